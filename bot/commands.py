@@ -1,14 +1,23 @@
+import asyncio
 import logging
+from collections import deque
 
 import discord
-from discord import TextStyle
+from discord import TextStyle, app_commands
 from discord.ext import commands
 
+from bot.ingest_queue import IngestJob, IngestQueue
 from bot.modals import RegistrationModal
 from services import crud
 from services.dependencies import get_db
+from services.mapping_index import mapping_index
+from services.mmr_algorithm import get_effective_mmrs
+from services.seasons import end_season, start_season
+from services.synergy import get_synergy_matrix
 from services.models import Player
-from services.team_balancer import balance_teams
+from services.rotation import rotation_queue
+from services.team_balancer import RECENT_SPLITS, SplitConstraints, balance_lobbies, balance_team_options
+from utils.demo_io import is_demo_file
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +31,20 @@ bot = commands.Bot(command_prefix='!', intents=intents)
 
 team_assignments = {}
 
+# Teams recently moved into their channels by /start, per guild
+recent_team_assignments = {}
+
+# Lobbies balanced by /lobbies, for /startlobbies, per guild
+lobby_assignments = {}
+
+ingest_queue = IngestQueue()
+
+# Number of matches shown by !history
+HISTORY_LENGTH = 15
+
+# Number of players shown by !leaderboard
+LEADERBOARD_LENGTH = 10
+
 @bot.command(name='mmr', help='Displays the MMR and stats for a player.')
 async def mmr(ctx, *, username: str):
     """
@@ -34,7 +57,7 @@ async def mmr(ctx, *, username: str):
                 await ctx.send(f"Player '{username}' not found.")
                 return
 
-            mmr = player.mmr
+            mmr = get_effective_mmrs(db, [player.id])[player.id]
             role = player.role or 'N/A'
             await ctx.send(f"Player **{player.username}**:\nMMR: **{mmr}**\nRole: **{role}**")
         except Exception as e:
@@ -79,16 +102,150 @@ async def stats(ctx, user: discord.Member = None):
             stats_embed.add_field(name="Total Assists", value=total_assists, inline=True)
             stats_embed.add_field(name="K/D Ratio", value=f"{kd_ratio:.2f}", inline=False)
 
+            season = crud.get_active_season(db)
+            summary = crud.get_season_summary(db, season_id=season.id, player_id=player_id) if season else None
+            if summary:
+                season_kd = summary.kills / summary.deaths if summary.deaths > 0 else summary.kills
+                stats_embed.add_field(
+                    name=f"Season {season.name}",
+                    value=(
+                        f"Matches: {summary.matches} ({summary.wins} won)\n"
+                        f"K/D/A: {summary.kills}/{summary.deaths}/{summary.assists} ({season_kd:.2f})\n"
+                        f"MMR change: {summary.mmr_change:+d}"
+                    ),
+                    inline=False
+                )
+
             await ctx.send(embed=stats_embed)
         except Exception as e:
             await ctx.send(f"❌ An error occurred while fetching stats for '{user.display_name}'.")
             logger.error(f"Error in !stats command: {e}", exc_info=True)
 
 
+@bot.command(name='history', help='Shows the MMR of a player over their last matches.')
+async def history(ctx, user: discord.Member = None):
+    """
+    Show a player's MMR after each of their last HISTORY_LENGTH matches.
+    If no user is provided, it will show the history of the command caller.
+    """
+    with get_db() as db:
+        try:
+            if user is None:
+                user = ctx.author
+
+            player = crud.get_player_by_discord_id(db, discord_id=str(user.id))
+            if not player:
+                await ctx.send(f"❌ Player '{user.display_name}' is not registered.")
+                return
+
+            rows = crud.get_mmr_history(db, player_id=player.id, limit=HISTORY_LENGTH)
+            if not rows:
+                await ctx.send(f"No rated matches for **{player.username}** yet.")
+                return
+
+            lines = [
+                f"`{date_time:%Y-%m-%d}` **{mmr_after}** ({delta:+d})"
+                for date_time, delta, mmr_after in rows
+            ]
+            history_embed = discord.Embed(
+                title=f"MMR history for {player.username}",
+                description='\n'.join(lines),
+                color=discord.Color.blue()
+            )
+            await ctx.send(embed=history_embed)
+        except Exception as e:
+            await ctx.send(f"❌ An error occurred while fetching the MMR history for '{user.display_name}'.")
+            logger.error(f"Error in !history command: {e}", exc_info=True)
+
+
+@bot.command(name='duo', help='Shows how two players do together and against each other.')
+async def duo(ctx, user: discord.Member, other: discord.Member = None):
+    """
+    Show the record of two players on the same team and against each other.
+    If only one user is provided, they are compared with the command caller.
+    """
+    with get_db() as db:
+        try:
+            if other is None:
+                user, other = ctx.author, user
+
+            players = crud.get_players_by_discord_ids(db, [str(user.id), str(other.id)])
+            for member in (user, other):
+                if str(member.id) not in players:
+                    await ctx.send(f"❌ Player '{member.display_name}' is not registered.")
+                    return
+            player_a, player_b = players[str(user.id)], players[str(other.id)]
+
+            synergy_matrix = get_synergy_matrix(db)
+            synergy_matrix.refresh()
+            record = synergy_matrix.duo(player_a.id, player_b.id)
+
+            together = record['together']
+            win_rate = f" ({record['wins_together'] / together:.0%})" if together else ""
+            duo_embed = discord.Embed(
+                title=f"{player_a.username} & {player_b.username}",
+                color=discord.Color.blue()
+            )
+            duo_embed.add_field(
+                name="Together",
+                value=f"{record['wins_together']} wins in {together} matches{win_rate}",
+                inline=False
+            )
+            duo_embed.add_field(
+                name="Against each other",
+                value=(
+                    f"{player_a.username} {record['wins_a']} - {record['wins_b']} {player_b.username} "
+                    f"in {record['against']} matches"
+                ),
+                inline=False
+            )
+            await ctx.send(embed=duo_embed)
+        except Exception as e:
+            await ctx.send("❌ An error occurred while fetching the duo stats.")
+            logger.error(f"Error in !duo command: {e}", exc_info=True)
+
+
+@bot.command(name='leaderboard', help='Shows the players with the highest MMR gain in a season.')
+async def leaderboard(ctx, *, season_name: str = None):
+    """
+    Show the top players of a season by MMR change. Without a season name the active season is shown.
+    """
+    with get_db() as db:
+        try:
+            if season_name:
+                season = crud.get_season_by_name(db, name=season_name)
+            else:
+                season = crud.get_active_season(db)
+            if not season:
+                await ctx.send(f"❌ Season '{season_name}' not found." if season_name else "❌ No season is active.")
+                return
+
+            rows = crud.get_season_leaderboard(db, season_id=season.id, limit=LEADERBOARD_LENGTH)
+            if not rows:
+                await ctx.send(f"No matches played in season **{season.name}** yet.")
+                return
+
+            lines = [
+                f"{rank}. **{player.username}** {summary.mmr_change:+d} ({summary.wins}/{summary.matches} won)"
+                for rank, (summary, player) in enumerate(rows, 1)
+            ]
+            leaderboard_embed = discord.Embed(
+                title=f"Season {season.name} leaderboard",
+                description='\n'.join(lines),
+                color=discord.Color.gold()
+            )
+            await ctx.send(embed=leaderboard_embed)
+        except Exception as e:
+            await ctx.send("❌ An error occurred while fetching the leaderboard.")
+            logger.error(f"Error in !leaderboard command: {e}", exc_info=True)
+
+
 @bot.tree.command(name='balance', description='Triggers team balancing and posts team assignments.')
 async def balance(interaction: discord.Interaction):
     with get_db() as db:
         try:
+            # Roles and core flags come from mapping.json, pick up any edits before balancing
+            mapping_index.refresh_and_sync(db)
 
             if interaction.user.voice.channel:
                 voice_channel = interaction.user.voice.channel
@@ -137,35 +294,140 @@ async def balance(interaction: discord.Interaction):
                     await interaction.response.send_message(f"Member '<@{member.id}>' is not registered, please use !register")
                     return
 
-            team_a, team_b, mmr = balance_teams(player_ids, db)
-
-            # Store the team assignments
             guild_id = interaction.guild.id
-            team_assignments[guild_id] = {'team_a': team_a, 'team_b': team_b}
+            result = balance_team_options(
+                player_ids, db, constraints=mapping_constraints(), recent=recent_team_assignments.get(guild_id, ()),
+                rotation=rotation_queue,
+            )
+            options = result['options']
+            team_a, team_b, mmr = options[0]
+
+            # Store the team assignments, and the other options for /reroll
+            team_assignments[guild_id] = {
+                'team_a': team_a, 'team_b': team_b, 'options': options, 'option': 0, 'started': False
+            }
+
+            embed = teams_embed(team_a, team_b, mmr)
+            if result['sitting_out']:
+                add_queue_field(embed, result['queue'])
+            await interaction.response.send_message(embed=embed)
+        except ValueError as e:
+            await interaction.response.send_message(f"❌ {e}")
+        except Exception as e:
+            await interaction.response.send_message("An error occurred while balancing teams.")
+            logger.error(f"Error in !balance command: {e}")
 
 
-            team_a = [f"<@{player}>" for player in team_a]
-            team_b = [f"<@{player}>" for player in team_b]
+@bot.tree.command(name='reroll', description='Shows the next best team assignment for the same players.')
+async def reroll(interaction: discord.Interaction):
+    try:
+        teams = team_assignments.get(interaction.guild.id)
+        if not teams:
+            await interaction.response.send_message("Teams have not been balanced yet. Use `/balance` first.")
+            return
+
+        # Served from the options ranked by /balance, wrapping around after the last one
+        teams['option'] = (teams['option'] + 1) % len(teams['options'])
+        teams['team_a'], teams['team_b'], mmr = teams['options'][teams['option']]
+
+        await interaction.response.send_message(embed=teams_embed(
+            teams['team_a'], teams['team_b'], mmr,
+            title=f"Teams (option {teams['option'] + 1} of {len(teams['options'])})"
+        ))
+    except Exception as e:
+        await interaction.response.send_message("An error occurred while rerolling teams.")
+        logger.error(f"Error in /reroll command: {e}")
+
+
+def teams_embed(team_a: list, team_b: list, mmr_diff: int, title: str = "Teams") -> discord.Embed:
+    team_a_str = '\n'.join([f"- <@{player}>" for player in team_a])
+    team_b_str = '\n'.join([f"- <@{player}>" for player in team_b])
+    return discord.Embed(
+        title=title,
+        description=(
+            f"**Team 🅰 :**\n"
+            f" {team_a_str}\n"
+            f"**Team 🅱️ :**\n"
+            f"{team_b_str}\n"
+            f"**MMR difference:** {mmr_diff}\n"
+        ),
+        color=discord.Color.green()
+    )
+
+
+def add_queue_field(embed: discord.Embed, queue: list) -> None:
+    """
+    Show the rotation queue, the players sitting out being first in it.
+    """
+    embed.add_field(
+        name="Up next",
+        value='\n'.join(f"{position}. <@{player}>" for position, player in enumerate(queue, 1)),
+        inline=False
+    )
 
-            team_a_str = '\n'.join([f"- {player}" for player in team_a])
-            team_b_str = '\n'.join([f"- {player}" for player in team_b])
-            mmr_diff = mmr
 
-            teams_embed = discord.Embed(
-                title="Teams",
+@bot.tree.command(name='lobbies', description='Splits everyone in voice into balanced 5v5 lobbies.')
+async def lobbies(interaction: discord.Interaction):
+    # The lobby search runs for up to LOBBY_TIME_BUDGET, longer than Discord waits for a response
+    await interaction.response.defer()
+    with get_db() as db:
+        try:
+            mapping_index.refresh_and_sync(db)
+
+            if not interaction.user.voice or not interaction.user.voice.channel:
+                await interaction.followup.send("You are not connected to a voice channel.")
+                return
+            voice_members = interaction.user.voice.channel.members
+
+            players = crud.get_players_by_discord_ids(db, [str(member.id) for member in voice_members])
+            unregistered = [member for member in voice_members if str(member.id) not in players]
+            if unregistered:
+                mentions = ', '.join(f"<@{member.id}>" for member in unregistered)
+                await interaction.followup.send(f"{mentions} not registered, please use /register")
+                return
+
+            # Keep the search off the event loop
+            result = await asyncio.to_thread(
+                balance_lobbies, [str(member.id) for member in voice_members], db, rotation=rotation_queue,
+                constraints=mapping_constraints(),
+            )
+            lobby_assignments[interaction.guild.id] = {'lobbies': result['lobbies'], 'started': False}
+
+            lobbies_embed = discord.Embed(
+                title=f"{len(result['lobbies'])} lobbies",
                 description=(
-                    f"**Team 🅰 :**\n"
-                    f" {team_a_str}\n"
-                    f"**Team 🅱️ :**\n"
-                    f"{team_b_str}\n"
-                    f"**MMR difference:** {mmr_diff}\n"
+                    f"Lobby MMR totals differ by at most **{result['lobby_spread']}** "
+                    f"(best possible: {result['lobby_spread_bound']} or more)"
                 ),
                 color=discord.Color.green()
             )
-            await interaction.response.send_message(embed=teams_embed)
+            for number, lobby in enumerate(result['lobbies'], 1):
+                team_a_str = '\n'.join(f"- <@{player}>" for player in lobby['team_a'])
+                team_b_str = '\n'.join(f"- <@{player}>" for player in lobby['team_b'])
+                lobbies_embed.add_field(
+                    name=f"Lobby {number} (avg MMR {lobby['mmr_average']:.0f}, difference {lobby['mmr_diff']})",
+                    value=f"**Team 🅰 :**\n{team_a_str}\n**Team 🅱️ :**\n{team_b_str}",
+                    inline=True
+                )
+            if result['sitting_out']:
+                add_queue_field(lobbies_embed, result['queue'])
+            await interaction.followup.send(embed=lobbies_embed)
+        except ValueError as e:
+            await interaction.followup.send(f"❌ {e}")
         except Exception as e:
-            await interaction.response.send_message("An error occurred while balancing teams.")
-            logger.error(f"Error in !balance command: {e}")
+            await interaction.followup.send("An error occurred while balancing lobbies.")
+            logger.error(f"Error in /lobbies command: {e}")
+
+
+def mapping_constraints() -> SplitConstraints:
+    """
+    The role quotas, conflicts and premades of mapping.json, as /balance and /lobbies apply them.
+    """
+    return SplitConstraints(
+        role_quotas=mapping_index.role_quotas,
+        conflicts=mapping_index.conflicts,
+        premades=mapping_index.premades,
+    )
 
 
 @bot.tree.command(name='register', description='Register yourself by linking your SteamID.')
@@ -195,6 +457,85 @@ async def register(interaction: discord.Interaction):
         await interaction.response.send_modal(modal)
 
 
+@bot.tree.command(name='ingest', description='Ingest an uploaded demo and update MMR.')
+@app_commands.describe(demo='A .dem file, optionally compressed as .dem.gz, .dem.bz2 or .dem.zst')
+@app_commands.default_permissions(administrator=True)
+@app_commands.checks.has_permissions(administrator=True)
+async def ingest(interaction: discord.Interaction, demo: discord.Attachment):
+    """
+    Queue an uploaded demo for ingestion. Progress is reported in the channel.
+    """
+    try:
+        if not is_demo_file(demo.filename):
+            await interaction.response.send_message(
+                "❌ Please attach a `.dem`, `.dem.gz`, `.dem.bz2` or `.dem.zst` file.",
+                ephemeral=True
+            )
+            return
+
+        job = IngestJob(demo, interaction.channel, interaction.user.display_name)
+        ahead = await ingest_queue.submit(job)
+        queued = f"✅ Queued `{demo.filename}` for ingestion"
+        await interaction.response.send_message(
+            f"{queued}, {ahead} demo(s) ahead of it." if ahead else f"{queued}.",
+            ephemeral=True
+        )
+    except Exception as e:
+        await interaction.response.send_message("❌ An error occurred while queueing the demo.", ephemeral=True)
+        logger.error(f"Error in /ingest command: {e}")
+
+
+@ingest.error
+async def ingest_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    if isinstance(error, app_commands.MissingPermissions):
+        await interaction.response.send_message("❌ Only administrators can ingest demos.", ephemeral=True)
+    else:
+        logger.error(f"Unhandled error in /ingest command: {error}")
+
+
+@bot.tree.command(name='season_start', description='End the active season and start a new one.')
+@app_commands.describe(name='Name of the new season')
+@app_commands.default_permissions(administrator=True)
+@app_commands.checks.has_permissions(administrator=True)
+async def season_start(interaction: discord.Interaction, name: str):
+    with get_db() as db:
+        try:
+            previous = crud.get_active_season(db)
+            season = start_season(db, name)
+            ended = f" Season **{previous.name}** has ended." if previous else ""
+            await interaction.response.send_message(f"✅ Season **{season.name}** has started.{ended}")
+        except ValueError as e:
+            await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+        except Exception as e:
+            await interaction.response.send_message("❌ An error occurred while starting the season.", ephemeral=True)
+            logger.error(f"Error in /season_start command: {e}")
+
+
+@bot.tree.command(name='season_end', description='End the active season.')
+@app_commands.default_permissions(administrator=True)
+@app_commands.checks.has_permissions(administrator=True)
+async def season_end(interaction: discord.Interaction):
+    with get_db() as db:
+        try:
+            season = end_season(db)
+            if not season:
+                await interaction.response.send_message("❌ No season is active.", ephemeral=True)
+                return
+            await interaction.response.send_message(f"✅ Season **{season.name}** has ended.")
+        except Exception as e:
+            await interaction.response.send_message("❌ An error occurred while ending the season.", ephemeral=True)
+            logger.error(f"Error in /season_end command: {e}")
+
+
+@season_start.error
+@season_end.error
+async def season_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    if isinstance(error, app_commands.MissingPermissions):
+        await interaction.response.send_message("❌ Only administrators can manage seasons.", ephemeral=True)
+    else:
+        logger.error(f"Unhandled error in season command: {error}")
+
+
 @bot.event
 async def on_command_error(ctx, error):
     """
@@ -275,26 +616,16 @@ async def start(interaction: discord.Interaction):
         team_a_ids = teams['team_a']
         team_b_ids = teams['team_b']
 
-        # Get or create voice channels for Team A and Team B
-        team_a_channel = discord.utils.get(guild.voice_channels, name="team-1")
-        team_b_channel = discord.utils.get(guild.voice_channels, name="team-2")
-
-        # Create channels if they don't exist
-        if not team_a_channel:
-            team_a_channel = await guild.create_voice_channel("team-1")
-        if not team_b_channel:
-            team_b_channel = await guild.create_voice_channel("team-2")
-
-        # Move members to their respective channels
-        for member_id in team_a_ids:
-            member = guild.get_member(int(member_id))
-            if member and member.voice:
-                await member.move_to(team_a_channel)
+        # Starting the same balance again only moves the players, the game is counted once
+        if not teams.get('started'):
+            # /balance avoids repeating recently played teams
+            recent = recent_team_assignments.setdefault(guild_id, deque(maxlen=RECENT_SPLITS))
+            recent.append((team_a_ids, team_b_ids))
+            record_game(team_a_ids + team_b_ids)
+            teams['started'] = True
 
-        for member_id in team_b_ids:
-            member = guild.get_member(int(member_id))
-            if member and member.voice:
-                await member.move_to(team_b_channel)
+        await move_to_channel(guild, team_a_ids, "team-1")
+        await move_to_channel(guild, team_b_ids, "team-2")
 
         await interaction.response.send_message("Players have been moved to their team voice channels.")
     except Exception as e:
@@ -302,9 +633,57 @@ async def start(interaction: discord.Interaction):
         logger.error(f"Error in /start command: {e}")
 
 
+@bot.tree.command(name='startlobbies', description='Moves players into the voice channels of their lobby teams.')
+async def start_lobbies(interaction: discord.Interaction):
+    try:
+        guild = interaction.guild
+        lobbies = lobby_assignments.get(guild.id)
+        if not lobbies:
+            await interaction.response.send_message("Lobbies have not been balanced yet. Use `/lobbies` first.")
+            return
+
+        # Starting the same lobbies again only moves the players, the games are counted once
+        if not lobbies['started']:
+            record_game([player for lobby in lobbies['lobbies'] for player in lobby['team_a'] + lobby['team_b']])
+            lobbies['started'] = True
+
+        for number, lobby in enumerate(lobbies['lobbies'], 1):
+            await move_to_channel(guild, lobby['team_a'], f"lobby-{number}-team-1")
+            await move_to_channel(guild, lobby['team_b'], f"lobby-{number}-team-2")
+
+        await interaction.response.send_message("Players have been moved to their lobby voice channels.")
+    except Exception as e:
+        await interaction.response.send_message("An error occurred while moving players.")
+        logger.error(f"Error in /startlobbies command: {e}")
+
+
+def record_game(player_ids: list) -> None:
+    """
+    Move the players of a started game, by Discord ID, to the back of the rotation queue.
+    """
+    with get_db() as db:
+        players = crud.get_players_by_discord_ids(db, player_ids)
+        rotation_queue.played(db, [player.id for player in players.values()])
+
+
+async def move_to_channel(guild: discord.Guild, member_ids: list, channel_name: str) -> None:
+    """
+    Move the members in voice to the named voice channel, creating it if it does not exist.
+    """
+    channel = discord.utils.get(guild.voice_channels, name=channel_name)
+    if not channel:
+        channel = await guild.create_voice_channel(channel_name)
+    for member_id in member_ids:
+        member = guild.get_member(int(member_id))
+        if member and member.voice:
+            await member.move_to(channel)
+
+
 @bot.event
 async def on_ready():
     # guild = discord.Object(id=819717610509041665) # dev
     guild = discord.Object(id=1274066274619490345)
     await bot.tree.sync(guild=guild)
+    with get_db() as db:
+        mapping_index.refresh_and_sync(db)
     print(f"Logged in as {bot.user}")
\ No newline at end of file
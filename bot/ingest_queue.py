@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+import discord
+
+from services.dependencies import get_db
+from services.mapping_index import mapping_index
+from services.mmr_algorithm import update_ratings
+from utils.demo_cache import DemoCache, demo_content_hash
+from utils.demo_parser import DEFAULT_CACHE_DIR, extract_demo_data, is_demo_processed, save_demo_data, setup_logging
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Minimum number of seconds between two progress edits of the status message
+PROGRESS_INTERVAL = 3.0
+
+
+class IngestJob:
+    """
+    A demo attachment waiting to be ingested, and the channel message its progress is reported in.
+    """
+
+    def __init__(self, attachment: discord.Attachment, channel: discord.abc.Messageable, requested_by: str):
+        self.attachment = attachment
+        self.channel = channel
+        self.requested_by = requested_by
+        self.status_message = None
+        self._last_report = 0.0
+
+    async def report(self, text: str, force: bool = True):
+        """
+        Show the job's progress in its status message. Unforced reports are rate limited.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_report < PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+        content = f"📼 `{self.attachment.filename}` ({self.requested_by}): {text}"
+        try:
+            if self.status_message is None:
+                self.status_message = await self.channel.send(content)
+            else:
+                await self.status_message.edit(content=content)
+        except discord.HTTPException as e:
+            logger.warning(f"Failed to report ingest progress: {e}")
+
+
+class IngestQueue:
+    """
+    Ingest uploaded demos one at a time without blocking the event loop.
+
+    Downloads are streamed to disk in chunks, DemoParser runs in a process pool, and the
+    database write and rating update run in a worker thread with their own session.
+    """
+
+    def __init__(self, workers: int = 1, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.workers = workers
+        self.cache = DemoCache(cache_dir) if cache_dir else None
+        self.queue = asyncio.Queue()
+        self._executor = None
+        self._task = None
+
+    def __len__(self):
+        return self.queue.qsize()
+
+    async def submit(self, job: IngestJob) -> int:
+        """
+        Queue a job, starting the queue's worker task if needed.
+
+        Returns:
+            int: The number of jobs ahead of this one.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        ahead = self.queue.qsize()
+        await self.queue.put(job)
+        return ahead
+
+    async def _run(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._process(job)
+            except Exception as e:
+                logger.error(f"Failed to ingest uploaded demo {job.attachment.filename}: {e}", exc_info=True)
+                await job.report(f"❌ Failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _process(self, job: IngestJob):
+        download_dir = await asyncio.to_thread(tempfile.mkdtemp, prefix='cs2-bot-upload-')
+        try:
+            # Keep the original file name, the match date is read from it
+            demo_file_path = os.path.join(download_dir, os.path.basename(job.attachment.filename))
+            await self._download(job, demo_file_path)
+
+            await job.report("Checking for duplicates…")
+            content_hash = await asyncio.to_thread(demo_content_hash, demo_file_path)
+            if await asyncio.to_thread(self._is_processed, demo_file_path, content_hash):
+                await job.report("⏭️ Already ingested, skipped.")
+                return
+
+            await job.report("Parsing…")
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=setup_logging)
+            loop = asyncio.get_running_loop()
+            demo_data = await loop.run_in_executor(
+                self._executor, extract_demo_data, demo_file_path, content_hash, self.cache
+            )
+            if demo_data is None:
+                await job.report("❌ No rounds found in the demo.")
+                return
+
+            await job.report("Saving and updating MMR…")
+            summary = await asyncio.to_thread(self._save, demo_data)
+            await job.report(f"✅ Ingested {summary}.")
+        finally:
+            await asyncio.to_thread(shutil.rmtree, download_dir, True)
+
+    async def _download(self, job: IngestJob, demo_file_path: str):
+        """
+        Stream the attachment to disk chunk by chunk, writing each chunk from a worker thread.
+        """
+        total = job.attachment.size
+        received = 0
+        await job.report("Downloading…")
+        demo_file = await asyncio.to_thread(open, demo_file_path, 'wb')
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(job.attachment.url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        await asyncio.to_thread(demo_file.write, chunk)
+                        received += len(chunk)
+                        if total:
+                            await job.report(f"Downloading… {received * 100 // total}%", force=False)
+        finally:
+            await asyncio.to_thread(demo_file.close)
+
+    @staticmethod
+    def _is_processed(demo_file_path, content_hash) -> bool:
+        with get_db() as db:
+            return is_demo_processed(demo_file_path, content_hash, db)
+
+    @staticmethod
+    def _save(demo_data) -> str:
+        with get_db() as db:
+            try:
+                mapping_index.refresh_and_sync(db)
+                match = save_demo_data(demo_data, mapping_index, db)
+                update_ratings(db)
+            except Exception:
+                db.rollback()
+                raise
+            return f"{match.map_name} {match.team1_score}:{match.team2_score}"
@@ -5,6 +5,7 @@ from discord import TextStyle
 
 from services import crud
 from services.dependencies import get_db
+from services.mapping_index import mapping_index
 from services.models import Player
 
 logger = logging.getLogger(__name__)
@@ -58,12 +59,14 @@ class RegistrationModal(discord.ui.Modal, title="Register Your SteamID"):
                         logger.info(f"Linked Discord ID {user.id} to existing player '{updated_player.username}'.")
                         return
 
-                # Create a new player entry
+                # Create a new player entry, with the role and core flag mapping.json gives them
+                mapping_index.refresh()
                 player_data = Player(
                     steamid=steamid,
                     username=user.display_name,
                     mmr=1000,
-                    role=None,
+                    role=mapping_index.role(steamid),
+                    core_member=mapping_index.is_core(steamid),
                     discord_id=str(user.id),
                     discord_name=user.display_name
                 )
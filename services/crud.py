@@ -1,8 +1,13 @@
 from typing import List, Type
 
+from sqlalchemy import case, func, insert, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session, Query
 
-from services.models import Match, PlayerMatchStats, Player
+from services.models import (
+    Match, PlayerMatchStats, Player, RatingState, MmrHistory, MmrCheckpoint, PlayerRatingDecay, Season,
+    SeasonPlayerSummary, RotationEntry,
+)
 
 
 def get_player(db: Session, player_id: int) -> Type[Player]:
@@ -19,6 +24,7 @@ def create_player(db: Session, player: Player) -> Player:
         username=player.username,
         mmr=player.mmr,
         role=player.role,
+        core_member=player.core_member,
         discord_id=player.discord_id,
         discord_name=player.discord_name
     )
@@ -48,6 +54,40 @@ def update_player_mmr(db: Session, player_id: int, mmr: float) -> Type[Player]:
     return db_player
 
 
+def get_player_ids(db: Session) -> list[int]:
+    return [player_id for (player_id,) in db.query(Player.id)]
+
+
+def get_player_mmrs(db: Session, player_ids: List[int] = None) -> dict:
+    """
+    Retrieve the MMR of the given players, or of all players, with a single query, as a player id to MMR dict.
+    """
+    query = db.query(Player.id, Player.mmr)
+    if player_ids is not None:
+        query = query.filter(Player.id.in_(player_ids))
+    return dict(query.all())
+
+
+def get_player_roles(db: Session) -> dict:
+    """
+    Retrieve the role of every player with a single query, as a player id to role dict.
+    """
+    return dict(db.query(Player.id, Player.role).all())
+
+
+def get_match_counts(db: Session, player_ids: List[int]) -> dict:
+    """
+    Count the matches played by each of the given players with a single query, as a player id to
+    count dict. Players without matches are left out.
+    """
+    return dict(
+        db.query(PlayerMatchStats.player_id, func.count(PlayerMatchStats.id))
+        .filter(PlayerMatchStats.player_id.in_(player_ids))
+        .group_by(PlayerMatchStats.player_id)
+        .all()
+    )
+
+
 def get_players(db: Session, skip: int = 0, limit: int = 100) -> list[Type[Player]]:
     return db.query(Player).offset(skip).limit(limit).all()
 
@@ -106,3 +146,378 @@ def get_player_by_username(db: Session, username: str) -> Type[Player]:
 
 def get_player_by_discord_id(db: Session, discord_id) -> Type[Player]:
     return db.query(Player).filter(Player.discord_id == discord_id).first()
+
+
+def get_players_by_discord_ids(db: Session, discord_ids: List[str]) -> dict:
+    """
+    Retrieve the players with the given Discord IDs with a single query, as a Discord ID to player dict.
+    """
+    return {player.discord_id: player for player in db.query(Player).filter(Player.discord_id.in_(discord_ids))}
+
+
+def get_matches_after(db: Session, match_id: int) -> list[Type[Match]]:
+    """
+    Retrieve the matches with an id greater than match_id, in id order.
+    """
+    return db.query(Match).filter(Match.id > match_id).order_by(Match.id).all()
+
+
+def get_last_match_id(db: Session):
+    return db.query(func.max(Match.id)).scalar()
+
+
+def get_rating_state(db: Session) -> RatingState:
+    """
+    Retrieve the rating state row, creating it if it does not exist yet.
+    """
+    state = db.query(RatingState).first()
+    if not state:
+        state = RatingState()
+        db.add(state)
+        db.flush()
+    return state
+
+
+def _matches_after(after_date, after_match_id: int):
+    """
+    Filter for the matches after a position in chronological (date, id) order. Without a date
+    the position is only an id, as the rating state has before any match was applied.
+    """
+    if after_date is None:
+        return Match.id > after_match_id
+    return tuple_(Match.date_time, Match.id) > tuple_(after_date, after_match_id)
+
+
+def count_matches_up_to(db: Session, match_id: int) -> int:
+    """
+    Count the matches with an id less than or equal to match_id.
+    """
+    return db.query(func.count(Match.id)).filter(Match.id <= match_id).scalar()
+
+
+def stream_match_stats(db: Session, after_date=None, after_match_id: int = 0, chunk_size: int = 1000) -> Query:
+    """
+    Stream the stat rows of all matches after the (after_date, after_match_id) position, joined
+    with the columns of their match, in chronological match order. Rows are fetched chunk_size at a time.
+    """
+    return (
+        db.query(
+            PlayerMatchStats.id,
+            PlayerMatchStats.match_id,
+            PlayerMatchStats.player_id,
+            PlayerMatchStats.team,
+            PlayerMatchStats.kills_total,
+            PlayerMatchStats.deaths_total,
+            PlayerMatchStats.assists_total,
+            PlayerMatchStats.damage_total,
+            PlayerMatchStats.rounds_won,
+            Match.date_time,
+            Match.winner,
+            Match.team1_score,
+            Match.team2_score,
+        )
+        .join(Match, PlayerMatchStats.match_id == Match.id)
+        .filter(_matches_after(after_date, after_match_id))
+        .order_by(Match.date_time, Match.id, PlayerMatchStats.id)
+        .yield_per(chunk_size)
+    )
+
+
+def get_mmr_history(db: Session, player_id: int, limit: int = None) -> list:
+    """
+    Retrieve a player's MMR history as (match date, delta, MMR after) rows, most recent last.
+    With a limit only the last limit rows are returned.
+    """
+    query = (
+        db.query(Match.date_time, MmrHistory.delta, MmrHistory.mmr_after)
+        .join(Match, MmrHistory.match_id == Match.id)
+        .filter(MmrHistory.player_id == player_id)
+        .order_by(Match.date_time.desc(), Match.id.desc())
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()[::-1]
+
+
+def get_mmr_after(db: Session, player_id: int, when) -> int | None:
+    """
+    Retrieve a player's MMR after their last match played at or before when, or None if they
+    had not played yet.
+    """
+    return (
+        db.query(MmrHistory.mmr_after)
+        .join(Match, MmrHistory.match_id == Match.id)
+        .filter(MmrHistory.player_id == player_id, Match.date_time <= when)
+        .order_by(Match.date_time.desc(), Match.id.desc())
+        .limit(1)
+        .scalar()
+    )
+
+
+def sum_mmr_deltas(db: Session, after_date, after_match_id: int, until) -> dict:
+    """
+    Sum the MMR deltas per player over the matches after the (after_date, after_match_id)
+    position played at or before until.
+    """
+    return dict(
+        db.query(MmrHistory.player_id, func.sum(MmrHistory.delta))
+        .join(Match, MmrHistory.match_id == Match.id)
+        .filter(_matches_after(after_date, after_match_id), Match.date_time <= until)
+        .group_by(MmrHistory.player_id)
+        .all()
+    )
+
+
+def get_latest_checkpoint(db: Session, before: tuple = None, until=None):
+    """
+    Retrieve the (match id, match date, match count) of the latest MMR checkpoint, or None.
+
+    Args:
+        before: Only consider checkpoints taken before this (match date, match id) position.
+        until: Only consider checkpoints taken after a match played at or before this date.
+    """
+    query = (
+        db.query(MmrCheckpoint.match_id, Match.date_time, MmrCheckpoint.match_count)
+        .join(Match, MmrCheckpoint.match_id == Match.id)
+    )
+    if before is not None:
+        query = query.filter(tuple_(Match.date_time, Match.id) < tuple_(*before))
+    if until is not None:
+        query = query.filter(Match.date_time <= until)
+    return query.order_by(Match.date_time.desc(), Match.id.desc()).first()
+
+
+def has_mmr_history(db: Session) -> bool:
+    return db.query(MmrHistory.id).first() is not None
+
+
+def get_checkpoint_mmrs(db: Session, match_id: int) -> dict:
+    """
+    Retrieve the MMR of every player stored in the checkpoint taken after match_id.
+    """
+    return dict(db.query(MmrCheckpoint.player_id, MmrCheckpoint.mmr).filter(MmrCheckpoint.match_id == match_id).all())
+
+
+def delete_mmr_history_after(db: Session, after_date=None, after_match_id: int = 0) -> None:
+    """
+    Delete the MMR history and checkpoints of the matches after the (after_date, after_match_id) position.
+    """
+    match_ids = db.query(Match.id).filter(_matches_after(after_date, after_match_id)).scalar_subquery()
+    for model in (MmrHistory, MmrCheckpoint):
+        db.query(model).filter(model.match_id.in_(match_ids)).delete(synchronize_session=False)
+
+
+def stream_mmr_history_until(db: Session, match_date, match_id: int) -> Query:
+    """
+    Stream the (player id, match date, delta) MMR history rows up to and including the match at
+    the (match_date, match_id) position, in chronological order.
+    """
+    return (
+        db.query(MmrHistory.player_id, Match.date_time, MmrHistory.delta)
+        .join(Match, MmrHistory.match_id == Match.id)
+        .filter(tuple_(Match.date_time, Match.id) <= tuple_(match_date, match_id))
+        .order_by(Match.date_time, Match.id, MmrHistory.id)
+        .yield_per(1000)
+    )
+
+
+def stream_mmr_history_before(db: Session, when, player_ids: List[int] = None) -> Query:
+    """
+    Stream the (player id, match date, delta) MMR history rows of the matches played before when,
+    of the given players or of all players, in chronological order.
+    """
+    query = (
+        db.query(MmrHistory.player_id, Match.date_time, MmrHistory.delta)
+        .join(Match, MmrHistory.match_id == Match.id)
+        .filter(Match.date_time < when)
+    )
+    if player_ids is not None:
+        query = query.filter(MmrHistory.player_id.in_(player_ids))
+    return query.order_by(Match.date_time, Match.id, MmrHistory.id).yield_per(1000)
+
+
+def get_rating_decays(db: Session, player_ids: List[int] = None) -> dict:
+    """
+    Retrieve the decayed MMR sum and its anchor date of the given players, or of all players,
+    as a player id to (decayed sum, anchor) dict.
+    """
+    query = db.query(PlayerRatingDecay.player_id, PlayerRatingDecay.decayed_sum, PlayerRatingDecay.anchor)
+    if player_ids is not None:
+        query = query.filter(PlayerRatingDecay.player_id.in_(player_ids))
+    return {player_id: (decayed_sum, anchor) for player_id, decayed_sum, anchor in query}
+
+
+def save_rating_decays(db: Session, decays: dict) -> None:
+    """
+    Insert or update the decayed MMR sum and anchor date of every player in decays.
+    """
+    if not decays:
+        return
+    statement = sqlite_insert(PlayerRatingDecay)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[PlayerRatingDecay.player_id],
+            set_={'decayed_sum': statement.excluded.decayed_sum, 'anchor': statement.excluded.anchor},
+        ),
+        [
+            {'player_id': player_id, 'decayed_sum': decayed_sum, 'anchor': anchor}
+            for player_id, (decayed_sum, anchor) in decays.items()
+        ]
+    )
+
+
+def delete_rating_decays(db: Session) -> None:
+    db.query(PlayerRatingDecay).delete(synchronize_session=False)
+
+
+def get_seasons(db: Session) -> list[Type[Season]]:
+    """
+    Retrieve all seasons, in start order.
+    """
+    return db.query(Season).order_by(Season.start_date).all()
+
+
+def get_active_season(db: Session) -> Type[Season]:
+    """
+    Retrieve the season that has not ended yet, or None.
+    """
+    return db.query(Season).filter(Season.end_date.is_(None)).order_by(Season.start_date.desc()).first()
+
+
+def get_season_by_name(db: Session, name: str) -> Type[Season]:
+    return db.query(Season).filter(Season.name == name).first()
+
+
+def get_season_summary(db: Session, season_id: int, player_id: int) -> Type[SeasonPlayerSummary]:
+    return db.query(SeasonPlayerSummary).filter(
+        SeasonPlayerSummary.season_id == season_id, SeasonPlayerSummary.player_id == player_id
+    ).first()
+
+
+def get_season_leaderboard(db: Session, season_id: int, limit: int = 10) -> list:
+    """
+    Retrieve the (summary, player) pairs of a season with the highest MMR change.
+    """
+    return (
+        db.query(SeasonPlayerSummary, Player)
+        .join(Player, SeasonPlayerSummary.player_id == Player.id)
+        .filter(SeasonPlayerSummary.season_id == season_id)
+        .order_by(SeasonPlayerSummary.mmr_change.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+SEASON_TOTAL_COLUMNS = ('matches', 'wins', 'kills', 'deaths', 'assists', 'damage', 'mmr_change')
+
+
+def add_season_summaries(db: Session, totals: dict) -> None:
+    """
+    Add (season id, player id) to SEASON_TOTAL_COLUMNS totals to the season summaries,
+    creating the missing rows, in one statement.
+    """
+    if not totals:
+        return
+    statement = sqlite_insert(SeasonPlayerSummary)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[SeasonPlayerSummary.season_id, SeasonPlayerSummary.player_id],
+            set_={
+                column: getattr(SeasonPlayerSummary, column) + getattr(statement.excluded, column)
+                for column in SEASON_TOTAL_COLUMNS
+            },
+        ),
+        [
+            {'season_id': season_id, 'player_id': player_id, **dict(zip(SEASON_TOTAL_COLUMNS, values))}
+            for (season_id, player_id), values in totals.items()
+        ]
+    )
+
+
+def sum_season_totals(db: Session, start_date, end_date=None) -> dict:
+    """
+    Aggregate the stats and MMR changes of the matches played from start_date until before
+    end_date, as a player id to SEASON_TOTAL_COLUMNS totals dict.
+    """
+    in_range = [Match.date_time >= start_date]
+    if end_date is not None:
+        in_range.append(Match.date_time < end_date)
+
+    won = case((func.lower(PlayerMatchStats.team) == func.lower(Match.winner), 1), else_=0)
+    stats = (
+        db.query(
+            PlayerMatchStats.player_id,
+            func.count(PlayerMatchStats.id),
+            func.sum(won),
+            func.sum(PlayerMatchStats.kills_total),
+            func.sum(PlayerMatchStats.deaths_total),
+            func.sum(PlayerMatchStats.assists_total),
+            func.sum(PlayerMatchStats.damage_total),
+        )
+        .join(Match, PlayerMatchStats.match_id == Match.id)
+        .filter(*in_range)
+        .group_by(PlayerMatchStats.player_id)
+    )
+    mmr_changes = dict(
+        db.query(MmrHistory.player_id, func.sum(MmrHistory.delta))
+        .join(Match, MmrHistory.match_id == Match.id)
+        .filter(*in_range)
+        .group_by(MmrHistory.player_id)
+        .all()
+    )
+    return {player_id: (*values, mmr_changes.get(player_id, 0)) for player_id, *values in stats}
+
+
+def replace_season_summaries(db: Session, season_id: int, totals: dict) -> None:
+    """
+    Replace the summaries of a season with player id to SEASON_TOTAL_COLUMNS totals, keeping
+    the final MMR recorded when the season ended.
+    """
+    final_mmrs = dict(
+        db.query(SeasonPlayerSummary.player_id, SeasonPlayerSummary.final_mmr)
+        .filter(SeasonPlayerSummary.season_id == season_id)
+        .all()
+    )
+    db.query(SeasonPlayerSummary).filter(SeasonPlayerSummary.season_id == season_id).delete(synchronize_session=False)
+    if totals:
+        db.execute(insert(SeasonPlayerSummary), [
+            {
+                'season_id': season_id,
+                'player_id': player_id,
+                'final_mmr': final_mmrs.get(player_id),
+                **dict(zip(SEASON_TOTAL_COLUMNS, values)),
+            }
+            for player_id, values in totals.items()
+        ])
+
+
+def get_rotation_entries(db: Session) -> list:
+    """
+    Retrieve the rotation queue as (player_id, games, position, updated_at) rows, in queue order.
+    """
+    return db.query(
+        RotationEntry.player_id, RotationEntry.games, RotationEntry.position, RotationEntry.updated_at
+    ).order_by(RotationEntry.games, RotationEntry.position).all()
+
+
+def save_rotation_entries(db: Session, entries: list) -> None:
+    """
+    Insert or update rotation queue entries, given as (player_id, games, position, updated_at) tuples.
+    """
+    if not entries:
+        return
+    statement = sqlite_insert(RotationEntry)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[RotationEntry.player_id],
+            set_={
+                'games': statement.excluded.games,
+                'position': statement.excluded.position,
+                'updated_at': statement.excluded.updated_at,
+            },
+        ),
+        [
+            {'player_id': player_id, 'games': games, 'position': position, 'updated_at': updated_at}
+            for player_id, games, position, updated_at in entries
+        ]
+    )
@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+
+from sqlalchemy.orm import Session
+
+from services.models import Player
+
+logger = logging.getLogger(__name__)
+
+MAPPING_PATH = "mapping.json"
+
+
+class MappingIndex:
+    """
+    Hash-based lookups over mapping.json: SteamID to Discord ID, SteamID to role, and
+    the set of core member SteamIDs.
+
+    The optional balancing constraints are read as they are: "role_quotas" maps a role to the
+    players of that role each team should get, "conflicts" lists pairs of SteamIDs that must
+    not play on the same team, and "premades" lists groups of SteamIDs that must.
+
+    The file is only read again when its modification time changes.
+    """
+
+    def __init__(self, path=MAPPING_PATH):
+        self.path = path
+        self.accounts = {}
+        self.roles = {}
+        self.core = frozenset()
+        self.role_quotas = {}
+        self.conflicts = []
+        self.premades = []
+        self._mtime = None
+
+    def refresh(self) -> bool:
+        """
+        Reload the mapping if the file changed since it was last read. A file that cannot be read
+        or parsed is logged and ignored until it changes again.
+
+        Returns:
+            bool: True if the mapping was reloaded.
+        """
+        if self.path is None:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            if self._mtime is None:
+                logger.warning(f"Mapping file {self.path} not found, using an empty mapping.")
+                self._mtime = 0
+            return False
+        if mtime == self._mtime:
+            return False
+
+        try:
+            with open(self.path, "r") as mapping_file:
+                mapping = json.load(mapping_file)
+        except (OSError, ValueError) as e:
+            # Keep the last good mapping rather than syncing everyone to an empty one
+            logger.warning(f"Could not load mapping file {self.path}, keeping the previous mapping: {e}")
+            self._mtime = mtime
+            return False
+        self.accounts = dict(mapping.get("accounts") or {})
+        self.roles = dict(mapping.get("roles") or {})
+        self.core = frozenset(mapping.get("core") or [])
+        self.role_quotas = dict(mapping.get("role_quotas") or {})
+        self.conflicts = [tuple(pair) for pair in mapping.get("conflicts") or []]
+        self.premades = [tuple(group) for group in mapping.get("premades") or []]
+        self._mtime = mtime
+        logger.info(
+            f"Loaded mapping from {self.path}: {len(self.accounts)} accounts, "
+            f"{len(self.roles)} roles, {len(self.core)} core members."
+        )
+        return True
+
+    def discord_id(self, steamid: str):
+        return self.accounts.get(steamid)
+
+    def role(self, steamid: str):
+        return self.roles.get(steamid)
+
+    def is_core(self, steamid: str) -> bool:
+        return steamid in self.core
+
+    def steamids(self) -> set:
+        """
+        The SteamIDs that appear anywhere in the accounts, roles or core members.
+        """
+        return set(self.accounts) | set(self.roles) | self.core
+
+    def sync_players(self, db: Session) -> int:
+        """
+        Write the mapped role and core flag to every player whose SteamID is in the mapping and
+        whose values differ, in a single batched update. Players missing from the mapping keep
+        their role and core flag.
+
+        Returns:
+            int: The number of players updated.
+        """
+        players = db.query(Player.id, Player.steamid, Player.role, Player.core_member).filter(
+            Player.steamid.isnot(None)
+        ).all()
+        mapped = self.steamids()
+        changes = []
+        for player_id, steamid, role, core_member in players:
+            if steamid not in mapped:
+                continue
+            mapped_role = self.role(steamid)
+            mapped_core = self.is_core(steamid)
+            if role != mapped_role or bool(core_member) != mapped_core:
+                changes.append({"id": player_id, "role": mapped_role, "core_member": mapped_core})
+
+        if changes:
+            db.bulk_update_mappings(Player, changes)
+            db.commit()
+            logger.info(f"Synced roles and core flags of {len(changes)} players from {self.path}.")
+        return len(changes)
+
+    def refresh_and_sync(self, db: Session) -> bool:
+        """
+        Reload the mapping if the file changed, and sync the players. Players are synced even when
+        the file did not change, so players added since, e.g. by /register, get their mapped role
+        and core flag; sync_players only writes the players whose values differ.
+
+        Returns:
+            bool: True if the mapping was reloaded.
+        """
+        reloaded = self.refresh()
+        self.sync_players(db)
+        return reloaded
+
+
+mapping_index = MappingIndex()
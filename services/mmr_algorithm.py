@@ -1,5 +1,39 @@
+import datetime
+import logging
+import os
+from itertools import islice
+
+import numpy as np
+from sqlalchemy import func, insert
 from sqlalchemy.orm import Session
-from services import models, crud
+from services import models, crud, seasons
+from services.synergy import get_synergy_matrix
+
+logger = logging.getLogger(__name__)
+
+# Rating parameters. Changing any of them makes update_ratings replay all matches.
+RATING_MODEL = 'hltv2'
+BASE_MMR = 1000
+RATING_SCALE = 20
+RESULT_BONUS = 5
+MAX_MMR_CHANGE = 50
+
+# Optional time decay, off by default: with a half-life, each match's MMR change counts half as
+# much every MMR_HALF_LIFE_DAYS days, so recent matches weigh more and the rating of a player who
+# stopped playing drifts back to BASE_MMR. Applied lazily by get_effective_mmrs.
+MMR_HALF_LIFE_DAYS = float(os.getenv('MMR_HALF_LIFE_DAYS')) if os.getenv('MMR_HALF_LIFE_DAYS') else None
+
+# Number of stat rows fetched per round trip, and rated per batch, when replaying matches
+REPLAY_CHUNK_SIZE = 10000
+
+# A snapshot of all ratings is stored every CHECKPOINT_INTERVAL matches, replays start from the nearest one
+CHECKPOINT_INTERVAL = 50
+
+# Columns calculate_mmr_changes_batch reads, as returned by crud.stream_match_stats
+STAT_COLUMNS = (
+    'id', 'match_id', 'player_id', 'team', 'kills_total', 'deaths_total', 'assists_total', 'damage_total',
+    'winner', 'team1_score', 'team2_score',
+)
 
 
 def calculate_mmr_change(player_stat: models.PlayerMatchStats, db: Session) -> int:
@@ -15,6 +49,16 @@ def calculate_mmr_change(player_stat: models.PlayerMatchStats, db: Session) -> i
     if not match:
         return 0
 
+    return mmr_change_for_match(player_stat, match)
+
+
+def mmr_change_for_match(player_stat, match) -> int:
+    """
+    Calculate the MMR change for a player's stats in a match, without any database access.
+
+    Only reads the team, kill/death/assist/damage totals of player_stat and the winner and
+    scores of match, so rows of a column query can be passed as well as ORM objects.
+    """
     # Determine team result
     player_team = player_stat.team.lower()  # 'terrorist' or 'counter_terrorist'
     match_winner = match.winner.lower()  # 'terrorist', 'counter_terrorist', or 'draw'
@@ -57,39 +101,352 @@ def calculate_mmr_change(player_stat: models.PlayerMatchStats, db: Session) -> i
     )
 
     # Adjust MMR based on Rating
-    mmr_change = (Rating - 1.0) * 20  # Scale the rating difference
+    mmr_change = (Rating - 1.0) * RATING_SCALE  # Scale the rating difference
 
     # Apply team result modifier
     if team_result == 'win':
-        mmr_change += 5
+        mmr_change += RESULT_BONUS
     elif team_result == 'loss':
-        mmr_change -= 5
+        mmr_change -= RESULT_BONUS
     # Draw results in no additional change
 
     # Ensure MMR change is within reasonable bounds
-    mmr_change = max(-50, min(mmr_change, 50))
+    mmr_change = max(-MAX_MMR_CHANGE, min(mmr_change, MAX_MMR_CHANGE))
 
     mmr_change = int(round(mmr_change))
     return mmr_change
 
 
+def calculate_mmr_changes_batch(columns) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate the MMR change of many player match stats at once, vectorized over columns.
+
+    Applies the same formula, in the same order of operations, as mmr_change_for_match, so every
+    change is identical to the one the scalar function returns for the same row.
+
+    Args:
+        columns: Mapping (a dict or a DataFrame) of the STAT_COLUMNS names to equally long
+            array-likes, one element per stat row.
+
+    Returns:
+        tuple: The stat ids and the MMR change of each of them, as integer arrays.
+    """
+    stat_ids, ratings, team_results, has_rounds = calculate_hltv_ratings_batch(columns)
+    changes = mmr_changes_from_ratings(ratings, team_results, has_rounds, RATING_SCALE, RESULT_BONUS, MAX_MMR_CHANGE)
+    return stat_ids, changes
+
+
+def calculate_hltv_ratings_batch(columns) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Calculate the HLTV 2.0 rating of many player match stats at once, the part of the MMR change
+    that does not depend on the rating parameters.
+
+    Returns:
+        tuple: The stat ids, the ratings, the team results (1 for a win, -1 for a loss and 0
+            for a draw) and whether the match had any rounds, as arrays aligned with the stat ids.
+    """
+    stat_ids = np.asarray(columns['id'], dtype=np.int64)
+    kills = np.asarray(columns['kills_total'], dtype=np.int64)
+    deaths = np.asarray(columns['deaths_total'], dtype=np.int64)
+    assists = np.asarray(columns['assists_total'], dtype=np.int64)
+    damage = np.asarray(columns['damage_total'], dtype=np.int64)
+    total_rounds = (
+        np.asarray(columns['team1_score'], dtype=np.int64) + np.asarray(columns['team2_score'], dtype=np.int64)
+    )
+    player_team = _lower(columns['team'])
+    match_winner = _lower(columns['winner'])
+
+    # Rows without rounds get no change; divide by 1 instead to avoid division by zero
+    has_rounds = total_rounds != 0
+    rounds = np.where(has_rounds, total_rounds, 1)
+
+    KPR = kills / rounds
+    DPR = deaths / rounds
+    APR = assists / rounds
+    ADR = damage / rounds
+    rounds_survived = rounds - deaths
+    KAST = ((kills + assists + rounds_survived) / rounds) * 100
+    Impact = 2.13 * KPR + 0.42 * APR - 0.41
+    Rating = (
+        0.0073 * KAST +
+        0.3591 * KPR -
+        0.5329 * DPR +
+        0.2372 * Impact +
+        0.0032 * ADR +
+        0.1587
+    )
+
+    is_draw = match_winner == 'draw'
+    team_results = np.where(is_draw, 0, np.where(player_team == match_winner, 1, -1)).astype(np.int8)
+    return stat_ids, Rating, team_results, has_rounds
+
+
+def mmr_changes_from_ratings(ratings, team_results, has_rounds, rating_scale, result_bonus, max_change) -> np.ndarray:
+    """
+    Turn HLTV 2.0 ratings into MMR changes with the given rating parameters.
+    """
+    mmr_change = (ratings - 1.0) * rating_scale
+    mmr_change = np.where(team_results == 1, mmr_change + result_bonus, mmr_change)
+    mmr_change = np.where(team_results == -1, mmr_change - result_bonus, mmr_change)
+
+    mmr_change = np.clip(mmr_change, -max_change, max_change)
+    # np.rint rounds halves to even, like the built-in round
+    return np.where(has_rounds, np.rint(mmr_change), 0).astype(np.int64)
+
+
+def _lower(values) -> np.ndarray:
+    # Only a handful of distinct team names exist, lowercase each of them once
+    lowered = {value: value.lower() for value in set(values)}
+    return np.array([lowered[value] for value in values], dtype=object)
+
+
 def recalculate_all_mmr(db: Session) -> None:
     """
-    Recalculate MMR for all players based on all matches.
+    Recalculate MMR for all players based on all matches, rebuilding the MMR history and checkpoints.
     """
-    # Reset all player MMRs to base value
-    players = crud.get_players(db)
-    for player in players:
-        player.mmr = 1000  # Base MMR
+    replay_from(db)
+
+
+def replay_from(db: Session, match: models.Match = None) -> None:
+    """
+    Replay the ratings of a match and of every match played after it, e.g. after correcting it.
+
+    Instead of starting from BASE_MMR, the replay starts from the nearest checkpoint before the
+    match, so its cost is bounded by CHECKPOINT_INTERVAL plus the number of later matches.
+    Without a match all matches are replayed.
+    """
+    ratings = {player_id: BASE_MMR for player_id in crud.get_player_ids(db)}
+    checkpoint = crud.get_latest_checkpoint(db, before=(match.date_time, match.id)) if match else None
+    if checkpoint:
+        after_match_id, after_date, match_count = checkpoint
+        ratings.update(crud.get_checkpoint_mmrs(db, match_id=after_match_id))
+    else:
+        after_match_id, after_date, match_count = 0, None, 0
+
+    decays = None
+    if MMR_HALF_LIFE_DAYS:
+        decays = _rebuild_decays(db, after_date, after_match_id) if checkpoint else {}
+        crud.delete_rating_decays(db)
+
+    crud.delete_mmr_history_after(db, after_date=after_date, after_match_id=after_match_id)
+    _replay(db, ratings, after_date, after_match_id, match_count, decays)
+
+    db.bulk_update_mappings(models.Player, [{'id': player_id, 'mmr': mmr} for player_id, mmr in ratings.items()])
+    if decays is not None:
+        crud.save_rating_decays(db, decays)
+    seasons.rebuild_season_summaries(db, since=after_date)
+    last_match_id, last_match_date = db.query(func.max(models.Match.id), func.max(models.Match.date_time)).one()
+    _set_rating_state(db, last_match_id or 0, last_match_date)
     db.commit()
 
-    # Get all matches
-    matches = crud.get_all_matches(db)
-    for match in matches:
-        match_stats = crud.get_match_stats(db, match_id=match.id)
-        for player_stat in match_stats:
-            mmr_change = calculate_mmr_change(player_stat, db)
-            player = crud.get_player(db, player_id=player_stat.player_id)
-            if player:
-                player.mmr += mmr_change
+
+def _replay(
+    db: Session, ratings: dict, after_date, after_match_id: int, match_count: int, decays: dict = None,
+    season_totals: seasons.SeasonTotals = None
+) -> set:
+    """
+    Apply the matches after the (after_date, after_match_id) position to ratings, in chronological
+    order. Writes the MMR history of every stat row, and a checkpoint of all ratings after every
+    CHECKPOINT_INTERVAL-th match, match_count being the number of matches applied before. Nothing is committed.
+
+    With decays, the decayed sums of the players are brought forward as well, and with
+    season_totals every row is added to the totals of its season.
+
+    Returns:
+        set: The ids of the players whose rating changed.
+    """
+    updated = set()
+    current_match_id = None
+
+    def finish_match():
+        nonlocal match_count
+        match_count += 1
+        if match_count % CHECKPOINT_INTERVAL == 0:
+            db.execute(insert(models.MmrCheckpoint), [
+                {'match_id': current_match_id, 'match_count': match_count, 'player_id': player_id, 'mmr': mmr}
+                for player_id, mmr in ratings.items()
+            ])
+
+    rows = iter(crud.stream_match_stats(
+        db, after_date=after_date, after_match_id=after_match_id, chunk_size=REPLAY_CHUNK_SIZE
+    ))
+    while chunk := list(islice(rows, REPLAY_CHUNK_SIZE)):
+        columns = dict(zip(chunk[0]._fields, zip(*chunk)))
+        _, changes = calculate_mmr_changes_batch(columns)
+        history = []
+        for row, delta in zip(chunk, changes.tolist()):
+            if row.match_id != current_match_id:
+                if current_match_id is not None:
+                    finish_match()
+                current_match_id = row.match_id
+            mmr = ratings.get(row.player_id, BASE_MMR) + delta
+            ratings[row.player_id] = mmr
+            updated.add(row.player_id)
+            if decays is not None:
+                decays[row.player_id] = _decay_step(decays.get(row.player_id), delta, row.date_time)
+            if season_totals is not None:
+                season_totals.add(row, delta)
+            history.append({'player_id': row.player_id, 'match_id': row.match_id, 'delta': delta, 'mmr_after': mmr})
+        db.execute(insert(models.MmrHistory), history)
+    if current_match_id is not None:
+        finish_match()
+    return updated
+
+
+def _decay_factor(elapsed: datetime.timedelta) -> float:
+    return 0.5 ** (max(elapsed.total_seconds(), 0) / (MMR_HALF_LIFE_DAYS * 86400))
+
+
+def _decay_step(decay: tuple, delta: int, date_time) -> tuple:
+    """
+    Decay a (decayed sum, anchor) pair forward to date_time and add a match's MMR change to it.
+    """
+    decayed_sum, anchor = decay or (0.0, date_time)
+    return decayed_sum * _decay_factor(date_time - anchor) + delta, date_time
+
+
+def _rebuild_decays(db: Session, match_date, match_id: int) -> dict:
+    """
+    Rebuild the decayed sums as they were after the match at the (match_date, match_id)
+    position from the MMR history, for a replay starting at a checkpoint.
+    """
+    decays = {}
+    for player_id, date_time, delta in crud.stream_mmr_history_until(db, match_date=match_date, match_id=match_id):
+        decays[player_id] = _decay_step(decays.get(player_id), delta, date_time)
+    return decays
+
+
+def get_effective_mmrs(db: Session, player_ids: list, now: datetime.datetime = None) -> dict:
+    """
+    Get the MMR of players to balance and display with, with time decay applied up to now
+    when MMR_HALF_LIFE_DAYS is set. Without decay this is the stored MMR.
+
+    Returns:
+        dict: Player id to MMR.
+    """
+    mmrs = crud.get_player_mmrs(db, player_ids=player_ids)
+    if not MMR_HALF_LIFE_DAYS:
+        return mmrs
+    now = now or datetime.datetime.now()
+    for player_id, (decayed_sum, anchor) in crud.get_rating_decays(db, player_ids=player_ids).items():
+        mmrs[player_id] = BASE_MMR + int(round(decayed_sum * _decay_factor(now - anchor)))
+    return mmrs
+
+
+def get_effective_mmrs_before(db: Session, player_ids: list, when: datetime.datetime) -> dict:
+    """
+    Get the MMR of players as get_effective_mmrs gave it at when, from the MMR history of the
+    matches played before when, so matches played since do not count.
+
+    Returns:
+        dict: Player id to MMR.
+    """
+    ratings = {player_id: BASE_MMR for player_id in player_ids}
+    decays = {}
+    for player_id, date_time, delta in crud.stream_mmr_history_before(db, when, player_ids=player_ids):
+        ratings[player_id] += delta
+        if MMR_HALF_LIFE_DAYS:
+            decays[player_id] = _decay_step(decays.get(player_id), delta, date_time)
+    for player_id, (decayed_sum, anchor) in decays.items():
+        ratings[player_id] = BASE_MMR + int(round(decayed_sum * _decay_factor(when - anchor)))
+    return ratings
+
+
+def get_mmr_as_of(db: Session, player_id: int, when) -> int:
+    """
+    Get a player's MMR as it was after the matches played at or before when.
+    """
+    mmr = crud.get_mmr_after(db, player_id=player_id, when=when)
+    return BASE_MMR if mmr is None else mmr
+
+
+def get_ratings_as_of(db: Session, when) -> dict:
+    """
+    Get the MMR of all players as it was after the matches played at or before when, starting
+    from the nearest checkpoint and adding the history deltas after it.
+
+    Returns:
+        dict: Player id to MMR.
+    """
+    ratings = {player_id: BASE_MMR for player_id in crud.get_player_ids(db)}
+    checkpoint = crud.get_latest_checkpoint(db, until=when)
+    if checkpoint:
+        after_match_id, after_date, _ = checkpoint
+        ratings.update(crud.get_checkpoint_mmrs(db, match_id=after_match_id))
+    else:
+        after_match_id, after_date = 0, None
+    for player_id, delta in crud.sum_mmr_deltas(db, after_date, after_match_id, until=when).items():
+        ratings[player_id] = ratings.get(player_id, BASE_MMR) + delta
+    return ratings
+
+
+def rating_params_version() -> str:
+    """
+    Identify the rating model and its parameters, to detect when stored ratings are stale.
+    """
+    version = f"{RATING_MODEL}:base={BASE_MMR},scale={RATING_SCALE},bonus={RESULT_BONUS},max={MAX_MMR_CHANGE}"
+    if MMR_HALF_LIFE_DAYS:
+        version += f",half_life={MMR_HALF_LIFE_DAYS:g}d"
+    return version
+
+
+def _set_rating_state(db: Session, last_match_id: int, last_match_date) -> None:
+    state = crud.get_rating_state(db)
+    state.params_version = rating_params_version()
+    state.last_match_id = last_match_id
+    state.last_match_date = last_match_date
+
+
+def update_ratings(db: Session) -> None:
+    """
+    Bring player MMR up to date with the matches in the database.
+
+    Matches added after the last applied match (the high-water mark) are applied
+    incrementally. Everything is replayed with recalculate_all_mmr instead when the rating
+    parameters changed since the ratings were computed, and the matches from the oldest new
+    one onward are replayed when a new match is dated before the last applied one.
+
+    The new matches are first counted in the player synergy of the session's database.
+    """
+    get_synergy_matrix(db).update(db)
+
+    state = crud.get_rating_state(db)
+    if state.params_version != rating_params_version():
+        logger.info(
+            f"Rating parameters changed from {state.params_version} to {rating_params_version()}, "
+            f"replaying all matches."
+        )
+        recalculate_all_mmr(db)
+        return
+    if state.last_match_id and not crud.has_mmr_history(db):
+        logger.info("No MMR history recorded yet, replaying all matches.")
+        recalculate_all_mmr(db)
+        return
+
+    new_matches = crud.get_matches_after(db, match_id=state.last_match_id or 0)
+    if not new_matches:
+        return
+
+    if state.last_match_date and any(match.date_time < state.last_match_date for match in new_matches):
+        oldest = min(new_matches, key=lambda match: (match.date_time, match.id))
+        logger.info(f"A match older than the last applied match was added, replaying from match {oldest.id}.")
+        replay_from(db, oldest)
+        return
+
+    ratings = crud.get_player_mmrs(db)
+    decays = crud.get_rating_decays(db) if MMR_HALF_LIFE_DAYS else None
+    match_count = crud.count_matches_up_to(db, match_id=state.last_match_id or 0)
+    season_totals = seasons.SeasonTotals(crud.get_seasons(db))
+    updated = _replay(
+        db, ratings, state.last_match_date, state.last_match_id or 0, match_count, decays, season_totals
+    )
+    db.bulk_update_mappings(models.Player, [{'id': player_id, 'mmr': ratings[player_id]} for player_id in updated])
+    season_totals.save(db)
+    if decays is not None:
+        crud.save_rating_decays(db, {player_id: decays[player_id] for player_id in updated})
+    last_match_date = max(match.date_time for match in new_matches)
+    if state.last_match_date:
+        last_match_date = max(last_match_date, state.last_match_date)
+    _set_rating_state(db, new_matches[-1].id, last_match_date)
     db.commit()
+    logger.info(f"Applied {len(new_matches)} new matches to player MMR.")
@@ -1,6 +1,6 @@
 import datetime
 
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Float, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 
 from database.database import Base
@@ -59,3 +59,121 @@ class PlayerMatchStats(Base):
     rounds_lost = Column(Integer)
     player = relationship('Player', back_populates='matches')
     match = relationship('Match', back_populates='players')
+
+
+class ProcessedDemo(Base):
+    __tablename__ = 'processed_demos'
+
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String, unique=True, index=True)
+    file_name = Column(String)
+    match_id = Column(Integer, ForeignKey('matches.id'))
+    match = relationship('Match')
+
+
+class PlayerRoundStats(Base):
+    __tablename__ = 'player_round_stats'
+
+    id = Column(Integer, primary_key=True, index=True)
+    match_id = Column(Integer, ForeignKey('matches.id'), index=True)
+    player_id = Column(Integer, ForeignKey('players.id'), index=True)
+    round_number = Column(Integer)
+    team = Column(String)
+    kills = Column(Integer)
+    deaths = Column(Integer)
+    assists = Column(Integer)
+    damage = Column(Integer)
+    equipment_value = Column(Integer)
+    opening_kill = Column(Boolean)
+    opening_death = Column(Boolean)
+    trade_kill = Column(Boolean)
+    traded_death = Column(Boolean)
+    clutch_opponents = Column(Integer)
+    clutch_won = Column(Boolean)
+    survived = Column(Boolean)
+    round_won = Column(Boolean)
+    player = relationship('Player')
+    match = relationship('Match')
+
+
+class RatingState(Base):
+    __tablename__ = 'rating_state'
+
+    id = Column(Integer, primary_key=True, index=True)
+    params_version = Column(String)
+    last_match_id = Column(Integer)
+    last_match_date = Column(DateTime)
+
+
+class MmrHistory(Base):
+    __tablename__ = 'mmr_history'
+
+    id = Column(Integer, primary_key=True, index=True)
+    player_id = Column(Integer, ForeignKey('players.id'), index=True)
+    match_id = Column(Integer, ForeignKey('matches.id'), index=True)
+    delta = Column(Integer)
+    mmr_after = Column(Integer)
+    player = relationship('Player')
+    match = relationship('Match')
+
+
+class MmrCheckpoint(Base):
+    __tablename__ = 'mmr_checkpoints'
+
+    id = Column(Integer, primary_key=True, index=True)
+    match_id = Column(Integer, ForeignKey('matches.id'), index=True)
+    match_count = Column(Integer)
+    player_id = Column(Integer, ForeignKey('players.id'))
+    mmr = Column(Integer)
+    match = relationship('Match')
+
+
+class PlayerRatingDecay(Base):
+    __tablename__ = 'player_rating_decay'
+
+    player_id = Column(Integer, ForeignKey('players.id'), primary_key=True)
+    decayed_sum = Column(Float)
+    anchor = Column(DateTime)
+    player = relationship('Player')
+
+
+class Season(Base):
+    __tablename__ = 'seasons'
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True)
+    start_date = Column(DateTime, index=True)
+    end_date = Column(DateTime)
+    players = relationship('SeasonPlayerSummary', back_populates='season')
+
+
+class SeasonPlayerSummary(Base):
+    __tablename__ = 'season_player_summaries'
+    __table_args__ = (
+        UniqueConstraint('season_id', 'player_id'),
+        Index('ix_season_player_summaries_season_mmr', 'season_id', 'mmr_change'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    season_id = Column(Integer, ForeignKey('seasons.id'))
+    player_id = Column(Integer, ForeignKey('players.id'))
+    matches = Column(Integer, default=0)
+    wins = Column(Integer, default=0)
+    kills = Column(Integer, default=0)
+    deaths = Column(Integer, default=0)
+    assists = Column(Integer, default=0)
+    damage = Column(Integer, default=0)
+    mmr_change = Column(Integer, default=0)
+    final_mmr = Column(Integer)
+    season = relationship('Season', back_populates='players')
+    player = relationship('Player')
+
+
+class RotationEntry(Base):
+    __tablename__ = 'rotation_queue'
+
+    player_id = Column(Integer, ForeignKey('players.id'), primary_key=True)
+    games = Column(Integer, default=0)
+    position = Column(Integer)
+    updated_at = Column(DateTime)
+    player = relationship('Player')
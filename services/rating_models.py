@@ -0,0 +1,254 @@
+import math
+from abc import ABC, abstractmethod
+
+from services import mmr_algorithm
+
+
+class RatingModel(ABC):
+    """
+    A rating engine: the rating state of a new player, the probability that one team beats
+    another, and the update of the players' states after a match.
+
+    Ratings are kept in a dict of player id to the model's own state, so the models can be
+    swapped in the same replay loop. A match result is 1.0 when team A won, 0.0 when team B
+    won and 0.5 for a draw. mmr_changes holds the HLTV-based MMR change of every player of
+    the match, for the models that rate individual performance.
+    """
+
+    name = None
+
+    @abstractmethod
+    def initial_rating(self):
+        ...
+
+    @abstractmethod
+    def win_probability(self, ratings: dict, team_a: list, team_b: list) -> float:
+        ...
+
+    @abstractmethod
+    def update(self, ratings: dict, team_a: list, team_b: list, result: float, mmr_changes: dict) -> None:
+        ...
+
+    def score(self, state) -> float:
+        """
+        A single number to rank players by.
+        """
+        return state
+
+    def _states(self, ratings: dict, team: list) -> list:
+        return [ratings.setdefault(player_id, self.initial_rating()) for player_id in team]
+
+
+def _logistic(difference: float, scale: float) -> float:
+    return 1 / (1 + 10 ** (-difference / scale))
+
+
+class HltvModel(RatingModel):
+    """
+    The production model of services.mmr_algorithm: each player's MMR moves by their HLTV 2.0
+    based change. Win probability is a logistic curve over the difference of the team means.
+    """
+
+    # The same name as in the rating parameter version that mmr_algorithm stores
+    name = mmr_algorithm.RATING_MODEL
+
+    def __init__(self, win_scale: float = 400):
+        self.win_scale = win_scale
+
+    def initial_rating(self):
+        return mmr_algorithm.BASE_MMR
+
+    def win_probability(self, ratings, team_a, team_b):
+        mean_a = sum(self._states(ratings, team_a)) / len(team_a)
+        mean_b = sum(self._states(ratings, team_b)) / len(team_b)
+        return _logistic(mean_a - mean_b, self.win_scale)
+
+    def update(self, ratings, team_a, team_b, result, mmr_changes):
+        for player_id in team_a + team_b:
+            ratings[player_id] = ratings.get(player_id, self.initial_rating()) + mmr_changes.get(player_id, 0)
+
+
+class EloModel(RatingModel):
+    """
+    Team Elo: a team's rating is the mean of its players' ratings, and every player of a team
+    moves by k times the difference between the result and the expected result.
+    """
+
+    name = 'elo'
+
+    def __init__(self, k: float = 32, initial: float = 1000, scale: float = 400):
+        self.k = k
+        self.initial = initial
+        self.scale = scale
+
+    def initial_rating(self):
+        return self.initial
+
+    def win_probability(self, ratings, team_a, team_b):
+        mean_a = sum(self._states(ratings, team_a)) / len(team_a)
+        mean_b = sum(self._states(ratings, team_b)) / len(team_b)
+        return _logistic(mean_a - mean_b, self.scale)
+
+    def update(self, ratings, team_a, team_b, result, mmr_changes):
+        change = self.k * (result - self.win_probability(ratings, team_a, team_b))
+        for player_id in team_a:
+            ratings[player_id] += change
+        for player_id in team_b:
+            ratings[player_id] -= change
+
+
+# Conversion between the Glicko and the Glicko-2 scale
+GLICKO2_SCALE = 173.7178
+
+
+class Glicko2Model(RatingModel):
+    """
+    Glicko-2 with every match as its own rating period. Each player is rated against the
+    opposing team as one composite player, with the mean rating and the root mean square
+    deviation of its players. States are (mu, phi, sigma) tuples on the Glicko-2 scale.
+    """
+
+    name = 'glicko2'
+
+    def __init__(self, initial_deviation: float = 350, initial_volatility: float = 0.06, tau: float = 0.5):
+        self.initial_deviation = initial_deviation
+        self.initial_volatility = initial_volatility
+        self.tau = tau
+
+    def initial_rating(self):
+        return 0.0, self.initial_deviation / GLICKO2_SCALE, self.initial_volatility
+
+    def score(self, state):
+        return 1500 + GLICKO2_SCALE * state[0]
+
+    @staticmethod
+    def _g(phi: float) -> float:
+        return 1 / math.sqrt(1 + 3 * phi ** 2 / math.pi ** 2)
+
+    def _composite(self, ratings, team) -> tuple:
+        states = self._states(ratings, team)
+        mu = sum(state[0] for state in states) / len(states)
+        phi = math.sqrt(sum(state[1] ** 2 for state in states) / len(states))
+        return mu, phi
+
+    def win_probability(self, ratings, team_a, team_b):
+        mu_a, phi_a = self._composite(ratings, team_a)
+        mu_b, phi_b = self._composite(ratings, team_b)
+        return 1 / (1 + math.exp(-self._g(math.hypot(phi_a, phi_b)) * (mu_a - mu_b)))
+
+    def update(self, ratings, team_a, team_b, result, mmr_changes):
+        opponent_a = self._composite(ratings, team_b)
+        opponent_b = self._composite(ratings, team_a)
+        for player_id in team_a:
+            ratings[player_id] = self._rate(ratings[player_id], opponent_a, result)
+        for player_id in team_b:
+            ratings[player_id] = self._rate(ratings[player_id], opponent_b, 1 - result)
+
+    def _rate(self, state: tuple, opponent: tuple, result: float) -> tuple:
+        mu, phi, sigma = state
+        opponent_mu, opponent_phi = opponent
+        g = self._g(opponent_phi)
+        expected = 1 / (1 + math.exp(-g * (mu - opponent_mu)))
+        v = 1 / (g ** 2 * expected * (1 - expected))
+        delta = v * g * (result - expected)
+        sigma = self._volatility(phi, sigma, v, delta)
+        phi = 1 / math.sqrt(1 / (phi ** 2 + sigma ** 2) + 1 / v)
+        return mu + phi ** 2 * g * (result - expected), phi, sigma
+
+    def _volatility(self, phi: float, sigma: float, v: float, delta: float, tolerance: float = 1e-6) -> float:
+        # Illinois algorithm from step 5 of Glickman's "Example of the Glicko-2 system"
+        a = math.log(sigma ** 2)
+
+        def f(x):
+            ex = math.exp(x)
+            return ex * (delta ** 2 - phi ** 2 - v - ex) / (2 * (phi ** 2 + v + ex) ** 2) - (x - a) / self.tau ** 2
+
+        low = a
+        if delta ** 2 > phi ** 2 + v:
+            high = math.log(delta ** 2 - phi ** 2 - v)
+        else:
+            k = 1
+            while f(a - k * self.tau) < 0:
+                k += 1
+            high = a - k * self.tau
+        f_low, f_high = f(low), f(high)
+        while abs(high - low) > tolerance:
+            middle = low + (low - high) * f_low / (f_high - f_low)
+            f_middle = f(middle)
+            if f_middle * f_high <= 0:
+                low, f_low = high, f_high
+            else:
+                f_low /= 2
+            high, f_high = middle, f_middle
+        return math.exp(low / 2)
+
+
+def _pdf(x: float) -> float:
+    return math.exp(-x * x / 2) / math.sqrt(2 * math.pi)
+
+
+def _cdf(x: float) -> float:
+    return (1 + math.erf(x / math.sqrt(2))) / 2
+
+
+class TrueSkillModel(RatingModel):
+    """
+    Two-team TrueSkill: a team's performance is the sum of its players' performances, and the
+    players' (mu, sigma) states are updated with the truncated Gaussian v and w functions.
+    Players are ranked by the conservative estimate mu - 3 sigma.
+    """
+
+    name = 'trueskill'
+
+    def __init__(self, mu: float = 25, sigma: float = 25 / 3, beta: float = 25 / 6, tau: float = 25 / 300,
+                 draw_margin: float = 0.5):
+        self.mu = mu
+        self.sigma = sigma
+        self.beta = beta
+        self.tau = tau
+        self.draw_margin = draw_margin
+
+    def initial_rating(self):
+        return self.mu, self.sigma
+
+    def score(self, state):
+        return state[0] - 3 * state[1]
+
+    def _difference(self, ratings, team_a, team_b) -> tuple:
+        states = self._states(ratings, team_a) + self._states(ratings, team_b)
+        mean = sum(mu for mu, _ in states[:len(team_a)]) - sum(mu for mu, _ in states[len(team_a):])
+        c = math.sqrt(sum(sigma ** 2 + self.tau ** 2 for _, sigma in states) + len(states) * self.beta ** 2)
+        return mean, c
+
+    def win_probability(self, ratings, team_a, team_b):
+        mean, c = self._difference(ratings, team_a, team_b)
+        return _cdf(mean / c)
+
+    def update(self, ratings, team_a, team_b, result, mmr_changes):
+        mean, c = self._difference(ratings, team_a, team_b)
+        if result == 0.5:
+            v, w = self._draw(mean / c, self.draw_margin / c)
+            sign = 1
+        else:
+            # Rate from the winner's point of view
+            sign = 1 if result == 1 else -1
+            t = sign * mean / c
+            v = _pdf(t) / max(_cdf(t), 1e-300)
+            w = v * (v + t)
+        for team, team_sign in ((team_a, sign), (team_b, -sign)):
+            for player_id in team:
+                mu, sigma = ratings[player_id]
+                variance = sigma ** 2 + self.tau ** 2
+                mu += team_sign * variance / c * v
+                sigma = math.sqrt(variance * max(1 - variance / c ** 2 * w, 1e-4))
+                ratings[player_id] = mu, sigma
+
+    @staticmethod
+    def _draw(t: float, margin: float) -> tuple:
+        denominator = max(_cdf(margin - t) - _cdf(-margin - t), 1e-300)
+        v = (_pdf(-margin - t) - _pdf(margin - t)) / denominator
+        w = v ** 2 + ((margin - t) * _pdf(margin - t) + (margin + t) * _pdf(margin + t)) / denominator
+        return v, w
+
+
+RATING_MODELS = {model.name: model for model in (HltvModel, EloModel, Glicko2Model, TrueSkillModel)}
@@ -0,0 +1,95 @@
+import datetime
+import heapq
+import logging
+
+from sqlalchemy.orm import Session
+
+from services import crud
+
+logger = logging.getLogger(__name__)
+
+# Games only count within one evening: after this many hours without a game, every player's
+# count starts from zero again, keeping their order in the queue
+ROTATION_RESET_HOURS = 8
+
+
+class RotationQueue:
+    """
+    Who plays next when more players are present than there are slots, persisted in the
+    rotation_queue table.
+
+    Players are ordered by the number of games they played recently, and by how long they have
+    been waiting within the same number of games. A player that plays goes to the back of the
+    queue of the next number of games, and a player seen for the first time to the back of the
+    queue of zero games, both in O(1). Picking the next players only sorts the players present.
+
+    The queue is read from the database once and kept in memory, and every game is written back
+    in a single statement.
+    """
+
+    def __init__(self):
+        # Player id to (games, position), a lower position having waited longer
+        self.entries = {}
+        self.next_position = 0
+        self.updated_at = None
+        # Players first seen since the last save, written with the next game
+        self._unsaved = set()
+        self._loaded = False
+
+    def load(self, db: Session) -> None:
+        if self._loaded:
+            return
+        for player_id, games, position, updated_at in crud.get_rotation_entries(db):
+            self.entries[player_id] = (games, position)
+            self.next_position = max(self.next_position, position + 1)
+            if updated_at is not None and (self.updated_at is None or updated_at > self.updated_at):
+                self.updated_at = updated_at
+        self._loaded = True
+        logger.info(f"Loaded the rotation queue with {len(self.entries)} players.")
+
+    def _enqueue(self, player_id: int, games: int) -> tuple:
+        self.entries[player_id] = (games, self.next_position)
+        self.next_position += 1
+        return self.entries[player_id]
+
+    def _reset_if_stale(self, now: datetime.datetime) -> None:
+        if self.updated_at is None or now - self.updated_at <= datetime.timedelta(hours=ROTATION_RESET_HOURS):
+            return
+        self.entries = {player_id: (0, position) for player_id, (_, position) in self.entries.items()}
+        self._unsaved.update(self.entries)
+        self.updated_at = now
+        logger.info("Reset the games counted by the rotation queue for a new evening.")
+
+    def order(self, db: Session, player_ids: list) -> list:
+        """
+        Order the given players by who should play next, first in the queue first.
+        """
+        self.load(db)
+        self._reset_if_stale(datetime.datetime.now())
+        for player_id in player_ids:
+            if player_id not in self.entries:
+                self._enqueue(player_id, 0)
+                self._unsaved.add(player_id)
+        return heapq.nsmallest(len(player_ids), player_ids, key=self.entries.__getitem__)
+
+    def played(self, db: Session, player_ids: list, now: datetime.datetime = None) -> None:
+        """
+        Move the players of a game to the back of the queue, and commit the queue.
+        """
+        self.load(db)
+        now = now or datetime.datetime.now()
+        self._reset_if_stale(now)
+        changed = self._unsaved | set(player_ids)
+        for player_id in player_ids:
+            games, _ = self.entries.get(player_id, (0, None))
+            self._enqueue(player_id, games + 1)
+        self.updated_at = now
+
+        crud.save_rotation_entries(db, [
+            (player_id, *self.entries[player_id], now) for player_id in changed
+        ])
+        db.commit()
+        self._unsaved = set()
+
+
+rotation_queue = RotationQueue()
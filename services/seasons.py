@@ -0,0 +1,113 @@
+import datetime
+import logging
+
+from sqlalchemy.orm import Session
+
+from services import crud, models
+
+logger = logging.getLogger(__name__)
+
+
+def season_for(seasons: list, date_time):
+    """
+    Find the id of the season a match played at date_time belongs to, or None.
+    """
+    for season in seasons:
+        if season.start_date <= date_time and (season.end_date is None or date_time < season.end_date):
+            return season.id
+    return None
+
+
+class SeasonTotals:
+    """
+    Per-season stat and MMR totals of the matches applied in one rating pass, added to the
+    season summaries in one statement by save.
+    """
+
+    def __init__(self, seasons: list):
+        self.seasons = seasons
+        self.totals = {}
+
+    def add(self, row, mmr_change: int):
+        """
+        Add a stat row, as streamed by crud.stream_match_stats, and its MMR change.
+        """
+        season_id = season_for(self.seasons, row.date_time)
+        if season_id is None:
+            return
+        won = int(row.team.lower() == row.winner.lower())
+        row_totals = (1, won, row.kills_total, row.deaths_total, row.assists_total, row.damage_total, mmr_change)
+        key = (season_id, row.player_id)
+        self.totals[key] = tuple(map(sum, zip(self.totals.get(key, (0,) * len(row_totals)), row_totals)))
+
+    def save(self, db: Session):
+        crud.add_season_summaries(db, self.totals)
+        self.totals = {}
+
+
+def rebuild_season_summaries(db: Session, since=None) -> None:
+    """
+    Rebuild the summaries of the seasons that end after since, or of all seasons, from the
+    matches and MMR history of each season's range only. Nothing is committed.
+    """
+    for season in crud.get_seasons(db):
+        if since is not None and season.end_date is not None and season.end_date <= since:
+            continue
+        crud.replace_season_summaries(
+            db, season.id, crud.sum_season_totals(db, season.start_date, season.end_date)
+        )
+
+
+def end_season(db: Session, end_date: datetime.datetime = None):
+    """
+    End the active season, snapshotting the MMR of its players as balancing saw it at the end
+    date, with time decay applied. The snapshot is built from the MMR history, so it is right
+    for an end date in the past too. Nothing is recalculated.
+
+    Returns:
+        Season: The season that was ended, or None if no season was active.
+    """
+    season = crud.get_active_season(db)
+    if season is None:
+        return None
+    season.end_date = end_date or datetime.datetime.now()
+
+    summaries = db.query(models.SeasonPlayerSummary.id, models.SeasonPlayerSummary.player_id).filter(
+        models.SeasonPlayerSummary.season_id == season.id
+    ).all()
+    # Imported here, mmr_algorithm imports this module to keep the season totals up to date
+    from services.mmr_algorithm import get_effective_mmrs_before
+    mmrs = get_effective_mmrs_before(db, [player_id for _, player_id in summaries], season.end_date)
+    db.bulk_update_mappings(models.SeasonPlayerSummary, [
+        {'id': summary_id, 'final_mmr': mmrs.get(player_id)} for summary_id, player_id in summaries
+    ])
+    db.commit()
+    logger.info(f"Ended season {season.name} with {len(summaries)} players.")
+    return season
+
+
+def start_season(db: Session, name: str, start_date: datetime.datetime = None):
+    """
+    Start a new season, ending the active one at the same moment. Matches already played
+    since start_date are counted in the new season.
+
+    Returns:
+        Season: The new season.
+    """
+    if crud.get_season_by_name(db, name) is not None:
+        raise ValueError(f"A season named '{name}' already exists.")
+    start_date = start_date or datetime.datetime.now()
+    previous = end_season(db, end_date=start_date)
+
+    season = models.Season(name=name, start_date=start_date)
+    db.add(season)
+    db.flush()
+    # A start date in the past moves matches from the previous season to the new one
+    for rebuilt in (previous, season):
+        if rebuilt is not None:
+            crud.replace_season_summaries(
+                db, rebuilt.id, crud.sum_season_totals(db, rebuilt.start_date, rebuilt.end_date)
+            )
+    db.commit()
+    logger.info(f"Started season {name} on {start_date:%Y-%m-%d %H:%M}.")
+    return season
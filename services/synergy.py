@@ -0,0 +1,245 @@
+import logging
+import os
+import threading
+import weakref
+from itertools import groupby
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from database.database import engine
+from services import crud
+
+logger = logging.getLogger(__name__)
+
+SYNERGY_FILE = "synergy.npz"
+
+# Where the bot's database keeps its synergy, next to the database file by default, whatever
+# the working directory. Other databases keep theirs next to their own file.
+SYNERGY_PATH = os.getenv('SYNERGY_PATH') or os.path.join(
+    os.path.dirname(os.path.abspath(engine.url.database)), SYNERGY_FILE
+)
+
+# The pairwise counts kept, each a players x players array
+MATRICES = ('together', 'wins_together', 'against', 'wins_against')
+
+# Games at a 50% win rate added to every pair's record together, so that a pair with a few
+# games together scores close to neutral
+SYNERGY_PRIOR_GAMES = 5
+
+
+class SynergyMatrix:
+    """
+    Pairwise records of the players, as players x players count arrays indexed through a player
+    id to row dict: games and wins on the same team, the diagonal being each player's own games
+    and wins, games on opposing teams, and wins of the row player against the column player.
+
+    The arrays are saved to path as .npz, with the id of the last match counted, and update
+    only counts the matches added since. Without a path they are only kept in memory. The file is only read again when its modification time
+    changes, so the bot picks up matches ingested by another process. Reads are array lookups.
+
+    update counts into copies of the arrays and swaps them in under a lock, so it can run in
+    the ingest worker thread while the bot reads.
+    """
+
+    def __init__(self, path=SYNERGY_PATH):
+        self.path = path
+        self.index = {}
+        self.player_ids = []
+        self.arrays = _empty_arrays()
+        self.last_match_id = 0
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def refresh(self) -> bool:
+        """
+        Reload the arrays if the file changed since it was last read or written.
+
+        Returns:
+            bool: True if the arrays were reloaded.
+        """
+        if self.path is None:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+
+        with np.load(self.path) as saved:
+            player_ids = saved['player_ids'].tolist()
+            arrays = {name: saved[name] for name in MATRICES}
+            last_match_id = int(saved['last_match_id'])
+        self._swap(player_ids, arrays, last_match_id)
+        self._mtime = mtime
+        logger.info(f"Loaded the synergy of {len(self.player_ids)} players up to match {self.last_match_id}.")
+        return True
+
+    def save(self) -> None:
+        """
+        Write the arrays, through a temporary file so readers never see a partial one.
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            player_ids, arrays, last_match_id = self.player_ids, self.arrays, self.last_match_id
+        temporary_path = f"{self.path}.tmp.npz"
+        np.savez(
+            temporary_path, player_ids=np.array(player_ids, dtype=np.int64), last_match_id=last_match_id, **arrays
+        )
+        os.replace(temporary_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def _swap(self, player_ids: list, arrays: dict, last_match_id: int) -> None:
+        index = {player_id: row for row, player_id in enumerate(player_ids)}
+        with self._lock:
+            self.player_ids, self.index, self.arrays, self.last_match_id = player_ids, index, arrays, last_match_id
+
+    def update(self, db: Session, recount: bool = False) -> int:
+        """
+        Count the matches added since the last update, and save the arrays if there were any.
+        Everything is counted again with recount, or if the last match counted is no longer in
+        the database.
+
+        Returns:
+            int: The number of matches counted.
+        """
+        self.refresh()
+        with self._lock:
+            player_ids, arrays, last_match_id = list(self.player_ids), self.arrays, self.last_match_id
+        if last_match_id > (crud.get_last_match_id(db) or 0):
+            logger.info("Matches were removed since the synergy was saved, counting all matches again.")
+            recount = True
+        if recount:
+            player_ids, arrays, last_match_id = [], _empty_arrays(), 0
+        index = {player_id: row for row, player_id in enumerate(player_ids)}
+        arrays = {name: array.copy() for name, array in arrays.items()}
+
+        pairs = {name: ([], [], []) for name in MATRICES}
+        match_count = 0
+        counted_match_id = last_match_id
+        for match_id, match_rows in groupby(
+            crud.stream_match_stats(db, after_match_id=last_match_id), key=lambda row: row.match_id
+        ):
+            match_rows = list(match_rows)
+            counted_match_id = max(counted_match_id, match_id)
+            teams = {}
+            for row in match_rows:
+                teams.setdefault(row.team.lower(), []).append(row.player_id)
+            if len(teams) != 2:
+                logger.warning(f"Skipping match {match_id} for synergy: expected two teams, found {sorted(teams)}.")
+                continue
+            winner = match_rows[0].winner.lower()
+            (name_a, team_a), (name_b, team_b) = teams.items()
+            rows_a, rows_b = _rows(index, player_ids, arrays, team_a), _rows(index, player_ids, arrays, team_b)
+            for own, other, won in ((rows_a, rows_b, winner == name_a), (rows_b, rows_a, winner == name_b)):
+                _add_pairs(pairs['together'], own, own, 1)
+                _add_pairs(pairs['wins_together'], own, own, int(won))
+                _add_pairs(pairs['against'], own, other, 1)
+                _add_pairs(pairs['wins_against'], own, other, int(won))
+            match_count += 1
+
+        for name, (pair_rows, pair_columns, weights) in pairs.items():
+            if pair_rows:
+                np.add.at(
+                    arrays[name], (np.concatenate(pair_rows), np.concatenate(pair_columns)),
+                    np.concatenate(weights).astype(np.int32)
+                )
+        if recount or counted_match_id != last_match_id:
+            self._swap(player_ids, arrays, counted_match_id)
+            self.save()
+            logger.info(f"Counted {match_count} new matches in the player synergy.")
+        return match_count
+
+    def duo(self, player_a: int, player_b: int) -> dict:
+        """
+        The record of two players together and against each other.
+        """
+        with self._lock:
+            index, arrays = self.index, self.arrays
+        if player_a not in index or player_b not in index:
+            return {'together': 0, 'wins_together': 0, 'against': 0, 'wins_a': 0, 'wins_b': 0}
+        a, b = index[player_a], index[player_b]
+        return {
+            'together': int(arrays['together'][a, b]),
+            'wins_together': int(arrays['wins_together'][a, b]),
+            'against': int(arrays['against'][a, b]),
+            'wins_a': int(arrays['wins_against'][a, b]),
+            'wins_b': int(arrays['wins_against'][b, a]),
+        }
+
+    def pair_synergy(self, player_ids: list) -> np.ndarray:
+        """
+        The synergy of every pair of the given players: their win rate together, with
+        SYNERGY_PRIOR_GAMES games at 50% added, minus 50%. Zero on the diagonal and for players
+        without games.
+        """
+        with self._lock:
+            index, arrays = self.index, self.arrays
+        known = np.array([player_id in index for player_id in player_ids])
+        rows = np.array([index.get(player_id, 0) for player_id in player_ids], dtype=np.intp)
+        together = arrays['together'][np.ix_(rows, rows)] if index else 0
+        wins_together = arrays['wins_together'][np.ix_(rows, rows)] if index else 0
+        synergy = (wins_together + SYNERGY_PRIOR_GAMES / 2) / (together + SYNERGY_PRIOR_GAMES) - 0.5
+        synergy = synergy * np.outer(known, known)
+        np.fill_diagonal(synergy, 0)
+        return synergy
+
+
+def _empty_arrays() -> dict:
+    return {name: np.zeros((0, 0), dtype=np.int32) for name in MATRICES}
+
+
+def _rows(index: dict, player_ids: list, arrays: dict, team: list) -> np.ndarray:
+    """
+    The rows of the players of a team, adding rows and columns for the new ones.
+    """
+    new_ids = [player_id for player_id in dict.fromkeys(team) if player_id not in index]
+    if new_ids:
+        for player_id in new_ids:
+            index[player_id] = len(player_ids)
+            player_ids.append(player_id)
+        size = len(player_ids)
+        for name, array in arrays.items():
+            grown = np.zeros((size, size), dtype=np.int32)
+            grown[:len(array), :len(array)] = array
+            arrays[name] = grown
+    return np.array([index[player_id] for player_id in team], dtype=np.intp)
+
+
+def _add_pairs(pairs: tuple, rows: np.ndarray, columns: np.ndarray, weight: int) -> None:
+    pair_rows, pair_columns, weights = pairs
+    pair_rows.append(np.repeat(rows, len(columns)))
+    pair_columns.append(np.tile(columns, len(rows)))
+    weights.append(np.full(len(rows) * len(columns), weight))
+
+
+# The matrix of each database engine, so a session on another database, such as the
+# benchmark's, never reads or overwrites the bot's synergy
+_matrices = weakref.WeakKeyDictionary()
+_matrices_lock = threading.Lock()
+
+
+def synergy_path(bind) -> str:
+    """
+    The synergy file of a database engine: SYNERGY_PATH for the bot's database, the same file
+    name next to any other database file, and None for an in-memory database.
+    """
+    if bind is engine:
+        return SYNERGY_PATH
+    database = bind.url.database
+    if not database or database == ':memory:':
+        return None
+    return os.path.join(os.path.dirname(os.path.abspath(database)), SYNERGY_FILE)
+
+
+def get_synergy_matrix(db: Session) -> SynergyMatrix:
+    """
+    The synergy matrix of the database the session is bound to.
+    """
+    bind = db.get_bind()
+    with _matrices_lock:
+        if bind not in _matrices:
+            _matrices[bind] = SynergyMatrix(path=synergy_path(bind))
+        return _matrices[bind]
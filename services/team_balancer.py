@@ -1,127 +1,827 @@
+import heapq
 import itertools
 import logging
+import os
 import random
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
 
 from services import crud, models
+from services.mmr_algorithm import get_effective_mmrs
+from services.rating_models import HltvModel
+from services.rotation import RotationQueue
+from services.synergy import get_synergy_matrix
 from typing import List, Dict, Any, Tuple
 from sqlalchemy.orm import Session
 
 logger = logging.getLogger(__name__)
 
+LOBBY_SIZE = 10
+
+# Seconds balance_lobbies may search for, well within Discord's 3 second interaction deadline
+LOBBY_TIME_BUDGET = 1.5
+# The lobby search stops early after this many perturbations in a row found nothing better
+LOBBY_STALL_ROUNDS = 100
+
+# Number of splits balance_team_options ranks, for /reroll to go through
+SPLIT_CANDIDATES = 10
+# Number of recently played team assignments a split is penalized for repeating
+RECENT_SPLITS = 5
+# MMR added to the cost of a split for each recent team assignment it repeats
+REPEAT_PENALTY = 50
+# Number of player sets whose ranked splits are kept
+SPLIT_CACHE_SIZE = 32
+
+# What the balancer minimizes over the splits, a key of OBJECTIVES
+BALANCE_OBJECTIVE = os.getenv('BALANCE_OBJECTIVE', 'mmr_difference')
+
+# For the win probability objective: the MMR uncertainty of a player without matches, which
+# shrinks with the square root of the matches played, and the weight of the MMR standard
+# deviation in a team's strength, positive when a star counts for more than the team mean
+NEW_PLAYER_SIGMA = 200
+SPREAD_WEIGHT = float(os.getenv('BALANCE_SPREAD_WEIGHT', '0.25'))
+# Number of rating draws the win probability is averaged over
+WIN_PROBABILITY_SAMPLES = 512
+
+# MMR added to a split's score per point of difference between the teams' summed pair
+# synergies, see SynergyMatrix.pair_synergy. Off by default.
+SYNERGY_WEIGHT = float(os.getenv('BALANCE_SYNERGY_WEIGHT', '0'))
+
+# The number of splits ranked and the ranked splits by (player IDs and MMRs, constraints),
+# least recently used first
+_split_cache = OrderedDict()
 
-def balance_teams(player_ids: List[int], db: Session) -> Tuple[List[int], List[int], int]:
+
+class SplitConstraints:
+    """
+    Constraints on splitting players into two teams, by SteamID.
+
+    role_quotas maps a role to the number of players of that role each team should get. A quota
+    is capped at half the players of the role that are playing, so the default sniper quota
+    gives each team a sniper only when at least two snipers play. conflicts are pairs of players
+    that must not be on the same team, and premades are groups that must all be on the same
+    team. Players that are not playing are ignored.
+    """
+
+    def __init__(self, role_quotas: Dict[str, int] = None, conflicts: list = (), premades: list = ()):
+        self.role_quotas = {'sniper': 1, **(role_quotas or {})}
+        self.conflicts = [tuple(pair) for pair in conflicts]
+        self.premades = [tuple(group) for group in premades]
+
+    def only_default_quotas(self, players: list) -> bool:
+        """
+        Whether nothing but the sniper rule of best_split applies to these players.
+        """
+        steamids = {player.steamid for player in players}
+        roles = {player.role for player in players}
+        return (
+            all(quota == 0 or role not in roles for role, quota in self.role_quotas.items() if role != 'sniper')
+            and self.role_quotas['sniper'] == 1
+            and not any(set(pair) <= steamids for pair in self.conflicts)
+            and not any(len(steamids.intersection(group)) >= 2 for group in self.premades)
+        )
+
+    def key(self) -> tuple:
+        return (
+            tuple(sorted(self.role_quotas.items())),
+            tuple(sorted(tuple(sorted(pair)) for pair in self.conflicts)),
+            tuple(sorted(tuple(sorted(group)) for group in self.premades)),
+        )
+
+
+def balance_teams(
+    player_ids: List[int], db: Session, constraints: SplitConstraints = None
+) -> Tuple[List[int], List[int], int]:
     """
     Balance teams based on player MMR and constraints.
     """
+    return balance_team_options(player_ids, db, constraints, candidates=1)['options'][0]
+
+
+def balance_team_options(
+    player_ids: List[int],
+    db: Session,
+    constraints: SplitConstraints = None,
+    recent: list = (),
+    candidates: int = SPLIT_CANDIDATES,
+    objective: str = BALANCE_OBJECTIVE,
+    rotation: RotationQueue = None,
+) -> Dict[str, Any]:
+    """
+    Rank the best splits of the players into two teams, best first.
+
+    With a rotation queue, the players that play are the first ones in the queue, core members
+    first. The queue is only read, so balancing again picks the same players until /start
+    records a game. Without a queue they are picked at random.
+
+    Splits are scored with the objective, a key of OBJECTIVES, and with SYNERGY_WEIGHT, the
+    synergy term: every split at once by top_splits, or, with role quotas, conflicts or premades
+    that apply to the selected players, the feasible splits found by constrained_splits. A split costs its score plus REPEAT_PENALTY for each of the recent team assignments,
+    given as (team A, team B) Discord IDs, that it repeats; every objective scores in MMR, the
+    win probability one as the team MMR difference that predicts the same probability. The
+    ranked splits are cached by the selected players, their MMR, uncertainty, role and core
+    flag, the constraints, the objective and the last match counted in the synergy, so
+    balancing the same players again only re-applies the penalties.
+
+    Returns:
+        dict: 'options', up to candidates (team A Discord IDs, team B Discord IDs, MMR difference)
+            tuples; 'sitting_out', the Discord IDs of the players sitting out, and 'queue', the
+            Discord IDs of all players in the order they are up next, or None without a queue.
+    """
     logger.info(f"Balancing teams for players: {player_ids}")
 
     # Retrieve player data
-    players = []
+    players_by_discord_id = crud.get_players_by_discord_ids(db, player_ids)
     for pid in player_ids:
-        player = crud.get_player_by_discord_id(db, discord_id=pid)
-        if not player:
+        if pid not in players_by_discord_id:
             raise ValueError(f"Player with id {pid} not found")
-        players.append(player)
+    players = [players_by_discord_id[pid] for pid in player_ids]
+
+    if len(players) < 10:
+        raise ValueError("At least 10 players are required to form two teams of five.")
+
+    selected_players = _select_from_queue(db, players, 10, rotation)
+
+    # Define team size
+    team_size = 5
+
+    # MMR with time decay applied, if enabled
+    mmrs = get_effective_mmrs(db, [player.id for player in selected_players])
+
+    default_constraints = constraints is None or constraints.only_default_quotas(selected_players)
+    sigmas = None
+    if objective == 'win_probability':
+        match_counts = crud.get_match_counts(db, [player.id for player in selected_players])
+        sigmas = {player.id: NEW_PLAYER_SIGMA / (1 + match_counts.get(player.id, 0)) ** 0.5 for player in selected_players}
+    pair_synergy = synergy_match_id = None
+    if SYNERGY_WEIGHT:
+        synergy_matrix = get_synergy_matrix(db)
+        synergy_matrix.refresh()
+        # Read first, a concurrent update can only make the synergy newer than the cache key says
+        synergy_match_id = synergy_matrix.last_match_id
+        pair_synergy = synergy_matrix.pair_synergy([player.id for player in selected_players])
+    cache_key = (
+        tuple(sorted(
+            (player.id, mmrs[player.id], sigmas and sigmas[player.id], player.role or '', bool(player.core_member))
+            for player in selected_players
+        )),
+        None if default_constraints else constraints.key(),
+        objective,
+        synergy_match_id,
+    )
+    # Penalties only apply to the splits that repeat a recent one, so the best candidates after
+    # penalties are among the best candidates + RECENT_SPLITS before
+    count = candidates + RECENT_SPLITS
+    cached_count, splits = _split_cache.get(cache_key, (0, None))
+    if cached_count < count:
+        if default_constraints:
+            ranked = top_splits(
+                selected_players, mmrs, count, team_size, objective=objective, sigmas=sigmas, pair_synergy=pair_synergy
+            )
+        elif objective == 'mmr_difference' and pair_synergy is None:
+            ranked = [
+                (team_a, team_b, mmr_diff, mmr_diff)
+                for team_a, team_b, mmr_diff in constrained_splits(selected_players, mmrs, constraints, count, team_size)
+            ]
+        else:
+            # constrained_splits ranks by MMR difference, so take every feasible split and
+            # rank them by the objective
+            feasible = constrained_splits(
+                selected_players, mmrs, constraints, len(split_table(len(selected_players), team_size)[0]), team_size
+            )
+            in_team_a = np.array([
+                [player in team_a for player in selected_players] for team_a, _, _ in feasible
+            ], dtype=np.int64)
+            scores = split_scores(selected_players, mmrs, in_team_a, objective, sigmas, pair_synergy)
+            ranked = [
+                (*feasible[split], float(scores[split])) for split in np.argsort(scores, kind='stable')[:count]
+            ]
+        splits = [
+            (score, ([player.discord_id for player in team_a], [player.discord_id for player in team_b], mmr_diff))
+            for team_a, team_b, mmr_diff, score in ranked
+        ]
+        _split_cache[cache_key] = count, splits
+        if len(_split_cache) > SPLIT_CACHE_SIZE:
+            _split_cache.popitem(last=False)
+    else:
+        logger.debug("Using cached splits")
+    _split_cache.move_to_end(cache_key)
+
+    recent_teams = [frozenset(team) for teams in recent for team in teams]
+
+    def cost(scored_split):
+        score, (team_a, _, _) = scored_split
+        return score + REPEAT_PENALTY * sum(1 for team in recent_teams if team == frozenset(team_a))
+
+    options = [split for _, split in sorted(splits, key=cost)[:candidates]]
+
+    logger.info(f"Teams balanced with MMR difference of {options[0][2]}")
+
+    return {
+        'options': options,
+        'sitting_out': [player.discord_id for player in players if player not in selected_players],
+        'queue': _queue_order(db, players, selected_players, rotation),
+    }
+
+
+def _select_from_queue(db: Session, players: list, count: int, rotation: RotationQueue = None) -> list:
+    """
+    Pick the players to play with select_players, in rotation order when there is a queue.
+    """
+    if rotation is None:
+        return select_players(players, count)
+    players_by_id = {player.id: player for player in players}
+    queue_order = [players_by_id[player_id] for player_id in rotation.order(db, list(players_by_id))]
+    return select_players(players, count, queue_order=queue_order)
+
+
+def _queue_order(db: Session, players: list, selected_players: list, rotation: RotationQueue = None) -> list:
+    """
+    The rotation queue once the selected players have played: the players sitting out first,
+    then the selected ones, each in queue order. Nothing is recorded, /start and /startlobbies
+    do that for the teams that actually play.
+
+    Returns:
+        list: The Discord IDs of all players in the order they are up next, or None without a queue.
+    """
+    if rotation is None:
+        return None
+    discord_ids = {player.id: player.discord_id for player in players}
+    selected_ids = {player.id for player in selected_players}
+    order = rotation.order(db, list(discord_ids))
+    return [discord_ids[player_id] for player_id in sorted(order, key=lambda player_id: player_id in selected_ids)]
+
+
+def balance_lobbies(
+    player_ids: List[str],
+    db: Session,
+    time_budget: float = LOBBY_TIME_BUDGET,
+    rotation: RotationQueue = None,
+    constraints: SplitConstraints = None,
+) -> Dict[str, Any]:
+    """
+    Split everyone into as many 5v5 lobbies as possible.
+
+    The players are partitioned into lobbies with a time-limited local search that keeps both the
+    MMR difference within each lobby and the differences between lobby totals small, and each
+    lobby is then split into two teams exactly as balance_teams does, with the constraints among
+    the lobby's players. The partition itself only knows the sniper rule, so the players of a
+    premade group can land in different lobbies, where the group no longer applies. Players that
+    do not fill a whole lobby sit out, picked like balance_team_options picks who plays.
+
+    Returns:
+        dict: 'lobbies', a list of dicts with the Discord IDs of 'team_a' and 'team_b', their
+            'mmr_diff' (the optimum for the lobby's players under the constraints) and the
+            lobby's 'mmr_average'; 'sitting_out', the Discord IDs of the players sitting out;
+            'lobby_spread', the difference between the highest and lowest lobby MMR total, and
+            'lobby_spread_bound', a lower bound on it, to show how far the partition is from
+            optimal; and 'queue', as returned by balance_team_options.
+
+    Raises:
+        ValueError: If a player is not registered, there are too few players for a lobby, or no
+            split of a lobby satisfies the constraints.
+    """
+    logger.info(f"Balancing lobbies for players: {player_ids}")
+
+    players_by_discord_id = crud.get_players_by_discord_ids(db, player_ids)
+    missing = [pid for pid in player_ids if pid not in players_by_discord_id]
+    if missing:
+        raise ValueError(f"Players with ids {', '.join(missing)} not found")
+    players = [players_by_discord_id[pid] for pid in player_ids]
+
+    lobby_count = len(players) // LOBBY_SIZE
+    if lobby_count == 0:
+        raise ValueError(f"At least {LOBBY_SIZE} players are required to form a lobby.")
+
+    selected_players = _select_from_queue(db, players, lobby_count * LOBBY_SIZE, rotation)
+    sitting_out = [player for player in players if player not in selected_players]
+    mmrs = get_effective_mmrs(db, [player.id for player in selected_players])
+
+    lobby_indices, lobby_spread, lobby_spread_bound = partition_lobbies(
+        [mmrs[player.id] for player in selected_players],
+        [player.role == 'sniper' for player in selected_players],
+        lobby_count,
+        time_budget,
+    )
+
+    lobbies = []
+    for indices in lobby_indices:
+        lobby_players = [selected_players[i] for i in indices]
+        if constraints is None or constraints.only_default_quotas(lobby_players):
+            team_a, team_b, mmr_diff = best_split(lobby_players, mmrs)
+        else:
+            team_a, team_b, mmr_diff = constrained_splits(lobby_players, mmrs, constraints)[0]
+        lobbies.append({
+            'team_a': [player.discord_id for player in team_a],
+            'team_b': [player.discord_id for player in team_b],
+            'mmr_diff': mmr_diff,
+            'mmr_average': sum(mmrs[player.id] for player in lobby_players) / len(lobby_players),
+        })
+
+    logger.info(
+        f"Balanced {lobby_count} lobbies with a lobby MMR spread of {lobby_spread} "
+        f"(lower bound {lobby_spread_bound}), {len(sitting_out)} players sitting out"
+    )
+    return {
+        'lobbies': lobbies,
+        'sitting_out': [player.discord_id for player in sitting_out],
+        'lobby_spread': lobby_spread,
+        'lobby_spread_bound': lobby_spread_bound,
+        'queue': _queue_order(db, players, selected_players, rotation),
+    }
+
+
+def partition_lobbies(
+    mmrs: List[int], snipers: List[bool], lobby_count: int, time_budget: float = LOBBY_TIME_BUDGET
+) -> Tuple[list, int, int]:
+    """
+    Partition players into lobby_count lobbies of LOBBY_SIZE, balanced within and across lobbies.
+
+    A lobby's cost is the MMR difference of its best split, as best_split finds it, plus the
+    distance of its MMR total from the mean lobby total. Teams are seeded greedily, strongest
+    player first into the weakest team with room, and paired into lobbies. The partition is then
+    improved with the player swap between two lobbies that lowers their cost the most, all
+    candidate swaps being evaluated at once, until no swap helps. While time is left, the best
+    partition is perturbed with random swaps and improved again, until LOBBY_STALL_ROUNDS
+    perturbations in a row found nothing better.
+
+    Returns:
+        tuple: The player indices of each lobby, the difference between the highest and lowest
+            lobby MMR total, and a lower bound on that difference.
+    """
+    deadline = time.perf_counter() + time_budget
+    values = np.asarray(mmrs, dtype=np.int64)
+    is_sniper = np.asarray(snipers, dtype=np.int64)
+    team_size = LOBBY_SIZE // 2
+    spread_bound = lobby_spread_bound(values, lobby_count)
+
+    teams = [[] for _ in range(2 * lobby_count)]
+    team_sums = [0] * len(teams)
+    for i in np.argsort(-values, kind='stable').tolist():
+        team = min((team for team in range(len(teams)) if len(teams[team]) < team_size), key=team_sums.__getitem__)
+        teams[team].append(i)
+        team_sums[team] += int(values[i])
+    assignment = np.array([teams[2 * lobby] + teams[2 * lobby + 1] for lobby in range(lobby_count)])
+
+    mean_total = values.sum() / lobby_count
+    _improve_lobbies(assignment, values, is_sniper, mean_total, deadline)
+    best = assignment.copy()
+    best_cost = _lobby_costs(values[best], is_sniper[best], mean_total).sum()
+    stalled = 0
+    while lobby_count > 1 and stalled < LOBBY_STALL_ROUNDS and time.perf_counter() < deadline:
+        stalled += 1
+        assignment = best.copy()
+        for _ in range(random.randint(1, LOBBY_SIZE)):
+            lobby_a, lobby_b = random.sample(range(lobby_count), 2)
+            slot_a, slot_b = random.randrange(LOBBY_SIZE), random.randrange(LOBBY_SIZE)
+            assignment[lobby_a, slot_a], assignment[lobby_b, slot_b] = assignment[lobby_b, slot_b], assignment[lobby_a, slot_a]
+        _improve_lobbies(assignment, values, is_sniper, mean_total, deadline)
+        cost = _lobby_costs(values[assignment], is_sniper[assignment], mean_total).sum()
+        if cost < best_cost:
+            best, best_cost, stalled = assignment, cost, 0
+
+    totals = values[best].sum(axis=1)
+    return best.tolist(), int(totals.max() - totals.min()), spread_bound
+
+
+def lobby_spread_bound(values: np.ndarray, lobby_count: int) -> int:
+    """
+    A lower bound on the difference between the highest and lowest lobby MMR total of any
+    partition of the players into lobby_count lobbies of LOBBY_SIZE: the highest total is at
+    least the mean total rounded up and _highest_total_bound, and the lowest total at most the
+    mean rounded down and the same bound taken from the weakest players.
+    """
+    values = np.sort(np.asarray(values, dtype=np.int64))
+    total = int(values.sum())
+    highest = max(-(-total // lobby_count), _highest_total_bound(values[::-1], lobby_count))
+    lowest = min(total // lobby_count, -_highest_total_bound(-values, lobby_count))
+    return highest - lowest
+
+
+def _highest_total_bound(descending: np.ndarray, lobby_count: int) -> int:
+    """
+    Among the (t - 1) * lobby_count + 1 first players, some lobby holds t, so its total is at
+    least the t last of them plus the LOBBY_SIZE - t last players, for every t from 1 to LOBBY_SIZE.
+    """
+    # prefix[i] is the sum of the i first values
+    prefix = np.concatenate(([0], np.cumsum(descending)))
+    t = np.arange(1, LOBBY_SIZE + 1)
+    first = (t - 1) * lobby_count + 1
+    return int((prefix[first] - prefix[first - t] + prefix[-1] - prefix[len(descending) - (LOBBY_SIZE - t)]).max())
+
+
+def _lobby_costs(lobby_mmrs: np.ndarray, lobby_snipers: np.ndarray, mean_total: float) -> np.ndarray:
+    """
+    The cost of each lobby (one row per lobby): the MMR difference of its best split, with the
+    sniper rule of best_split, plus the distance of its MMR total from mean_total.
+    """
+    _, in_team_a = split_table(LOBBY_SIZE, LOBBY_SIZE // 2)
+    totals = lobby_mmrs.sum(axis=1)
+    mmr_diffs = np.abs(2 * (lobby_mmrs @ in_team_a.T) - totals[:, None]).astype(float)
+
+    sniper_counts = lobby_snipers.sum(axis=1)[:, None]
+    snipers_team_a = lobby_snipers @ in_team_a.T
+    invalid = (sniper_counts >= 2) & ((snipers_team_a < 1) | (snipers_team_a >= sniper_counts))
+    mmr_diffs[invalid] = np.inf
+    return mmr_diffs.min(axis=1) + np.abs(totals - mean_total)
+
+
+def _improve_lobbies(
+    assignment: np.ndarray, values: np.ndarray, is_sniper: np.ndarray, mean_total: float, deadline: float
+) -> None:
+    """
+    Swap players between lobbies, in place, while a swap lowers the cost of the two lobbies,
+    or until the deadline.
+    """
+    slots_a, slots_b = np.divmod(np.arange(LOBBY_SIZE * LOBBY_SIZE), LOBBY_SIZE)
+    swaps = np.arange(len(slots_a))
+    costs = _lobby_costs(values[assignment], is_sniper[assignment], mean_total)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for lobby_a, lobby_b in itertools.combinations(range(len(assignment)), 2):
+            # Every lobby A and lobby B after swapping player slots_a[k] of A with slots_b[k] of B
+            swapped_a = np.repeat(assignment[lobby_a][None, :], len(swaps), axis=0)
+            swapped_b = np.repeat(assignment[lobby_b][None, :], len(swaps), axis=0)
+            swapped_a[swaps, slots_a] = assignment[lobby_b][slots_b]
+            swapped_b[swaps, slots_b] = assignment[lobby_a][slots_a]
+            cost_a = _lobby_costs(values[swapped_a], is_sniper[swapped_a], mean_total)
+            cost_b = _lobby_costs(values[swapped_b], is_sniper[swapped_b], mean_total)
+
+            best = int(np.argmin(cost_a + cost_b))
+            if cost_a[best] + cost_b[best] < costs[lobby_a] + costs[lobby_b] - 1e-9:
+                assignment[lobby_a], assignment[lobby_b] = swapped_a[best], swapped_b[best]
+                costs[lobby_a], costs[lobby_b] = cost_a[best], cost_b[best]
+                improved = True
+
+
+def select_players(players: list, count: int, queue_order: list = None) -> list:
+    """
+    Pick count players to play, in random order: all core members first, and random
+    non-core members for the remaining slots. If there are more core members than slots,
+    a random sample of them is picked. With queue_order, the players ordered by the rotation
+    queue, the players first in the queue are picked instead of random ones.
+    """
+    if queue_order is not None:
+        players = queue_order
+
+        def sample(group, k):
+            return group[:k]
+    else:
+        sample = random.sample
 
     core_members = [player for player in players if player.core_member]
     non_core_members = [player for player in players if not player.core_member]
-    total_players = len(core_members) + len(non_core_members)
-    if total_players < 10:
-        raise ValueError("At least 10 players are required to form two teams of five.")
 
-    if len(core_members) >= 10:
-        selected_players = random.sample(core_members, 10)
+    if len(core_members) >= count:
+        selected_players = sample(core_members, count)
 
     else:
         # Include all core members
         selected_players = core_members.copy()
         # Need to fill up remaining slots with non-core members
-        remaining_slots = 10 - len(core_members)
+        remaining_slots = count - len(core_members)
         if len(non_core_members) < remaining_slots:
             raise ValueError(
                 f"Not enough non-core members to fill the teams. Need {remaining_slots}, "
                 f"but have {len(non_core_members)}"
             )
         # Randomly select non-core members to fill up
-        selected_players.extend(random.sample(non_core_members, remaining_slots))
+        selected_players.extend(sample(non_core_members, remaining_slots))
 
     random.shuffle(selected_players)
+    return selected_players
 
-    # Define team size
-    team_size = 5
 
-    # Initialize variables to track the best team combination
-    min_mmr_diff = float('inf')
-    best_team_a = []
-    best_team_b = []
-
-    constraints = {
-        'roles': {
-            'sniper': 1
-        },
-        'conflicts': [
-        ]
-    }
+def best_split(selected_players: list, mmrs: Dict[int, int], team_size: int = 5) -> Tuple[list, list, int]:
+    """
+    Find the split of the selected players into two teams with the smallest MMR difference.
 
-    # Generate all possible combinations for team A
+    Returns:
+        tuple: The players of team A, the players of team B and their MMR difference.
+    """
+    return top_splits(selected_players, mmrs, 1, team_size)[0][:3]
+
+
+def top_splits(
+    selected_players: list,
+    mmrs: Dict[int, int],
+    count: int,
+    team_size: int = 5,
+    objective: str = 'mmr_difference',
+    sigmas: Dict[int, float] = None,
+    pair_synergy: np.ndarray = None,
+) -> list:
+    """
+    Find the count splits of the selected players into two teams with the lowest score by the
+    objective, a key of OBJECTIVES, evaluating every split at once. sigmas holds the MMR
+    uncertainty of each player for the objectives that use it. With pair_synergy, the synergy
+    of every pair of the selected players, SYNERGY_WEIGHT times the difference between the
+    teams' summed pair synergies is added to the score. When at least two snipers are selected,
+    each team needs one. Ties go to the first split in combination order.
+
+    Returns:
+        list: (team A players, team B players, MMR difference, score) tuples, best first.
+    """
     player_indices = list(range(len(selected_players)))
-    player_roles = [player.role for player in selected_players]
+    combos, in_team_a = split_table(len(selected_players), team_size)
 
-    sniper_count = sum(1 for role in player_roles if role == 'sniper')
+    # Team A's MMR sum and the absolute difference to team B, for every split
+    player_mmrs = np.array([mmrs[player.id] for player in selected_players], dtype=np.int64)
+    mmr_team_a = in_team_a @ player_mmrs
+    mmr_diffs = np.abs(2 * mmr_team_a - player_mmrs.sum())
 
-    combinations = list(itertools.combinations(player_indices, team_size))
+    # Swapping the teams gives the same split, so only the splits with the first player in team A
+    # count. They come first in combination order, so ties still go to the same split.
+    valid = in_team_a[:, 0] == 1
 
-    # Iterate through all possible team combinations
-    for combo in combinations:
-        team_a_indices = set(combo)
-        team_b_indices = set(player_indices) - team_a_indices
+    # With at least two snipers, each team needs one
+    is_sniper = np.array([player.role == 'sniper' for player in selected_players], dtype=np.int64)
+    sniper_count = int(is_sniper.sum())
+    if sniper_count >= 2:
+        snipers_team_a = in_team_a @ is_sniper
+        valid &= (snipers_team_a >= 1) & (snipers_team_a < sniper_count)
 
-        team_a = [selected_players[i] for i in team_a_indices]
-        team_b = [selected_players[i] for i in team_b_indices]
+    if not valid.any():
+        raise ValueError("Unable to balance teams with the given constraints")
 
-        if sniper_count >= 2:
-            if not snipers_balanced(team_a, team_b):
-                continue
+    valid_splits = np.flatnonzero(valid)
+    scores = np.full(len(combos), np.inf)
+    scores[valid_splits] = split_scores(
+        selected_players, mmrs, in_team_a[valid_splits], objective, sigmas, pair_synergy
+    )
+    ranked = valid_splits[np.argsort(scores[valid_splits], kind='stable')[:count]]
 
-        # Check role constraints
-        # if not roles_balanced(team_a, team_b, constraints['roles']):
-        #     continue
-        #
-        # # Check conflicts
-        # if not conflicts_respected(team_a, team_b, constraints['conflicts']):
-        #     continue
+    splits = []
+    for split in ranked:
+        team_a_indices = set(combos[split].tolist())
+        team_b_indices = set(player_indices) - team_a_indices
+        team_a = [selected_players[i] for i in team_a_indices]
+        team_b = [selected_players[i] for i in team_b_indices]
+        splits.append((team_a, team_b, int(mmr_diffs[split]), float(scores[split])))
+    return splits
+
+
+def split_scores(
+    selected_players: list,
+    mmrs: Dict[int, int],
+    in_team_a: np.ndarray,
+    objective: str = 'mmr_difference',
+    sigmas: Dict[int, float] = None,
+    pair_synergy: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Score splits of the selected players, given as 0/1 team A membership rows, by the objective,
+    plus SYNERGY_WEIGHT times the difference between the teams' summed pair synergies with
+    pair_synergy.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown balancing objective {objective!r}, expected one of: {', '.join(OBJECTIVES)}")
+    # In player id order, so a split scores the same whatever order the players were selected in
+    by_id = np.argsort([player.id for player in selected_players], kind='stable')
+    player_mmrs = np.array([mmrs[selected_players[i].id] for i in by_id], dtype=np.int64)
+    player_sigmas = np.array([(sigmas or {}).get(selected_players[i].id, 0.0) for i in by_id])
+    scores = OBJECTIVES[objective](player_mmrs, player_sigmas, in_team_a[:, by_id])
+    if pair_synergy is not None:
+        synergy_a = ((in_team_a @ pair_synergy) * in_team_a).sum(axis=1) / 2
+        synergy_b = (((1 - in_team_a) @ pair_synergy) * (1 - in_team_a)).sum(axis=1) / 2
+        scores = scores + SYNERGY_WEIGHT * np.abs(synergy_a - synergy_b)
+    return scores
+
+
+def mmr_difference_scores(player_mmrs: np.ndarray, player_sigmas: np.ndarray, in_team_a: np.ndarray) -> np.ndarray:
+    """
+    The absolute difference between the teams' MMR sums, for every split.
+    """
+    return np.abs(2 * (in_team_a @ player_mmrs) - player_mmrs.sum())
 
-        # Calculate total MMR for each team
-        mmr_team_a = sum(player.mmr for player in team_a)
-        mmr_team_b = sum(player.mmr for player in team_b)
 
-        # Calculate the absolute difference in MMR between the two teams
-        mmr_diff = abs(mmr_team_a - mmr_team_b)
+def win_probability_scores(player_mmrs: np.ndarray, player_sigmas: np.ndarray, in_team_a: np.ndarray) -> np.ndarray:
+    """
+    How far team A's predicted win probability is from a coin flip, for every split.
+
+    A team's strength is its mean MMR plus SPREAD_WEIGHT times the standard deviation of its
+    MMRs, and the win probability is the logistic curve of the rating model over the strength
+    difference, averaged over WIN_PROBABILITY_SAMPLES draws of the players' MMRs from their
+    uncertainty. The same draws are used for every split, so the scores are deterministic. The
+    probability is converted back to the team MMR sum difference that predicts it, so that it
+    compares with the MMR difference objective and the repeat penalty.
+    """
+    rng = np.random.default_rng(0)
+    draws = player_mmrs + player_sigmas * rng.standard_normal((WIN_PROBABILITY_SAMPLES, len(player_mmrs)))
+
+    strengths = []
+    for in_team in (in_team_a, 1 - in_team_a):
+        membership = in_team.T / in_team.sum(axis=1)
+        means = draws @ membership
+        deviations = np.sqrt(np.maximum((draws ** 2) @ membership - means ** 2, 0))
+        strengths.append(means + SPREAD_WEIGHT * deviations)
+    strength_diffs = strengths[0] - strengths[1]
+
+    win_scale = HltvModel().win_scale
+    win_probabilities = (1 / (1 + 10 ** (-strength_diffs / win_scale))).mean(axis=0)
+    win_probabilities = np.clip(win_probabilities, 1e-12, 1 - 1e-12)
+    mean_diffs = win_scale * np.abs(np.log10(win_probabilities / (1 - win_probabilities)))
+    return mean_diffs * in_team_a.sum(axis=1)
+
+
+OBJECTIVES = {
+    'mmr_difference': mmr_difference_scores,
+    'win_probability': win_probability_scores,
+}
+
+if BALANCE_OBJECTIVE not in OBJECTIVES:
+    raise ValueError(
+        f"Unknown BALANCE_OBJECTIVE {BALANCE_OBJECTIVE!r}, expected one of: {', '.join(OBJECTIVES)}"
+    )
+
+
+def constrained_splits(
+    selected_players: list, mmrs: Dict[int, int], constraints: SplitConstraints, count: int = 1, team_size: int = 5
+) -> list:
+    """
+    Find the count splits of the selected players into two teams with the smallest MMR
+    difference that satisfy the constraints, with a branch-and-bound search.
 
-        # Update the best team combination if a better one is found
-        if mmr_diff < min_mmr_diff:
-            min_mmr_diff = mmr_diff
-            best_team_a = team_a
-            best_team_b = team_b
+    Premade groups are merged into units that are placed on a team as a whole, largest and
+    strongest first, each on the weaker team first. A branch is cut as soon as a team is full, a
+    conflict pair ends up on one team, the remaining players can no longer fill a role quota, or
+    the best MMR difference still reachable, bounded by the lowest and highest sums of the
+    players left for team A's open slots, is no better than the worst of the count best splits
+    found so far, which are kept in a bounded heap. Ties go to the split found first.
 
-            # Early exit if perfect balance is found
-            if mmr_diff == 0:
-                break
+    Returns:
+        list: (team A players, team B players, MMR difference) tuples, best first.
 
-    if not best_team_a or not best_team_b:
-        raise ValueError("Unable to balance teams with the given constraints")
+    Raises:
+        ValueError: If no split satisfies the constraints, naming the constraints involved.
+    """
+    def name(i):
+        return selected_players[i].username or selected_players[i].discord_name or selected_players[i].discord_id
+
+    index_by_steamid = {player.steamid: i for i, player in enumerate(selected_players) if player.steamid}
+
+    # Merge the premade groups, overlapping ones included, into units
+    unit_of = list(range(len(selected_players)))
+
+    def find(i):
+        while unit_of[i] != i:
+            unit_of[i] = unit_of[unit_of[i]]
+            i = unit_of[i]
+        return i
+
+    premades = []
+    for group in constraints.premades:
+        members = [index_by_steamid[steamid] for steamid in group if steamid in index_by_steamid]
+        if len(members) >= 2:
+            premades.append(members)
+            for i in members[1:]:
+                unit_of[find(i)] = find(members[0])
+    members_by_root = {}
+    for i in range(len(selected_players)):
+        members_by_root.setdefault(find(i), []).append(i)
+    units = sorted(
+        members_by_root.values(),
+        key=lambda members: (-len(members), -sum(mmrs[selected_players[i].id] for i in members))
+    )
+    unit_index = {i: u for u, members in enumerate(units) for i in members}
+
+    for members in units:
+        if len(members) > team_size:
+            raise ValueError(
+                f"Premade group {', '.join(name(i) for i in members)} has more than {team_size} players."
+            )
 
-    # Prepare the output data
-    team_a_output = [
-        player.discord_id for player in best_team_a
-    ]
-    team_b_output = [
-        player.discord_id for player in best_team_b
+    conflicts = []
+    conflict_masks = [0] * len(units)
+    for steamid_a, steamid_b in constraints.conflicts:
+        if steamid_a not in index_by_steamid or steamid_b not in index_by_steamid:
+            continue
+        a, b = index_by_steamid[steamid_a], index_by_steamid[steamid_b]
+        conflicts.append((a, b))
+        if unit_index[a] == unit_index[b]:
+            raise ValueError(f"{name(a)} and {name(b)} must not play together, but are in the same premade group.")
+        conflict_masks[unit_index[a]] |= 1 << unit_index[b]
+        conflict_masks[unit_index[b]] |= 1 << unit_index[a]
+
+    quotas = []
+    for role, quota in constraints.role_quotas.items():
+        role_count = sum(1 for player in selected_players if player.role == role)
+        if min(quota, role_count // 2) > 0:
+            quotas.append((role, min(quota, role_count // 2)))
+
+    unit_sizes = [len(members) for members in units]
+    unit_mmrs = [sum(mmrs[selected_players[i].id] for i in members) for members in units]
+    unit_roles = [
+        tuple(sum(1 for i in members if selected_players[i].role == role) for role, _ in quotas) for members in units
     ]
+    total = sum(unit_mmrs)
+
+    # For the units from u on: the players of each quota role left, and the lowest and highest
+    # MMR sums of k of their players
+    roles_left = [[0] * len(quotas) for _ in range(len(units) + 1)]
+    lowest_sums, highest_sums = [[0]] * (len(units) + 1), [[0]] * (len(units) + 1)
+    for u in range(len(units) - 1, -1, -1):
+        roles_left[u] = [left + unit_count for left, unit_count in zip(roles_left[u + 1], unit_roles[u])]
+        remaining = sorted(mmrs[selected_players[i].id] for members in units[u:] for i in members)
+        lowest_sums[u] = list(itertools.accumulate(remaining, initial=0))
+        highest_sums[u] = list(itertools.accumulate(reversed(remaining), initial=0))
+
+    # The count best splits so far as (-difference, -order found, team A units), worst on top
+    best = []
+    found = itertools.count()
+    perfect = total % 2
+
+    def bound():
+        return -best[0][0] if len(best) == count else float('inf')
+
+    def search(u, size_a, size_b, sum_a, roles_a, roles_b, mask_a, mask_b):
+        if u == len(units):
+            diff = abs(2 * sum_a - total)
+            if len(best) < count:
+                heapq.heappush(best, (-diff, -next(found), mask_a))
+            elif diff < bound():
+                heapq.heapreplace(best, (-diff, -next(found), mask_a))
+            return
+        open_a = team_size - size_a
+        if open_a > len(lowest_sums[u]) - 1:
+            return
+        lower_bound = max(
+            0, 2 * (sum_a + lowest_sums[u][open_a]) - total, total - 2 * (sum_a + highest_sums[u][open_a])
+        )
+        if lower_bound >= bound():
+            return
+
+        # The first unit goes to team A, as swapping the teams gives the same split
+        if u == 0:
+            teams = (True,)
+        else:
+            sum_b = total - lowest_sums[u][-1] - sum_a
+            teams = (True, False) if sum_a <= sum_b else (False, True)
+        for to_a in teams:
+            size, mask = (size_a, mask_a) if to_a else (size_b, mask_b)
+            if size + unit_sizes[u] > team_size or conflict_masks[u] & mask:
+                continue
+            if to_a:
+                new_roles_a = tuple(map(sum, zip(roles_a, unit_roles[u])))
+                new_roles_b = roles_b
+            else:
+                new_roles_a = roles_a
+                new_roles_b = tuple(map(sum, zip(roles_b, unit_roles[u])))
+            left = roles_left[u + 1]
+            if any(
+                (roles_team_a < needed and roles_team_a + count_left < needed)
+                or (roles_team_b < needed and roles_team_b + count_left < needed)
+                or roles_team_a + roles_team_b + count_left < 2 * needed
+                for (_, needed), roles_team_a, roles_team_b, count_left in zip(quotas, new_roles_a, new_roles_b, left)
+            ):
+                continue
+            if to_a:
+                search(u + 1, size_a + unit_sizes[u], size_b, sum_a + unit_mmrs[u],
+                       new_roles_a, new_roles_b, mask_a | 1 << u, mask_b)
+            else:
+                search(u + 1, size_a, size_b + unit_sizes[u], sum_a,
+                       new_roles_a, new_roles_b, mask_a, mask_b | 1 << u)
+            if bound() == perfect:
+                return
+
+    search(0, 0, 0, 0, (0,) * len(quotas), (0,) * len(quotas), 0, 0)
+
+    if not best:
+        active = [f"at least {needed} {role} per team" for role, needed in quotas]
+        active += [f"{name(a)} and {name(b)} apart" for a, b in conflicts]
+        active += [f"{', '.join(name(i) for i in members)} together" for members in premades]
+        raise ValueError(f"No split into teams of {team_size} satisfies the constraints: {'; '.join(active)}.")
+
+    splits = []
+    for negative_diff, _, mask_a in sorted(best, reverse=True):
+        team_a_indices = sorted(i for u, members in enumerate(units) if mask_a >> u & 1 for i in members)
+        team_b_indices = sorted(i for u, members in enumerate(units) if not mask_a >> u & 1 for i in members)
+        team_a = [selected_players[i] for i in team_a_indices]
+        team_b = [selected_players[i] for i in team_b_indices]
+        splits.append((team_a, team_b, -negative_diff))
+    return splits
 
-    logger.info(f"Teams balanced with MMR difference of {min_mmr_diff}")
 
-    return team_a_output, team_b_output, min_mmr_diff
+@lru_cache(maxsize=None)
+def split_table(player_count: int, team_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Every choice of team_size players for team A, in itertools.combinations order, built once
+    per lobby size.
+
+    Returns:
+        tuple: The player indices of team A per split (splits x team_size), and the same as a
+            membership mask (splits x player_count). Both are read only.
+    """
+    combos = np.array(list(itertools.combinations(range(player_count), team_size)), dtype=np.intp)
+    in_team_a = np.zeros((len(combos), player_count), dtype=np.int64)
+    in_team_a[np.arange(len(combos))[:, None], combos] = 1
+    combos.flags.writeable = False
+    in_team_a.flags.writeable = False
+    return combos, in_team_a
 
 
 def roles_balanced(
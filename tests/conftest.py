@@ -0,0 +1,25 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# database.database opens ./players.db on import, keep it out of the working tree
+os.chdir(tempfile.mkdtemp(prefix='cs2-bot-tests-'))
+
+from database.database import Base  # noqa: E402
+from services import models  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine, autocommit=False, autoflush=False)()
+    yield session
+    session.close()
+    engine.dispose()
@@ -0,0 +1,38 @@
+import datetime
+
+from services import models
+
+
+def add_players(db, count: int, mmr: int = 1000) -> list:
+    players = [
+        models.Player(username=f'player{i}', steamid=str(76561198000000000 + i), discord_id=str(1000 + i), mmr=mmr)
+        for i in range(count)
+    ]
+    db.add_all(players)
+    db.commit()
+    return players
+
+
+def add_match(db, date_time: datetime.datetime, team_a: list, team_b: list, winner: str = 'terrorist',
+              score: tuple = (13, 8), seed: int = 0) -> models.Match:
+    """
+    Add a match between team_a (terrorist) and team_b (counter_terrorist), given as player ids,
+    with stats derived from seed.
+    """
+    match = models.Match(
+        date_time=date_time, map_name='de_mirage', team1_name='terrorist', team2_name='counter_terrorist',
+        team1_score=score[0], team2_score=score[1], winner=winner,
+        team_results=f'{date_time.isoformat()}-{seed}',
+    )
+    db.add(match)
+    db.flush()
+    for team_name, team, rounds_won in (('terrorist', team_a, score[0]), ('counter_terrorist', team_b, score[1])):
+        for i, player_id in enumerate(team):
+            value = (seed * 7 + player_id * 3 + i) % 17
+            db.add(models.PlayerMatchStats(
+                match_id=match.id, player_id=player_id, team=team_name, kills_total=8 + value,
+                deaths_total=10 + (value * 5) % 9, assists_total=value % 6, damage_total=1500 + 90 * value,
+                rounds_won=rounds_won,
+            ))
+    db.commit()
+    return match
@@ -0,0 +1,128 @@
+import asyncio
+import contextlib
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from bot import commands
+from helpers import add_players
+from services.mapping_index import MappingIndex
+from services.rotation import RotationQueue
+
+
+class FakeResponse:
+    def __init__(self):
+        self.messages = []
+        self.deferred = False
+
+    async def send_message(self, content=None, **kwargs):
+        assert not self.deferred, "responded after deferring"
+        self.messages.append(content)
+
+    async def defer(self):
+        self.deferred = True
+
+
+class FakeFollowup:
+    def __init__(self, response):
+        self.response = response
+        self.messages = []
+
+    async def send(self, content=None, embed=None):
+        assert self.response.deferred, "followup before deferring"
+        self.messages.append(content or embed)
+
+
+class FakeGuild:
+    def __init__(self):
+        self.id = 1
+        self.voice_channels = []
+
+    async def create_voice_channel(self, name):
+        channel = SimpleNamespace(name=name)
+        self.voice_channels.append(channel)
+        return channel
+
+    def get_member(self, member_id):
+        return None
+
+
+@pytest.fixture
+def bot_state(db, monkeypatch):
+    monkeypatch.setattr(commands, 'get_db', lambda: contextlib.nullcontext(db))
+    monkeypatch.setattr(commands, 'rotation_queue', RotationQueue())
+    monkeypatch.setattr(commands, 'team_assignments', {})
+    monkeypatch.setattr(commands, 'recent_team_assignments', {})
+    monkeypatch.setattr(commands, 'lobby_assignments', {})
+    monkeypatch.setattr(commands, 'mapping_index', MappingIndex('mapping.json'))
+    return commands
+
+
+def interaction(voice_members=()):
+    response = FakeResponse()
+    user = SimpleNamespace(voice=SimpleNamespace(channel=SimpleNamespace(members=list(voice_members))))
+    return SimpleNamespace(guild=FakeGuild(), response=response, followup=FakeFollowup(response), user=user)
+
+
+def games(db, rotation, players):
+    rotation.order(db, [player.id for player in players])
+    return {player.id: rotation.entries[player.id][0] for player in players}
+
+
+def test_start_counts_a_game_once(db, bot_state):
+    players = add_players(db, 10)
+    ids = [player.discord_id for player in players]
+    bot_state.team_assignments[1] = {
+        'team_a': ids[:5], 'team_b': ids[5:], 'options': [(ids[:5], ids[5:], 0)], 'option': 0, 'started': False
+    }
+
+    asyncio.run(bot_state.start.callback(interaction()))
+    asyncio.run(bot_state.start.callback(interaction()))
+
+    assert set(games(db, bot_state.rotation_queue, players).values()) == {1}
+    assert len(bot_state.recent_team_assignments[1]) == 1
+
+
+def test_start_lobbies_moves_the_lobby_players_to_the_back_of_the_queue(db, bot_state):
+    players = add_players(db, 22)
+    ids = [player.discord_id for player in players]
+    bot_state.lobby_assignments[1] = {'lobbies': [
+        {'team_a': ids[:5], 'team_b': ids[5:10]}, {'team_a': ids[10:15], 'team_b': ids[15:20]}
+    ], 'started': False}
+    guild_interaction = interaction()
+
+    asyncio.run(bot_state.start_lobbies.callback(guild_interaction))
+    asyncio.run(bot_state.start_lobbies.callback(interaction()))
+
+    counts = games(db, bot_state.rotation_queue, players)
+    assert [counts[player.id] for player in players] == [1] * 20 + [0] * 2
+    assert bot_state.rotation_queue.order(db, [player.id for player in players])[:2] == [p.id for p in players[20:]]
+    assert sorted(channel.name for channel in guild_interaction.guild.voice_channels) == [
+        'lobby-1-team-1', 'lobby-1-team-2', 'lobby-2-team-1', 'lobby-2-team-2'
+    ]
+
+
+def test_lobbies_defers_and_keeps_the_conflicts_apart(db, bot_state):
+    players = add_players(db, 10)
+    for player, mmr in zip(players, [500, 500, 2000] + [1000] * 7):
+        player.mmr = mmr
+    db.commit()
+    with open('mapping.json', 'w') as f:
+        json.dump({'conflicts': [[players[0].steamid, players[1].steamid]]}, f)
+    lobbies_interaction = interaction(SimpleNamespace(id=int(player.discord_id)) for player in players)
+
+    asyncio.run(bot_state.lobbies.callback(lobbies_interaction))
+
+    assert lobbies_interaction.response.deferred
+    assert [message.title for message in lobbies_interaction.followup.messages] == ["1 lobbies"]
+    lobby = bot_state.lobby_assignments[1]['lobbies'][0]
+    assert (players[0].discord_id in lobby['team_a']) != (players[1].discord_id in lobby['team_a'])
+
+
+def test_lobbies_reports_unregistered_players_after_deferring(db, bot_state):
+    lobbies_interaction = interaction([SimpleNamespace(id=42)])
+
+    asyncio.run(bot_state.lobbies.callback(lobbies_interaction))
+
+    assert lobbies_interaction.followup.messages == ["<@42> not registered, please use /register"]
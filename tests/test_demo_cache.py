@@ -0,0 +1,36 @@
+import logging
+
+import pandas as pd
+
+from utils.demo_cache import DemoCache, demo_content_hash
+
+
+def test_store_and_load_round_trip(tmp_path):
+    demo = tmp_path / 'match.dem'
+    demo.write_bytes(b'demo' * 1000)
+    cache = DemoCache(str(tmp_path / 'cache'))
+    content_hash = demo_content_hash(str(demo))
+    round_end_events = pd.DataFrame({'round': [1, 2], 'winner': ['CT', 'T']})
+    players = pd.DataFrame({'steamid': ['1', '2'], 'kills_total': [10, 12]})
+
+    assert cache.load(content_hash) is None
+    cache.store(content_hash, {'map_name': 'de_inferno'}, round_end_events, players)
+
+    entry = cache.load(content_hash)
+    assert entry['header'] == {'map_name': 'de_inferno'}
+    pd.testing.assert_frame_equal(entry['round_end_events'], round_end_events)
+    pd.testing.assert_frame_equal(entry['players'], players)
+    assert entry['rounds'] is None
+
+
+def test_store_failure_is_logged(tmp_path, caplog):
+    cache_dir = tmp_path / 'cache'
+    # A file where the cache directory should be
+    cache_dir.write_text('')
+    cache = DemoCache(str(cache_dir))
+
+    with caplog.at_level(logging.WARNING):
+        cache.store('ab' * 16, {}, pd.DataFrame(), pd.DataFrame())
+
+    assert 'Failed to cache demo data' in caplog.text
+    assert cache.load('ab' * 16) is None
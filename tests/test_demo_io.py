@@ -0,0 +1,114 @@
+import bz2
+import gzip
+import os
+import sys
+import tempfile
+
+import pytest
+
+from utils import demo_io
+from utils.demo_io import demo_file_name, is_demo_file, open_demo
+
+DEMO = bytes(range(256)) * 1000
+
+
+def write_zstd(path, data):
+    zstandard = pytest.importorskip('zstandard')
+    with open(path, 'wb') as demo_file:
+        demo_file.write(zstandard.ZstdCompressor().compress(data))
+
+
+def writer(open_compressed):
+    def write(path, data):
+        with open_compressed(path, 'wb') as demo_file:
+            demo_file.write(data)
+    return write
+
+
+COMPRESSORS = {
+    '.gz': writer(gzip.open),
+    '.bz2': writer(bz2.open),
+    '.zst': write_zstd,
+}
+
+
+@pytest.fixture(autouse=True)
+def scratch_dir(tmp_path, monkeypatch):
+    # Keep the scratch files of the tests apart, and stream in several chunks
+    scratch_dir = tmp_path / 'scratch'
+    scratch_dir.mkdir()
+    monkeypatch.setattr(tempfile, 'tempdir', str(scratch_dir))
+    monkeypatch.setattr(demo_io, 'CHUNK_SIZE', 4096)
+    return scratch_dir
+
+
+def compressed_demo(tmp_path, suffix, data=DEMO, name='2024-09-01_20-00-00'):
+    path = str(tmp_path / f'{name}.dem{suffix}')
+    COMPRESSORS[suffix](path, data)
+    return path
+
+
+@pytest.mark.parametrize('suffix', sorted(COMPRESSORS))
+def test_compressed_demo_round_trip(tmp_path, scratch_dir, suffix):
+    path = compressed_demo(tmp_path, suffix)
+
+    assert is_demo_file(path)
+    assert demo_file_name(path) == '2024-09-01_20-00-00.dem'
+    with open_demo(path) as raw_path:
+        assert os.path.dirname(raw_path) == str(scratch_dir)
+        with open(raw_path, 'rb') as raw:
+            assert raw.read() == DEMO
+
+    # The scratch file only lives while the demo is used
+    assert os.listdir(scratch_dir) == []
+
+
+@pytest.mark.parametrize('suffix', sorted(COMPRESSORS))
+def test_scratch_file_is_reused_by_the_next_demo(tmp_path, scratch_dir, suffix):
+    first = compressed_demo(tmp_path, suffix)
+    second = compressed_demo(tmp_path, suffix, data=DEMO[::-1][:1000], name='2024-09-02_20-00-00')
+
+    with open_demo(first) as first_raw_path:
+        pass
+    with open_demo(second) as second_raw_path:
+        with open(second_raw_path, 'rb') as raw:
+            assert raw.read() == DEMO[::-1][:1000]
+
+    assert first_raw_path == second_raw_path
+    assert os.listdir(scratch_dir) == []
+
+
+def test_raw_demo_is_used_in_place(tmp_path, scratch_dir):
+    path = tmp_path / '2024-09-01_20-00-00.dem'
+    path.write_bytes(DEMO)
+
+    with open_demo(str(path)) as raw_path:
+        assert raw_path == str(path)
+
+    assert path.read_bytes() == DEMO
+    assert os.listdir(scratch_dir) == []
+
+
+def test_scratch_file_is_removed_on_errors(tmp_path, scratch_dir):
+    with pytest.raises(KeyError):
+        with open_demo(compressed_demo(tmp_path, '.gz')):
+            raise KeyError
+
+    corrupt = tmp_path / 'corrupt.dem.gz'
+    corrupt.write_bytes(b'not gzip')
+    with pytest.raises(OSError):
+        with open_demo(str(corrupt)):
+            pass
+
+    assert os.listdir(scratch_dir) == []
+
+
+def test_zstd_without_a_decompressor(tmp_path, monkeypatch):
+    path = tmp_path / 'match.dem.zst'
+    path.write_bytes(b'')
+    monkeypatch.setitem(sys.modules, 'compression', None)
+    monkeypatch.setitem(sys.modules, 'zstandard', None)
+
+    with pytest.raises(RuntimeError, match='requires the zstandard package'):
+        with open_demo(str(path)):
+            pass
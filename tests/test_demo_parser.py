@@ -0,0 +1,64 @@
+import gzip
+import shutil
+
+import pytest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database.database import Base
+from services.mapping_index import MappingIndex
+from services.models import Match, Player, PlayerMatchStats, PlayerRoundStats, ProcessedDemo
+from utils import demo_parser
+from utils.ingest_benchmark import FakeDemoParser, create_fake_demos
+
+
+@pytest.fixture
+def fake_parser(monkeypatch):
+    # Worker processes are forked, so they inherit the fake parser
+    monkeypatch.setattr(demo_parser, 'DemoParser', FakeDemoParser)
+
+
+def new_session():
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine, autocommit=False, autoflush=False)()
+
+
+def contents(db):
+    tables = {}
+    for model in (Match, Player, PlayerMatchStats, PlayerRoundStats, ProcessedDemo):
+        mapper = inspect(model)
+        rows = db.query(model).order_by(*mapper.primary_key)
+        tables[model.__tablename__] = [tuple(getattr(row, column.key) for column in mapper.columns) for row in rows]
+    return tables
+
+
+@pytest.mark.parametrize('extract_rounds', [False, True])
+def test_parallel_ingest_matches_serial(fake_parser, tmp_path, extract_rounds):
+    demo_files = create_fake_demos(str(tmp_path), 8, seed=0)
+    # A compressed demo, a copy of a demo under another name and a demo that fails to decompress
+    with open(demo_files[3], 'rb') as raw, gzip.open(f'{demo_files[3]}.gz', 'wb') as compressed:
+        shutil.copyfileobj(raw, compressed)
+    demo_files[3] += '.gz'
+    copy = str(tmp_path / '2024-09-28_05-00-00_copy.dem')
+    shutil.copyfile(demo_files[1], copy)
+    broken = tmp_path / '2024-09-28_06-00-00_broken.dem.gz'
+    broken.write_bytes(b'not gzip')
+    demo_files[5:5] = [copy, str(broken)]
+
+    results = []
+    for workers in (1, 3):
+        db = new_session()
+        # The first demos were ingested before, the second run skips them
+        demo_parser.ingest_demo_files(demo_files[:2], MappingIndex(path=None), db, extract_rounds=extract_rounds)
+        demo_parser.ingest_demo_files(
+            demo_files + demo_files[:1], MappingIndex(path=None), db, workers=workers, extract_rounds=extract_rounds
+        )
+        results.append(contents(db))
+        db.close()
+
+    serial, parallel = results
+    assert len(serial['matches']) == 8
+    assert bool(serial['player_round_stats']) == extract_rounds
+    assert parallel == serial
@@ -0,0 +1,144 @@
+import asyncio
+import contextlib
+import os
+import tempfile
+from concurrent.futures import Executor, Future
+from types import SimpleNamespace
+
+import pytest
+
+from bot import ingest_queue
+from bot.ingest_queue import IngestJob, IngestQueue
+from services.mapping_index import MappingIndex
+from services.models import Match
+from utils import demo_parser
+from utils.ingest_benchmark import FakeDemoParser
+
+DEMO = bytes(range(256)) * 64
+
+
+class InlineExecutor(Executor):
+    """
+    Runs the parser in the calling thread, with the fake DemoParser of this process.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.content = self
+
+    def raise_for_status(self):
+        pass
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self.data), len(self.data) // 4):
+            yield self.data[start:start + len(self.data) // 4]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class FakeClientSession:
+    """
+    Serves every URL with the attachment's bytes, in four chunks.
+    """
+
+    def get(self, url):
+        return FakeResponse(DEMO)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class FakeMessage:
+    def __init__(self, contents, content):
+        self.contents = contents
+        contents.append(content)
+
+    async def edit(self, content):
+        self.contents.append(content)
+
+
+class FakeChannel:
+    def __init__(self):
+        self.contents = []
+
+    async def send(self, content):
+        return FakeMessage(self.contents, content)
+
+
+@pytest.fixture
+def download_dir(tmp_path, monkeypatch):
+    download_dir = tmp_path / 'downloads'
+    download_dir.mkdir()
+    monkeypatch.setattr(tempfile, 'tempdir', str(download_dir))
+    return download_dir
+
+
+@pytest.fixture
+def queue(db, download_dir, monkeypatch):
+    monkeypatch.setattr(demo_parser, 'DemoParser', FakeDemoParser)
+    monkeypatch.setattr(ingest_queue, 'get_db', lambda: contextlib.nullcontext(db))
+    monkeypatch.setattr(ingest_queue, 'mapping_index', MappingIndex(path=None))
+    monkeypatch.setattr(ingest_queue.aiohttp, 'ClientSession', FakeClientSession)
+    monkeypatch.setattr(ingest_queue, 'PROGRESS_INTERVAL', 0)
+    queue = IngestQueue(cache_dir=None)
+    queue._executor = InlineExecutor()
+    return queue
+
+
+def ingest(queue, filename):
+    attachment = SimpleNamespace(filename=filename, size=len(DEMO), url=f'https://cdn.example/{filename}')
+    job = IngestJob(attachment, FakeChannel(), 'admin')
+    asyncio.run(queue._process(job))
+    prefix = f"📼 `{filename}` (admin): "
+    return [content.removeprefix(prefix) for content in job.channel.contents]
+
+
+def test_process_ingests_a_demo_and_skips_it_the_second_time(db, queue, download_dir):
+    reports = ingest(queue, '2024-09-01_20-00-00.dem')
+
+    match = db.query(Match).one()
+    assert reports == [
+        "Downloading…", "Downloading… 25%", "Downloading… 50%", "Downloading… 75%", "Downloading… 100%",
+        "Checking for duplicates…", "Parsing…", "Saving and updating MMR…",
+        f"✅ Ingested {match.map_name} {match.team1_score}:{match.team2_score}.",
+    ]
+    assert match.team_results == '2024-09-01_20-00-00.dem'
+
+    # The same demo under another name is found by its content
+    reports = ingest(queue, '2024-09-02_20-00-00.dem')
+
+    assert reports[-2:] == ["Checking for duplicates…", "⏭️ Already ingested, skipped."]
+    assert db.query(Match).count() == 1
+    # The downloads are removed
+    assert os.listdir(download_dir) == []
+
+
+def test_progress_reports_are_rate_limited(queue, monkeypatch):
+    monkeypatch.setattr(ingest_queue, 'PROGRESS_INTERVAL', 60)
+
+    reports = ingest(queue, '2024-09-01_20-00-00.dem')
+
+    assert reports[:2] == ["Downloading…", "Checking for duplicates…"]
+
+
+def test_demo_without_rounds_is_reported(db, queue, monkeypatch):
+    monkeypatch.setattr(FakeDemoParser, 'rounds', 0)
+
+    reports = ingest(queue, '2024-09-01_20-00-00.dem')
+
+    assert reports[-1] == "❌ No rounds found in the demo."
+    assert db.query(Match).count() == 0
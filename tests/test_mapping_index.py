@@ -0,0 +1,69 @@
+import json
+
+from helpers import add_players
+from services import crud
+from services.mapping_index import MappingIndex
+from services.models import Player
+
+
+def write_mapping(path, mapping):
+    path.write_text(json.dumps(mapping))
+
+
+def roles(db):
+    return {player.steamid: (player.role, bool(player.core_member)) for player in db.query(Player)}
+
+
+def test_sync_only_changes_players_in_the_mapping(db, tmp_path):
+    players = add_players(db, 3)
+    players[2].role, players[2].core_member = 'entry', True
+    db.commit()
+    path = tmp_path / 'mapping.json'
+    write_mapping(path, {
+        'accounts': {players[0].steamid: '1'},
+        'roles': {players[1].steamid: 'sniper'},
+        'core': [players[1].steamid],
+    })
+    index = MappingIndex(str(path))
+
+    assert index.refresh_and_sync(db)
+
+    assert roles(db) == {
+        players[0].steamid: (None, False),
+        players[1].steamid: ('sniper', True),
+        players[2].steamid: ('entry', True),
+    }
+
+
+def test_unreadable_mapping_keeps_the_previous_one(db, tmp_path):
+    players = add_players(db, 1)
+    path = tmp_path / 'mapping.json'
+    write_mapping(path, {'roles': {players[0].steamid: 'awp'}, 'core': [players[0].steamid]})
+    index = MappingIndex(str(path))
+    index.refresh_and_sync(db)
+
+    path.write_text('{"roles": ')
+    index._mtime = None
+
+    assert not index.refresh_and_sync(db)
+    assert index.role(players[0].steamid) == 'awp'
+    assert roles(db) == {players[0].steamid: ('awp', True)}
+
+
+def test_players_added_later_are_synced_without_a_mapping_change(db, tmp_path):
+    path = tmp_path / 'mapping.json'
+    steamid = '76561198000000001'
+    write_mapping(path, {'roles': {steamid: 'sniper'}, 'core': [steamid]})
+    index = MappingIndex(str(path))
+    assert index.refresh_and_sync(db)
+
+    crud.create_player(db, Player(steamid=steamid, username='late', mmr=1000, discord_id='1'))
+
+    assert not index.refresh_and_sync(db)
+    assert roles(db) == {steamid: ('sniper', True)}
+
+
+def test_create_player_keeps_the_core_flag(db):
+    player = crud.create_player(db, Player(steamid='1', username='core', mmr=1000, role='entry', core_member=True))
+
+    assert (player.role, player.core_member) == ('entry', True)
@@ -0,0 +1,109 @@
+import datetime
+import random
+
+import pytest
+
+from helpers import add_match, add_players
+from services import crud, mmr_algorithm, models
+
+START = datetime.datetime(2024, 9, 1, 20, 0)
+
+
+@pytest.fixture(autouse=True)
+def small_checkpoint_interval(monkeypatch):
+    monkeypatch.setattr(mmr_algorithm, 'CHECKPOINT_INTERVAL', 3)
+
+
+def add_random_matches(db, players, count, start=START, seed=0):
+    rng = random.Random(seed)
+    matches = []
+    for i in range(count):
+        lobby = [player.id for player in rng.sample(players, 10)]
+        winner = rng.choice(['terrorist', 'counter_terrorist', 'terrorist', 'draw'])
+        matches.append(add_match(
+            db, start + datetime.timedelta(days=i, hours=rng.random()), lobby[:5], lobby[5:], winner,
+            seed=seed * 1000 + i
+        ))
+    return matches
+
+
+def snapshot(db):
+    return (
+        sorted((player.id, player.mmr) for player in db.query(models.Player)),
+        sorted((h.player_id, h.match_id, h.delta, h.mmr_after) for h in db.query(models.MmrHistory)),
+        sorted((c.match_id, c.match_count, c.player_id, c.mmr) for c in db.query(models.MmrCheckpoint)),
+        sorted(
+            (d.player_id, round(d.decayed_sum, 6), d.anchor) for d in db.query(models.PlayerRatingDecay)
+        ),
+    )
+
+
+def test_batch_changes_match_scalar_formula(db):
+    players = add_players(db, 12)
+    add_random_matches(db, players, 20)
+
+    rows = crud.stream_match_stats(db).all()
+    stat_ids, changes = mmr_algorithm.calculate_mmr_changes_batch(dict(zip(rows[0]._fields, zip(*rows))))
+
+    assert stat_ids.tolist() == [row.id for row in rows]
+    assert changes.tolist() == [mmr_algorithm.mmr_change_for_match(row, row) for row in rows]
+
+
+@pytest.mark.parametrize('half_life', [None, 30])
+def test_incremental_updates_match_full_replay(db, monkeypatch, half_life):
+    monkeypatch.setattr(mmr_algorithm, 'MMR_HALF_LIFE_DAYS', half_life)
+    players = add_players(db, 14)
+    matches = add_random_matches(db, players, 12)
+    mmr_algorithm.update_ratings(db)
+    # Newer matches, then a match dated before all of them
+    add_random_matches(db, players, 5, start=START + datetime.timedelta(days=20), seed=1)
+    mmr_algorithm.update_ratings(db)
+    add_random_matches(db, players, 1, start=matches[4].date_time + datetime.timedelta(minutes=5), seed=2)
+    mmr_algorithm.update_ratings(db)
+    incremental = snapshot(db)
+
+    mmr_algorithm.recalculate_all_mmr(db)
+
+    assert snapshot(db) == incremental
+
+
+@pytest.mark.parametrize('half_life', [None, 30])
+def test_replay_from_any_match_matches_full_replay(db, monkeypatch, half_life):
+    monkeypatch.setattr(mmr_algorithm, 'MMR_HALF_LIFE_DAYS', half_life)
+    players = add_players(db, 14)
+    matches = add_random_matches(db, players, 10)
+    mmr_algorithm.recalculate_all_mmr(db)
+    full = snapshot(db)
+
+    for match in matches:
+        mmr_algorithm.replay_from(db, match)
+        assert snapshot(db) == full
+
+
+def test_ratings_as_of_match_history(db):
+    players = add_players(db, 12)
+    matches = add_random_matches(db, players, 8)
+    mmr_algorithm.update_ratings(db)
+
+    for match in matches:
+        ratings = mmr_algorithm.get_ratings_as_of(db, match.date_time)
+        for player_id, mmr in ratings.items():
+            assert mmr == mmr_algorithm.get_mmr_as_of(db, player_id, match.date_time)
+    assert mmr_algorithm.get_ratings_as_of(db, matches[-1].date_time) == crud.get_player_mmrs(db)
+
+
+def test_effective_mmr_decays_towards_base(db, monkeypatch):
+    monkeypatch.setattr(mmr_algorithm, 'MMR_HALF_LIFE_DAYS', 10)
+    players = add_players(db, 10)
+    matches = add_random_matches(db, players, 1)
+    mmr_algorithm.update_ratings(db)
+    ids = [player.id for player in players]
+    stored = crud.get_player_mmrs(db, ids)
+
+    at_match = mmr_algorithm.get_effective_mmrs(db, ids, now=matches[0].date_time)
+    after_half_life = mmr_algorithm.get_effective_mmrs(db, ids, now=matches[0].date_time + datetime.timedelta(days=10))
+
+    assert at_match == stored
+    for player_id in ids:
+        change = stored[player_id] - mmr_algorithm.BASE_MMR
+        assert after_half_life[player_id] - mmr_algorithm.BASE_MMR == int(round(change / 2))
@@ -0,0 +1,55 @@
+import datetime
+import itertools
+
+import numpy as np
+import pytest
+
+from helpers import add_match, add_players
+from services import crud
+from utils import mmr_sweep
+from test_mmr_algorithm import add_random_matches
+
+CONFIG = {'scale': 20, 'bonus': 5, 'clamp': 50}
+
+
+def load(db):
+    snapshot = mmr_sweep.build_snapshot(db)
+    snapshot['split_signs'] = mmr_sweep._split_signs(mmr_sweep.TEAM_SIZE)
+    return snapshot
+
+
+def test_metrics_only_use_the_held_out_matches(db, monkeypatch):
+    players = add_players(db, 14)
+    add_random_matches(db, players, 30)
+    snapshot = load(db)
+    fitted = []
+    fit = mmr_sweep._fit_logistic_slope
+    monkeypatch.setattr(mmr_sweep, '_fit_logistic_slope', lambda x, y: fitted.append(len(x)) or fit(x, y))
+
+    result = mmr_sweep.evaluate(CONFIG, snapshot, warmup=10, train_fraction=0.5)
+
+    assert fitted == [10]
+    assert 0 <= result['brier'] <= 1 and result['log_loss'] > 0
+    with pytest.raises(ValueError, match='Not enough matches'):
+        mmr_sweep.evaluate(CONFIG, snapshot, warmup=30)
+
+
+def test_balance_error_applies_the_sniper_rule(db):
+    players = add_players(db, 10)
+    start = datetime.datetime(2024, 9, 1)
+    for i in range(8):
+        add_match(db, start + datetime.timedelta(days=i), [p.id for p in players[:5]], [p.id for p in players[5:]],
+                  seed=i)
+    snapshot = load(db)
+    without_rule = mmr_sweep.evaluate(CONFIG, snapshot)
+    player_ids = np.asarray([row.player_id for row in crud.stream_match_stats(db)])
+
+    errors = []
+    for sniper_a, sniper_b in itertools.combinations(players, 2):
+        snapshot['is_sniper'] = np.isin(player_ids, [sniper_a.id, sniper_b.id])
+        with_rule = mmr_sweep.evaluate(CONFIG, snapshot)
+        assert with_rule['log_loss'] == without_rule['log_loss']
+        errors.append(with_rule['balance_error'])
+
+    # Only snipers the best split puts on the same team make it worse
+    assert min(errors) == without_rule['balance_error'] < max(errors)
@@ -0,0 +1,66 @@
+import pytest
+
+from services import mmr_algorithm
+from services.rating_models import (
+    GLICKO2_SCALE, RATING_MODELS, EloModel, Glicko2Model, HltvModel, RatingModel, TrueSkillModel
+)
+
+
+def test_rating_model_is_abstract():
+    with pytest.raises(TypeError):
+        RatingModel()
+
+
+def test_hltv_model_is_named_like_the_production_model():
+    assert RATING_MODELS[mmr_algorithm.RATING_MODEL] is HltvModel
+
+
+def test_elo_update():
+    model = EloModel()
+    ratings = {1: 1200, 2: 1000, 3: 1000, 4: 1000}
+
+    # Team means 1100 and 1000: expected result 1 / (1 + 10 ** -0.25) = 0.640065
+    assert model.win_probability(ratings, [1, 2], [3, 4]) == pytest.approx(0.640065, abs=1e-6)
+    model.update(ratings, [1, 2], [3, 4], 1.0, {})
+
+    # 32 * (1 - 0.640065) = 11.51792
+    assert ratings == pytest.approx({1: 1211.51792, 2: 1011.51792, 3: 988.48208, 4: 988.48208})
+
+
+@pytest.mark.parametrize('deviation, expected', [
+    # Values of the glicko2 package, rating period with a single game
+    (200, (1563.564194, 175.402656, 0.059999)),
+    (350, (1631.368920, 252.160006, 0.059999)),
+])
+def test_glicko2_update(deviation, expected):
+    model = Glicko2Model()
+    ratings = {1: (0.0, deviation / GLICKO2_SCALE, 0.06), 2: (-100 / GLICKO2_SCALE, 30 / GLICKO2_SCALE, 0.06)}
+
+    model.update(ratings, [1], [2], 1.0, {})
+
+    _, phi, sigma = ratings[1]
+    assert (model.score(ratings[1]), phi * GLICKO2_SCALE, sigma) == pytest.approx(expected, abs=1e-5)
+
+
+def test_trueskill_update():
+    model = TrueSkillModel()
+    ratings = {1: (30, 5), 2: (20, 6), 3: (25, 4), 4: (24, 7)}
+
+    model.update(ratings, [1, 2], [3, 4], 1.0, {})
+
+    # Values of the trueskill package with draw_probability=0
+    expected = {1: (31.346679, 4.798033), 2: (21.939053, 5.647108), 3: (24.137991, 3.897858), 4: (21.360868, 6.432750)}
+    for player_id, (mu, sigma) in expected.items():
+        assert ratings[player_id] == pytest.approx((mu, sigma), abs=1e-5)
+
+
+def test_trueskill_first_win():
+    model = TrueSkillModel()
+    ratings = {}
+    model._states(ratings, [1, 2])
+
+    model.update(ratings, [1], [2], 1.0, {})
+
+    # Values of the trueskill package with draw_probability=0
+    assert ratings[1] == pytest.approx((29.205473, 7.194816), abs=1e-5)
+    assert ratings[2] == pytest.approx((20.794527, 7.194816), abs=1e-5)
@@ -0,0 +1,41 @@
+import datetime
+
+from helpers import add_players
+from services import rotation
+from services.rotation import RotationQueue
+
+
+def test_order_puts_players_who_played_less_first(db):
+    ids = [player.id for player in add_players(db, 12)]
+    queue = RotationQueue()
+
+    assert queue.order(db, ids) == ids
+    queue.played(db, ids[:10])
+    assert queue.order(db, ids) == ids[10:] + ids[:10]
+    queue.played(db, ids[10:] + ids[:8])
+    # ids[8:10] played once, everyone else twice
+    assert queue.order(db, ids)[:2] == ids[8:10]
+
+
+def test_order_does_not_change_the_queue(db):
+    ids = [player.id for player in add_players(db, 12)]
+    queue = RotationQueue()
+    queue.played(db, ids[2:])
+
+    assert queue.order(db, ids) == queue.order(db, ids) == ids[:2] + ids[2:]
+
+
+def test_queue_is_persisted_and_reset_after_an_evening(db):
+    ids = [player.id for player in add_players(db, 12)]
+    evening = datetime.datetime.now()
+    first = RotationQueue()
+    first.order(db, ids)
+    first.played(db, ids[:10], now=evening)
+
+    queue = RotationQueue()
+    assert queue.order(db, ids) == ids[10:] + ids[:10]
+    queue.updated_at = evening
+    queue._reset_if_stale(evening + datetime.timedelta(hours=rotation.ROTATION_RESET_HOURS + 1))
+    # Counts reset, the order within the queue is kept
+    assert {games for games, _ in queue.entries.values()} == {0}
+    assert queue.order(db, ids) == ids[10:] + ids[:10]
@@ -0,0 +1,101 @@
+import pandas as pd
+
+from utils.round_stats import ROUND_STATS_COLUMNS, extract_round_stats
+
+# Terrorists a, b and c against counter-terrorists x, y and z, and a spectator
+A, B, C, X, Y, Z, SPECTATOR = (76561198000000000 + i for i in (1, 2, 3, 11, 12, 13, 20))
+TEAMS = {A: 2, B: 2, C: 2, X: 3, Y: 3, Z: 3, SPECTATOR: 1}
+
+# Player snapshots by tick: (damage_total, current_equip_value)
+SNAPSHOTS = {
+    # Round 1, freeze end and round end
+    100: {A: (0, 800), B: (0, 800), C: (0, 800), X: (0, 800), Y: (0, 800), Z: (0, 800), SPECTATOR: (0, 0)},
+    1000: {A: (50, 0), B: (300, 700), C: (20, 0), X: (100, 0), Y: (0, 0), Z: (150, 0), SPECTATOR: (0, 0)},
+    # Round 2
+    1200: {A: (50, 1000), B: (300, 4000), C: (20, 2000), X: (100, 4500), Y: (0, 5000), Z: (150, 3000),
+           SPECTATOR: (0, 0)},
+    2000: {A: (150, 0), B: (300, 0), C: (80, 0), X: (100, 4500), Y: (0, 5000), Z: (150, 3000), SPECTATOR: (0, 0)},
+}
+
+# tick, victim, attacker, assister
+DEATHS = [
+    # Round 1: x opens on a and is traded by b, b's kill on y leaves z alone against b and c,
+    # z kills c and b wins the 1 vs 1, trading c
+    (200, A, X, Y),
+    (300, X, B, None),
+    (700, Y, B, None),
+    (800, C, Z, None),
+    (900, Z, B, None),
+    # Between the rounds, ignored
+    (1100, C, X, None),
+    # Round 2: a dies to the world, which is no opening kill, y opens on b and c loses a 1 vs 3
+    (1300, A, None, None),
+    (1400, B, Y, Z),
+    (1500, C, X, None),
+]
+
+
+class RoundParser:
+    """
+    Stand-in for DemoParser with two hand-made rounds.
+    """
+
+    def parse_event(self, event_name):
+        if event_name == 'round_freeze_end':
+            return pd.DataFrame({'tick': [100, 1200]})
+        if event_name == 'player_death':
+            # Events hold SteamIDs as strings, tick data as integers
+            deaths = [(tick, *(None if steamid is None else str(steamid) for steamid in players))
+                      for tick, *players in DEATHS]
+            return pd.DataFrame(deaths, columns=['tick', 'user_steamid', 'attacker_steamid', 'assister_steamid'])
+        return pd.DataFrame()
+
+    def parse_ticks(self, wanted_props, ticks=None):
+        rows = [
+            {'tick': tick, 'steamid': steamid, 'team_num': TEAMS[steamid], 'damage_total': damage,
+             'current_equip_value': equipment_value}
+            for tick in ticks for steamid, (damage, equipment_value) in SNAPSHOTS[tick].items()
+        ]
+        return pd.DataFrame(rows)[['tick', 'steamid', *wanted_props]]
+
+
+ROUND_END_EVENTS = pd.DataFrame({'tick': [2000, 1000], 'round': [2, 1], 'winner': ['CT', 'T']})
+
+EXPECTED = [
+    # round, steamid, team, kills, deaths, assists, damage, equipment, opening kill, opening death,
+    # trade kill, traded death, clutch opponents, clutch won, survived, round won
+    (1, A, 2, 0, 1, 0, 50, 800, False, True, False, True, 0, False, False, True),
+    (1, B, 2, 3, 0, 0, 300, 800, False, False, True, False, 1, True, True, True),
+    (1, C, 2, 0, 1, 0, 20, 800, False, False, False, True, 0, False, False, True),
+    (1, X, 3, 1, 1, 0, 100, 800, True, False, False, False, 0, False, False, False),
+    (1, Y, 3, 0, 1, 1, 0, 800, False, False, False, False, 0, False, False, False),
+    (1, Z, 3, 1, 1, 0, 150, 800, False, False, False, False, 2, False, False, False),
+    (2, A, 2, 0, 1, 0, 100, 1000, False, False, False, False, 0, False, False, False),
+    (2, B, 2, 0, 1, 0, 0, 4000, False, True, False, False, 0, False, False, False),
+    (2, C, 2, 0, 1, 0, 60, 2000, False, False, False, False, 3, False, False, False),
+    (2, X, 3, 1, 0, 0, 0, 4500, False, False, False, False, 0, False, True, True),
+    (2, Y, 3, 1, 0, 0, 0, 5000, True, False, False, False, 0, False, True, True),
+    (2, Z, 3, 0, 0, 1, 0, 3000, False, False, False, False, 0, False, True, True),
+]
+
+
+def test_extract_round_stats():
+    rounds = extract_round_stats(RoundParser(), ROUND_END_EVENTS)
+
+    expected = pd.DataFrame(
+        [(round_number, str(steamid), *rest) for round_number, steamid, *rest in EXPECTED], columns=ROUND_STATS_COLUMNS
+    )
+    pd.testing.assert_frame_equal(rounds, expected, check_dtype=False)
+
+
+class NoDeathsParser(RoundParser):
+    def parse_event(self, event_name):
+        return pd.DataFrame() if event_name == 'player_death' else super().parse_event(event_name)
+
+
+def test_extract_round_stats_without_deaths():
+    rounds = extract_round_stats(NoDeathsParser(), ROUND_END_EVENTS)
+
+    assert len(rounds) == 12
+    assert rounds['survived'].all() and not rounds['kills'].any() and not rounds['opening_kill'].any()
+    assert rounds['damage'].tolist() == [row[6] for row in EXPECTED]
@@ -0,0 +1,98 @@
+import datetime
+
+import pytest
+
+from helpers import add_players
+from services import mmr_algorithm, models, seasons
+from test_mmr_algorithm import START, add_random_matches
+
+
+def summaries(db):
+    return sorted(
+        (s.season_id, s.player_id, s.matches, s.wins, s.kills, s.deaths, s.assists, s.damage, s.mmr_change)
+        for s in db.query(models.SeasonPlayerSummary)
+    )
+
+
+def test_season_summaries_updated_incrementally_match_rebuild(db):
+    players = add_players(db, 14)
+    seasons.start_season(db, 'one', start_date=START - datetime.timedelta(days=1))
+    add_random_matches(db, players, 6)
+    mmr_algorithm.update_ratings(db)
+    seasons.start_season(db, 'two', start_date=START + datetime.timedelta(days=3, hours=12))
+    add_random_matches(db, players, 6, start=START + datetime.timedelta(days=10), seed=1)
+    mmr_algorithm.update_ratings(db)
+    incremental = summaries(db)
+
+    seasons.rebuild_season_summaries(db)
+
+    assert summaries(db) == incremental
+    assert {season_id for season_id, *_ in incremental} == {1, 2}
+    # Every stat row is counted in exactly one season
+    assert sum(matches for _, _, matches, *_ in incremental) == db.query(models.PlayerMatchStats).count()
+
+
+def test_end_season_snapshots_final_mmr(db):
+    players = add_players(db, 10)
+    seasons.start_season(db, 'one', start_date=START - datetime.timedelta(days=1))
+    add_random_matches(db, players, 3)
+    mmr_algorithm.update_ratings(db)
+
+    season = seasons.end_season(db, end_date=START + datetime.timedelta(days=5))
+
+    final = {s.player_id: s.final_mmr for s in db.query(models.SeasonPlayerSummary).filter_by(season_id=season.id)}
+    assert final == {player.id: player.mmr for player in players}
+
+
+def test_end_season_snapshots_decayed_mmr_at_the_end_date(db, monkeypatch):
+    monkeypatch.setattr(mmr_algorithm, 'MMR_HALF_LIFE_DAYS', 10)
+    players = add_players(db, 10)
+    seasons.start_season(db, 'one', start_date=START - datetime.timedelta(days=1))
+    matches = add_random_matches(db, players, 1)
+    mmr_algorithm.update_ratings(db)
+    end_date = matches[0].date_time + datetime.timedelta(days=10)
+
+    season = seasons.end_season(db, end_date=end_date)
+
+    final = {s.player_id: s.final_mmr for s in db.query(models.SeasonPlayerSummary).filter_by(season_id=season.id)}
+    assert final == mmr_algorithm.get_effective_mmrs(db, [player.id for player in players], now=end_date)
+    assert any(final[player.id] != player.mmr for player in players)
+
+
+@pytest.mark.parametrize('half_life', [None, 10])
+def test_end_season_in_the_past_ignores_later_matches(db, monkeypatch, half_life):
+    monkeypatch.setattr(mmr_algorithm, 'MMR_HALF_LIFE_DAYS', half_life)
+    players = add_players(db, 10)
+    seasons.start_season(db, 'one', start_date=START - datetime.timedelta(days=1))
+    matches = add_random_matches(db, players, 6)
+    mmr_algorithm.update_ratings(db)
+    end_date = matches[3].date_time + datetime.timedelta(hours=1)
+    ids = [player.id for player in players]
+    # The ratings and decay state as they were at the end date, before the later matches
+    expected = {}
+    for player_id in ids:
+        rows = [(h.delta, h.match.date_time) for h in db.query(models.MmrHistory).filter_by(player_id=player_id)
+                if h.match.date_time < end_date]
+        if half_life:
+            decayed = 0.0
+            anchor = None
+            for delta, date_time in sorted(rows, key=lambda row: row[1]):
+                if anchor is not None:
+                    decayed *= 0.5 ** ((date_time - anchor).total_seconds() / (half_life * 86400))
+                decayed, anchor = decayed + delta, date_time
+            if anchor is not None:
+                decayed *= 0.5 ** ((end_date - anchor).total_seconds() / (half_life * 86400))
+            expected[player_id] = mmr_algorithm.BASE_MMR + int(round(decayed))
+        else:
+            expected[player_id] = mmr_algorithm.BASE_MMR + sum(delta for delta, _ in rows)
+
+    # Starting a season in the past ends the previous one at that date
+    seasons.start_season(db, 'two', start_date=end_date)
+
+    final = {s.player_id: s.final_mmr for s in db.query(models.SeasonPlayerSummary).filter_by(season_id=1)}
+    assert final and final == {player_id: expected[player_id] for player_id in final}
+    if not half_life:
+        assert final == {
+            player_id: mmr for player_id, mmr in mmr_algorithm.get_ratings_as_of(db, matches[3].date_time).items()
+            if player_id in final
+        }
@@ -0,0 +1,164 @@
+import collections
+import datetime
+import os
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from helpers import add_players
+from services import crud, mmr_algorithm, models
+from database.database import Base
+from services.synergy import SynergyMatrix, get_synergy_matrix
+from test_mmr_algorithm import add_random_matches
+
+
+def brute_force_counts(db):
+    counts = collections.Counter()
+    for match in db.query(models.Match):
+        teams = collections.defaultdict(list)
+        for stats in match.players:
+            teams[stats.team].append(stats.player_id)
+        for team, own in teams.items():
+            won = match.winner == team
+            other = [player_id for name, team_players in teams.items() if name != team for player_id in team_players]
+            for a in own:
+                for b in own:
+                    counts['together', a, b] += 1
+                    counts['wins_together', a, b] += won
+                for b in other:
+                    counts['against', a, b] += 1
+                    counts['wins_against', a, b] += won
+    return counts
+
+
+def dense(matrix, player_ids):
+    rows = [matrix.index[player_id] for player_id in player_ids]
+    return {name: array[np.ix_(rows, rows)] for name, array in matrix.arrays.items()}
+
+
+def test_update_matches_brute_force(db, tmp_path):
+    players = add_players(db, 14)
+    add_random_matches(db, players, 15)
+    matrix = SynergyMatrix(path=str(tmp_path / 'synergy.npz'))
+
+    assert matrix.update(db) == 15
+
+    for (name, a, b), count in brute_force_counts(db).items():
+        assert matrix.arrays[name][matrix.index[a], matrix.index[b]] == count
+    a, b = players[0].id, players[1].id
+    record = matrix.duo(a, b)
+    assert record['against'] == record['wins_a'] + record['wins_b'] + sum(
+        1 for match in db.query(models.Match) if match.winner == 'draw'
+        and {a, b} <= {stats.player_id for stats in match.players}
+        and len({stats.team for stats in match.players if stats.player_id in (a, b)}) == 2
+    )
+
+
+def test_incremental_updates_match_full_count_after_reload(db, tmp_path):
+    players = add_players(db, 14)
+    incremental = SynergyMatrix(path=str(tmp_path / 'incremental.npz'))
+    add_random_matches(db, players, 5)
+    incremental.update(db)
+    add_random_matches(db, players, 7, start=datetime.datetime(2024, 10, 1), seed=1)
+    incremental.update(db)
+    assert incremental.update(db) == 0
+
+    full = SynergyMatrix(path=str(tmp_path / 'full.npz'))
+    full.update(db)
+    reloaded = SynergyMatrix(path=str(tmp_path / 'incremental.npz'))
+    reloaded.refresh()
+
+    player_ids = crud.get_player_ids(db)
+    player_ids = [player_id for player_id in player_ids if player_id in full.index]
+    assert reloaded.last_match_id == full.last_match_id
+    for name, array in dense(full, player_ids).items():
+        assert np.array_equal(dense(reloaded, player_ids)[name], array)
+
+
+def test_pair_synergy_is_neutral_for_unknown_players(db, tmp_path):
+    players = add_players(db, 10)
+    add_random_matches(db, players, 3)
+    matrix = SynergyMatrix(path=str(tmp_path / 'synergy.npz'))
+    matrix.update(db)
+
+    synergy = matrix.pair_synergy([players[0].id, players[1].id, 9999])
+
+    assert synergy.shape == (3, 3)
+    assert np.allclose(synergy, synergy.T)
+    assert not synergy[2].any() and not synergy.diagonal().any()
+
+
+def test_recount_picks_up_an_edited_match(db):
+    players = add_players(db, 10)
+    matches = add_random_matches(db, players, 4)
+    mmr_algorithm.update_ratings(db)
+    matrix = get_synergy_matrix(db)
+
+    edited = matches[1]
+    edited.winner = 'counter_terrorist' if edited.winner == 'terrorist' else 'terrorist'
+    db.commit()
+    matrix.update(db, recount=True)
+
+    full = SynergyMatrix(path=None)
+    full.update(db)
+    rows = [matrix.index[player_id] for player_id in full.player_ids]
+    for name, array in full.arrays.items():
+        assert np.array_equal(matrix.arrays[name][np.ix_(rows, rows)], array)
+
+
+def test_out_of_order_match_is_counted_incrementally(db):
+    players = add_players(db, 14)
+    matches = add_random_matches(db, players, 6)
+    mmr_algorithm.update_ratings(db)
+    matrix = get_synergy_matrix(db)
+    counted = []
+    update = matrix.update
+    matrix.update = lambda db, recount=False: counted.append(recount) or update(db, recount)
+
+    add_random_matches(db, players, 1, start=matches[2].date_time + datetime.timedelta(minutes=5), seed=1)
+    mmr_algorithm.update_ratings(db)
+
+    assert counted == [False]
+    assert matrix.last_match_id == crud.get_last_match_id(db)
+
+
+def test_each_database_keeps_its_own_synergy_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    database_dir = tmp_path / 'bench'
+    database_dir.mkdir()
+    engine = create_engine(f"sqlite:///{database_dir / 'players.db'}")
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        add_random_matches(db, add_players(db, 10), 2)
+        mmr_algorithm.update_ratings(db)
+        mmr_algorithm.recalculate_all_mmr(db)
+
+        assert get_synergy_matrix(db).path == str(database_dir / 'synergy.npz')
+    assert os.listdir(tmp_path) == ['bench']
+    assert sorted(os.listdir(database_dir)) == ['players.db', 'synergy.npz']
+    engine.dispose()
+
+
+def test_in_memory_databases_do_not_share_a_matrix(db):
+    other = create_engine('sqlite://')
+
+    assert get_synergy_matrix(db) is get_synergy_matrix(db)
+    assert get_synergy_matrix(db) is not get_synergy_matrix(sessionmaker(bind=other)())
+    assert get_synergy_matrix(db).path is None
+
+
+def test_readers_keep_a_consistent_snapshot_during_an_update(db, tmp_path):
+    players = add_players(db, 14)
+    add_random_matches(db, players, 3)
+    matrix = SynergyMatrix(path=str(tmp_path / 'synergy.npz'))
+    matrix.update(db)
+    arrays_before = matrix.arrays
+
+    add_random_matches(db, players, 3, start=datetime.datetime(2024, 10, 1), seed=1)
+    matrix.update(db)
+
+    # Counted into new arrays, the ones a reader may still hold are unchanged
+    assert matrix.arrays is not arrays_before
+    assert arrays_before['together'].diagonal().sum() == 3 * 10
+    assert matrix.arrays['together'].diagonal().sum() == 6 * 10
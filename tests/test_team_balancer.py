@@ -0,0 +1,230 @@
+import itertools
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from helpers import add_players
+from services import crud
+from services.rotation import RotationQueue
+from services.team_balancer import (
+    NEW_PLAYER_SIGMA, SplitConstraints, balance_lobbies, balance_team_options, constrained_splits,
+    lobby_spread_bound, partition_lobbies, split_scores, top_splits
+)
+
+ROLES = [None, None, None, 'sniper', 'entry', 'support']
+
+
+def make_players(rng, count=10):
+    return [
+        SimpleNamespace(id=i, steamid=f's{i}', role=rng.choice(ROLES), username=f'p{i}', discord_name=None,
+                        discord_id=str(i))
+        for i in range(count)
+    ]
+
+
+def brute_force_diffs(players, mmrs, constraints, team_size=5):
+    """
+    The MMR differences of every split satisfying the constraints, each split counted once, best first.
+    """
+    index = {player.steamid: i for i, player in enumerate(players)}
+    total = sum(mmrs[player.id] for player in players)
+    diffs = []
+    for combo in itertools.combinations(range(len(players)), team_size):
+        team_a = set(combo)
+        if 0 not in team_a:
+            continue
+        valid = True
+        for role, quota in constraints.role_quotas.items():
+            role_count = sum(player.role == role for player in players)
+            needed = min(quota, role_count // 2)
+            in_a = sum(players[i].role == role for i in team_a)
+            valid &= in_a >= needed and role_count - in_a >= needed
+        for steamid_a, steamid_b in constraints.conflicts:
+            valid &= (index[steamid_a] in team_a) != (index[steamid_b] in team_a)
+        for group in constraints.premades:
+            valid &= len({index[steamid] in team_a for steamid in group}) == 1
+        if valid:
+            diffs.append(abs(2 * sum(mmrs[players[i].id] for i in team_a) - total))
+    return sorted(diffs)
+
+
+def check_splits(splits, players, mmrs):
+    seen = set()
+    for team_a, team_b, mmr_diff, *_ in splits:
+        assert len(team_a) == len(team_b) == 5
+        assert {player.id for player in team_a} | {player.id for player in team_b} == {player.id for player in players}
+        assert mmr_diff == abs(sum(mmrs[p.id] for p in team_a) - sum(mmrs[p.id] for p in team_b))
+        split = frozenset((frozenset(p.id for p in team_a), frozenset(p.id for p in team_b)))
+        assert split not in seen
+        seen.add(split)
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_top_splits_match_brute_force(seed):
+    rng = random.Random(seed)
+    players = make_players(rng)
+    mmrs = {player.id: rng.randint(700, 1400) for player in players}
+
+    splits = top_splits(players, mmrs, 15)
+
+    check_splits(splits, players, mmrs)
+    assert [split[2] for split in splits] == brute_force_diffs(players, mmrs, SplitConstraints())[:15]
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_constrained_splits_match_brute_force(seed):
+    rng = random.Random(seed)
+    players = make_players(rng)
+    mmrs = {player.id: rng.randint(700, 1400) for player in players}
+    steamids = [player.steamid for player in players]
+    constraints = SplitConstraints(
+        role_quotas=rng.choice([{}, {'entry': 1}, {'support': 2, 'entry': 1}]),
+        conflicts=[tuple(rng.sample(steamids, 2)) for _ in range(rng.randint(0, 3))],
+        premades=[tuple(rng.sample(steamids, rng.randint(2, 3))) for _ in range(rng.randint(0, 2))],
+    )
+    expected = brute_force_diffs(players, mmrs, constraints)[:10]
+
+    if not expected:
+        with pytest.raises(ValueError):
+            constrained_splits(players, mmrs, constraints, 10)
+        return
+    splits = constrained_splits(players, mmrs, constraints, 10)
+    check_splits(splits, players, mmrs)
+    assert [split[2] for split in splits] == expected
+
+
+def test_constrained_splits_report_infeasible_constraints():
+    players = make_players(random.Random(0))
+    mmrs = {player.id: 1000 for player in players}
+
+    with pytest.raises(ValueError, match='more than 5 players'):
+        constrained_splits(players, mmrs, SplitConstraints(premades=[tuple(f's{i}' for i in range(6))]))
+    with pytest.raises(ValueError, match='same premade group'):
+        constrained_splits(players, mmrs, SplitConstraints(conflicts=[('s0', 's1')], premades=[('s0', 's1')]))
+    with pytest.raises(ValueError, match='p0 and p1 apart'):
+        constrained_splits(players, mmrs, SplitConstraints(conflicts=[('s0', 's1'), ('s1', 's2'), ('s0', 's2')]))
+
+
+@pytest.mark.parametrize('player_count', [20, 30])
+def test_partition_lobbies_uses_every_player_once(player_count):
+    rng = random.Random(player_count)
+    mmrs = [rng.randint(700, 1400) for _ in range(player_count)]
+
+    lobbies, spread, bound = partition_lobbies(mmrs, [False] * player_count, player_count // 10, time_budget=0.2)
+
+    assert sorted(i for lobby in lobbies for i in lobby) == list(range(player_count))
+    totals = [sum(mmrs[i] for i in lobby) for lobby in lobbies]
+    assert spread == max(totals) - min(totals)
+    assert 0 <= bound <= spread
+
+
+def test_balancing_again_selects_the_same_players_until_a_game_is_played(db):
+    players = add_players(db, 12)
+    discord_ids = [player.discord_id for player in players]
+    rotation = RotationQueue()
+
+    first = balance_team_options(discord_ids, db, rotation=rotation)
+    second = balance_team_options(discord_ids, db, rotation=rotation)
+
+    assert first['sitting_out'] == second['sitting_out'] == discord_ids[10:]
+    assert first['options'] == second['options']
+    assert first['queue'] == discord_ids[10:] + discord_ids[:10]
+
+    team_a, team_b, _ = first['options'][0]
+    played = crud.get_players_by_discord_ids(db, team_a + team_b)
+    rotation.played(db, [player.id for player in played.values()])
+
+    assert set(balance_team_options(discord_ids, db, rotation=rotation)['sitting_out']) < set(discord_ids[:10])
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_lobby_spread_bound_is_below_the_optimum(seed):
+    rng = random.Random(seed)
+    mmrs = [rng.randint(500, 2500) if rng.random() < 0.2 else rng.randint(900, 1100) for _ in range(20)]
+    total = sum(mmrs)
+    optimum = min(
+        abs(2 * sum(mmrs[i] for i in lobby) - total) for lobby in itertools.combinations(range(20), 10) if 0 in lobby
+    )
+
+    assert lobby_spread_bound(mmrs, 2) <= optimum
+
+
+def test_lobby_spread_bound_accounts_for_an_outlier():
+    mmrs = [3000] + [1000] * 29
+
+    _, spread, bound = partition_lobbies(mmrs, [False] * 30, 3, time_budget=0.2)
+
+    assert spread == bound == 2000
+
+
+def test_unknown_objective_is_rejected():
+    players = make_players(random.Random(0))
+    mmrs = {player.id: 1000 for player in players}
+
+    with pytest.raises(ValueError, match='Unknown balancing objective'):
+        top_splits(players, mmrs, 1, objective='win_rate')
+
+
+def test_role_change_is_not_served_from_the_split_cache(db):
+    players = add_players(db, 10)
+    for i, player in enumerate(players):
+        player.mmr = 1000 + 37 * i
+    db.commit()
+    discord_ids = [player.discord_id for player in players]
+    team_a, _, _ = balance_team_options(discord_ids, db)['options'][0]
+
+    # Two players the cached best split keeps together become snipers
+    snipers = [player for player in players if player.discord_id in team_a][:2]
+    for player in snipers:
+        player.role = 'sniper'
+    db.commit()
+    team_a, _, _ = balance_team_options(discord_ids, db)['options'][0]
+
+    assert sum(player.discord_id in team_a for player in snipers) == 1
+
+
+@pytest.mark.parametrize('objective', ['mmr_difference', 'win_probability'])
+def test_constrained_balance_ranks_by_the_objective(db, objective):
+    rng = random.Random(7)
+    players = add_players(db, 10)
+    for player in players:
+        player.mmr = rng.randint(700, 1400)
+    db.commit()
+    constraints = SplitConstraints(conflicts=[(players[0].steamid, players[1].steamid)])
+    mmrs = {player.id: player.mmr for player in players}
+    sigmas = {player.id: NEW_PLAYER_SIGMA for player in players}
+
+    options = balance_team_options(
+        [player.discord_id for player in players], db, constraints=constraints, objective=objective
+    )['options']
+
+    # Every split keeping the conflicting players apart, scored by the objective
+    feasible = [
+        combo for combo in itertools.combinations(range(10), 5) if 0 in combo and 1 not in combo
+    ]
+    in_team_a = np.array([[i in combo for i in range(10)] for combo in feasible], dtype=np.int64)
+    scores = sorted(split_scores(players, mmrs, in_team_a, objective, sigmas))
+    option_rows = np.array([
+        [player.discord_id in team_a for player in players] for team_a, _, _ in options
+    ], dtype=np.int64)
+    # The conflicting players are apart in every option
+    assert all(row[0] != row[1] for row in option_rows)
+    assert np.allclose(split_scores(players, mmrs, option_rows, objective, sigmas), scores[:len(options)])
+
+
+def test_lobbies_apply_the_constraints_within_each_lobby(db):
+    # Together, players 0 and 1 make the only even split
+    players = add_players(db, 10)
+    for player, mmr in zip(players, [500, 500, 2000] + [1000] * 7):
+        player.mmr = mmr
+    db.commit()
+    ids = [player.discord_id for player in players]
+
+    assert balance_lobbies(ids, db, time_budget=0.1)['lobbies'][0]['mmr_diff'] == 0
+
+    constraints = SplitConstraints(conflicts=[(players[0].steamid, players[1].steamid)])
+    lobby = balance_lobbies(ids, db, time_budget=0.1, constraints=constraints)['lobbies'][0]
+    assert lobby['mmr_diff'] == 1000
+    assert (ids[0] in lobby['team_a']) != (ids[1] in lobby['team_a'])
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import pandas as pd
+
+# Bump when the data extracted from a demo changes, so stale cache entries are not reused
+CACHE_VERSION = 1
+
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_COUNT = 16
+
+
+def demo_content_hash(demo_file_path):
+    """
+    Compute a content hash for a demo file.
+
+    Small files are hashed in full. Larger files are hashed from their size and
+    SAMPLE_COUNT evenly spaced blocks of SAMPLE_SIZE bytes, so a multi-hundred MB
+    demo costs about 1 MB of reads instead of a second full pass over the file.
+
+    Returns:
+        str: The hex digest of the hash.
+    """
+    file_size = os.path.getsize(demo_file_path)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(file_size).encode())
+
+    with open(demo_file_path, 'rb') as demo_file:
+        if file_size <= SAMPLE_SIZE * SAMPLE_COUNT:
+            for chunk in iter(lambda: demo_file.read(SAMPLE_SIZE), b''):
+                digest.update(chunk)
+        else:
+            step = (file_size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+            for i in range(SAMPLE_COUNT):
+                demo_file.seek(i * step)
+                digest.update(demo_file.read(SAMPLE_SIZE))
+
+    return digest.hexdigest()
+
+
+class DemoCache:
+    """
+    On-disk cache of the data extracted from demos, keyed by content hash.
+
+    Each entry is a directory holding the demo header as JSON and the round_end
+    events, final-tick player frame and, when extracted, per-round player stats as
+    Parquet files.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.join(cache_dir, f"v{CACHE_VERSION}")
+
+    def _entry_dir(self, content_hash):
+        return os.path.join(self.cache_dir, content_hash[:2], content_hash)
+
+    def load(self, content_hash):
+        """
+        Load a cached entry.
+
+        Returns:
+            dict: The header, round_end events, player frame and round stats (None if
+                  they were not extracted), or None on a cache miss.
+        """
+        entry_dir = self._entry_dir(content_hash)
+        if not os.path.isdir(entry_dir):
+            return None
+
+        try:
+            with open(os.path.join(entry_dir, 'header.json'), 'r') as header_file:
+                header = json.load(header_file)
+            round_end_events = pd.read_parquet(os.path.join(entry_dir, 'round_end.parquet'))
+            players = pd.read_parquet(os.path.join(entry_dir, 'players.parquet'))
+            rounds_path = os.path.join(entry_dir, 'rounds.parquet')
+            rounds = pd.read_parquet(rounds_path) if os.path.exists(rounds_path) else None
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable cache entry {entry_dir}: {e}")
+            return None
+
+        return {
+            'header': header,
+            'round_end_events': round_end_events,
+            'players': players,
+            'rounds': rounds,
+        }
+
+    def store(self, content_hash, header, round_end_events, players, rounds=None):
+        """
+        Store an entry, replacing any existing one. The entry is written to a temporary
+        directory first so a crash never leaves a half-written entry behind.
+
+        A failure to write the entry, such as a full disk or a missing Parquet engine, is
+        logged and the demo is simply not cached; any other error is raised.
+        """
+        entry_dir = self._entry_dir(content_hash)
+        tmp_dir = f"{entry_dir}.tmp{os.getpid()}"
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            with open(os.path.join(tmp_dir, 'header.json'), 'w') as header_file:
+                json.dump(header, header_file)
+            round_end_events.to_parquet(os.path.join(tmp_dir, 'round_end.parquet'), index=False)
+            players.to_parquet(os.path.join(tmp_dir, 'players.parquet'), index=False)
+            if rounds is not None:
+                rounds.to_parquet(os.path.join(tmp_dir, 'rounds.parquet'), index=False)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+        except (OSError, ValueError, ImportError) as e:
+            logging.warning(f"Failed to cache demo data for {content_hash} in {entry_dir}: {e}")
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
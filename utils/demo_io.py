@@ -0,0 +1,87 @@
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+DEMO_SUFFIX = '.dem'
+
+# Size of the chunks streamed from a compressed demo into the scratch file
+CHUNK_SIZE = 1024 * 1024
+
+
+def _open_zstd(path):
+    try:
+        from compression import zstd  # Python 3.14+
+        return zstd.open(path, 'rb')
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError(f"Reading {path} requires the zstandard package (pip install zstandard)")
+    return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+
+
+COMPRESSED_SUFFIXES = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.zst': _open_zstd,
+}
+
+
+def _split_compression_suffix(path):
+    for suffix in COMPRESSED_SUFFIXES:
+        if path.endswith(DEMO_SUFFIX + suffix):
+            return path[:-len(suffix)], suffix
+    return path, None
+
+
+def is_demo_file(path):
+    """
+    Check whether a path is a demo file, either raw (.dem) or compressed (.dem.gz, .dem.bz2, .dem.zst).
+    """
+    return _split_compression_suffix(path)[0].endswith(DEMO_SUFFIX)
+
+
+def demo_file_name(path):
+    """
+    Return the demo's file name without any compression suffix, so a compressed demo
+    is recorded under the same name as the raw one.
+    """
+    return os.path.basename(_split_compression_suffix(path)[0])
+
+
+def _scratch_path():
+    return os.path.join(
+        tempfile.gettempdir(), f"cs2-bot-demo-{os.getpid()}-{threading.get_ident()}{DEMO_SUFFIX}"
+    )
+
+
+@contextmanager
+def open_demo(path):
+    """
+    Yield a path to the raw demo that DemoParser can read.
+
+    Raw demos are used in place. Compressed demos are streamed chunk by chunk into a
+    scratch file owned by the current process and thread, which is removed as soon as
+    the caller is done with it. Disk usage therefore peaks at one decompressed demo per
+    worker, regardless of how many archives are ingested.
+    """
+    _, suffix = _split_compression_suffix(path)
+    if suffix is None:
+        yield path
+        return
+
+    scratch_path = _scratch_path()
+    try:
+        with COMPRESSED_SUFFIXES[suffix](path) as compressed, open(scratch_path, 'wb') as scratch:
+            shutil.copyfileobj(compressed, scratch, CHUNK_SIZE)
+        yield scratch_path
+    finally:
+        try:
+            os.remove(scratch_path)
+        except OSError:
+            pass
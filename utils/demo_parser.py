@@ -1,65 +1,244 @@
 import argparse
-import json
+import cProfile
 import logging
 import os
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime
 
+import pandas as pd
 from demoparser2 import DemoParser
+from sqlalchemy import insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 from database.database import SessionLocal
-from services.mmr_algorithm import recalculate_all_mmr
-from services.models import PlayerMatchStats, Player, Match
-
-
-def parse_demo_file(demo_file_path, discord_mapping, db: SessionLocal):
+from services import crud
+from services.mapping_index import MappingIndex, mapping_index
+from services.synergy import get_synergy_matrix
+from services.mmr_algorithm import recalculate_all_mmr, replay_from, update_ratings
+from services.models import PlayerMatchStats, PlayerRoundStats, Player, Match, ProcessedDemo
+from utils import ingest_profiler
+from utils.demo_cache import DemoCache, demo_content_hash
+from utils.demo_io import demo_file_name, is_demo_file, open_demo
+from utils.demo_watcher import DemoWatcher
+from utils.round_stats import extract_round_stats
+
+DEFAULT_INPUT_PATH = "C:/Users/Dimas/MatchZy"
+DEFAULT_CACHE_DIR = "demo_cache"
+
+# Map team numbers to team names
+TEAM_MAP = {2: 'TERRORIST', 3: 'COUNTER_TERRORIST', 0: 'SPECTATOR'}
+TEAM_NAMES = ['TERRORIST', 'COUNTER_TERRORIST']
+
+# Winner team map
+WINNER_TEAM_MAP = {'T': 'TERRORIST', 'CT': 'COUNTER_TERRORIST'}
+
+# Tick fields copied into PlayerMatchStats, and the column each one is stored in
+STATS_FIELD_MAP = {
+    'kills_total': 'kills_total',
+    'deaths_total': 'deaths_total',
+    'assists_total': 'assists_total',
+    'damage_total': 'damage_total',
+    'alive_time_total': 'alive_time_total',
+    'headshot_kills_total': 'headshot_kills_total',
+    'utility_damage_total': 'utility_damage_total',
+    'enemies_flashed_total': 'enemies_flashed_total',
+    'ace_rounds_total': 'ace_rounds_total',
+    '4k_rounds_total': 'four_k_rounds_total',
+    '3k_rounds_total': 'three_k_rounds_total',
+    'score': 'score',
+    'mvps': 'mvps',
+}
+
+
+def parse_demo_file(demo_file_path, mapping: MappingIndex, db: SessionLocal, cache: DemoCache = None, extract_rounds=False):
     """
     Parse the demo file to extract match and player statistics and save them to the database.
+
+    Returns:
+        Match: The saved match, or None if the demo was skipped or failed to parse.
     """
     try:
-        # Check if the demo has already been processed
-        demo_file_name = os.path.basename(demo_file_path)
-        existing_match = db.query(Match).filter(Match.team_results == demo_file_name).first()
-        if existing_match:
-            logging.info(f"Demo {demo_file_name} has already been processed. Skipping.")
-            return
+        with ingest_profiler.demo(demo_file_path):
+            with ingest_profiler.stage('content_hash'):
+                content_hash = demo_content_hash(demo_file_path)
+
+            # Check if the demo has already been processed
+            with ingest_profiler.stage('dedup_check'):
+                if is_demo_processed(demo_file_path, content_hash, db):
+                    return
+
+            demo_data = extract_demo_data(demo_file_path, content_hash, cache, extract_rounds)
+            if demo_data is None:
+                return
+
+            return save_demo_data(demo_data, mapping, db)
+
+    except Exception as e:
+        logging.error(f"Failed to parse demo file {demo_file_path}: {e}")
+        db.rollback()
+
+
+def is_demo_processed(demo_file_path, content_hash, db: SessionLocal):
+    """
+    Check whether the demo file has already been saved to the database.
+
+    Demos are identified by content hash. Matches ingested before content hashes were
+    recorded are still found by file name, and get their hash recorded on the way.
+    """
+    file_name = demo_file_name(demo_file_path)
+    processed_demo = db.query(ProcessedDemo).filter(ProcessedDemo.content_hash == content_hash).first()
+    if processed_demo:
+        logging.info(f"Demo {file_name} has already been processed as {processed_demo.file_name}. Skipping.")
+        return True
+
+    existing_match = db.query(Match).filter(Match.team_results == file_name).first()
+    if existing_match:
+        if not db.query(ProcessedDemo).filter(ProcessedDemo.match_id == existing_match.id).first():
+            db.add(ProcessedDemo(content_hash=content_hash, file_name=file_name, match_id=existing_match.id))
+            db.commit()
+        logging.info(f"Demo {file_name} has already been processed. Skipping.")
+        return True
+    return False
+
+
+def extract_demo_data(demo_file_path, content_hash, cache: DemoCache = None, extract_rounds=False):
+    """
+    Run the DemoParser passes for a demo file and return the extracted data.
+
+    When a cache is given and holds an entry for the content hash, DemoParser is not
+    run at all. This step does not touch the database, so it can run in a worker process.
+
+    Returns:
+        dict: The demo file name, content hash, header, round_end events, final-tick
+              player frame and per-round stats (None unless extract_rounds is set),
+              or None if the demo has no round_end events.
+    """
+    demo_data = {
+        'demo_file_path': demo_file_path,
+        'demo_file_name': demo_file_name(demo_file_path),
+        'content_hash': content_hash,
+    }
+
+    with ingest_profiler.stage('cache_load'):
+        cached = cache.load(content_hash) if cache else None
+    if cached and (cached['rounds'] is not None or not extract_rounds):
+        logging.info(f"Loaded {demo_file_path} from the demo cache.")
+        demo_data.update(cached)
+        if not extract_rounds:
+            demo_data['rounds'] = None
+        return demo_data
+
+    # Compressed demos are streamed into a scratch file that only lives while it is parsed
+    with ExitStack() as stack:
+        with ingest_profiler.stage('open_demo'):
+            raw_demo_path = stack.enter_context(open_demo(demo_file_path))
+        parsed = run_demo_parser(raw_demo_path, extract_rounds)
+    if parsed is None:
+        return None
+    header_info, round_end_events, df, rounds = parsed
+
+    if cache:
+        with ingest_profiler.stage('cache_store'):
+            cache.store(content_hash, header_info, round_end_events, df, rounds)
+
+    demo_data.update({
+        'header': header_info,
+        'round_end_events': round_end_events,
+        'players': df,
+        'rounds': rounds,
+    })
+    return demo_data
+
+
+def run_demo_parser(demo_file_path, extract_rounds=False):
+    """
+    Run the DemoParser passes on a raw demo file.
 
+    Returns:
+        tuple: The header, round_end events, final-tick player frame and per-round stats
+               (None unless extract_rounds is set), or None if the demo has no round_end events.
+    """
+    with ingest_profiler.stage('DemoParser'):
         parser = DemoParser(demo_file_path)
-        logging.info(f"Initialized DemoParser for {demo_file_path}.")
+    logging.info(f"Initialized DemoParser for {demo_file_path}.")
 
-        # Parse player info to get team mapping
+    # Parse player info to get team mapping
+    with ingest_profiler.stage('parse_player_info'):
         player_info_df = parser.parse_player_info()
-        logging.info("Parsed player info.")
+    logging.info("Parsed player info.")
 
-        header_info = parser.parse_header()
-        map_name = header_info.get('map_name', 'unknown')
+    with ingest_profiler.stage('parse_header'):
+        header_info = dict(parser.parse_header())
 
-        # Map team numbers to team names
-        team_map = {2: 'TERRORIST', 3: 'COUNTER_TERRORIST', 0: 'SPECTATOR'}
-
-        # Parse 'round_end' events to accumulate team scores
+    # Parse 'round_end' events to accumulate team scores
+    with ingest_profiler.stage('parse_event(round_end)'):
         round_end_events = parser.parse_event("round_end")
-        if round_end_events.empty:
-            logging.error("No round_end events found.")
-            return
+    if round_end_events.empty:
+        logging.error("No round_end events found.")
+        return None
+
+    # Get the maximum tick
+    max_tick = round_end_events["tick"].max()
+
+    # Fields to extract
+    wanted_fields = [
+        "player_name",
+        "user_id",
+        "team_num",
+        "kills_total",
+        "deaths_total",
+        "assists_total",
+        "mvps",
+        "score",
+        "headshot_kills_total",
+        "ace_rounds_total",
+        "4k_rounds_total",
+        "3k_rounds_total",
+        "utility_damage_total",
+        "enemies_flashed_total",
+        "alive_time_total",
+        "damage_total",
+    ]
+
+    # Parse the desired ticks
+    with ingest_profiler.stage('parse_ticks'):
+        df = parser.parse_ticks(wanted_fields, ticks=[max_tick])
+    logging.info("Parsed ticks for desired fields.")
+
+    rounds = None
+    if extract_rounds:
+        with ingest_profiler.stage('round_stats'):
+            rounds = extract_round_stats(parser, round_end_events)
 
-        # Winner team map
-        winner_team_map = {'T': 'TERRORIST', 'CT': 'COUNTER_TERRORIST'}
+    return header_info, round_end_events, df, rounds
 
-        # Initialize team scores
-        team_scores = {'TERRORIST': 0, 'COUNTER_TERRORIST': 0}
 
-        # Iterate over round_end events
-        for _, event in round_end_events.iterrows():
-            winner_team_code = event.get('winner')
-            winner_team_name = winner_team_map.get(winner_team_code)
-            if winner_team_name:
-                team_scores[winner_team_name] += 1
+def save_demo_data(demo_data, mapping: MappingIndex, db: SessionLocal):
+    """
+    Save the data extracted by extract_demo_data to the database.
+
+    The match, any new players and all player stats are written in a single transaction.
+    """
+    demo_file_path = demo_data['demo_file_path']
+    demo_file_name = demo_data['demo_file_name']
+    map_name = demo_data['header'].get('map_name', 'unknown')
+    round_end_events = demo_data['round_end_events']
+    df = demo_data['players']
+
+    with ingest_profiler.stage('transform'):
+        # Count rounds won by each team
+        if 'winner' in round_end_events:
+            round_winners = round_end_events['winner'].map(WINNER_TEAM_MAP)
+        else:
+            round_winners = pd.Series(dtype=object)
+        team_scores = round_winners.value_counts().reindex(TEAM_NAMES, fill_value=0).astype(int).to_dict()
 
         # Determine match result
-        t_rounds = team_scores.get('TERRORIST', 0)
-        ct_rounds = team_scores.get('COUNTER_TERRORIST', 0)
+        t_rounds = team_scores['TERRORIST']
+        ct_rounds = team_scores['COUNTER_TERRORIST']
 
         if t_rounds > ct_rounds:
             winner = 'TERRORIST'
@@ -68,45 +247,20 @@ def parse_demo_file(demo_file_path, discord_mapping, db: SessionLocal):
         else:
             winner = 'draw'
 
-        # Get the maximum tick
-        max_tick = round_end_events["tick"].max()
-
-        # Fields to extract
-        wanted_fields = [
-            "player_name",
-            "user_id",
-            "team_num",
-            "kills_total",
-            "deaths_total",
-            "assists_total",
-            "mvps",
-            "score",
-            "headshot_kills_total",
-            "ace_rounds_total",
-            "4k_rounds_total",
-            "3k_rounds_total",
-            "utility_damage_total",
-            "enemies_flashed_total",
-            "alive_time_total",
-            "damage_total",
-        ]
-
-        # Parse the desired ticks
-        df = parser.parse_ticks(wanted_fields, ticks=[max_tick])
-        logging.info("Parsed ticks for desired fields.")
-
         # Replace NaN with zeros
-        df.fillna(0, inplace=True)
+        df = df.fillna(0)
 
         # Map team numbers to team names
-        df['team_name'] = df['team_num'].map(team_map)
+        df['team_name'] = df['team_num'].map(TEAM_MAP)
         df = df[df['team_name'] != 'SPECTATOR']  # remove spectators
+        steamids = df['steamid'].astype(str)
 
         # Extract date from filename
         demo_date = extract_date_from_filename(demo_file_path)
         if not demo_date:
             demo_date = datetime.utcnow()  # Use current time if extraction fails
 
+    with ingest_profiler.stage('db_insert_match'):
         # Create Match instance
         match = Match(
             date_time=demo_date,
@@ -120,65 +274,204 @@ def parse_demo_file(demo_file_path, discord_mapping, db: SessionLocal):
         )
 
         db.add(match)
-        db.commit()  # Commit to get match.id
-
-        # get additional custom mappings
-        account_mapping = discord_mapping.get("accounts")
-        role_mapping = discord_mapping.get("roles")
-        core_members = discord_mapping.get("core")
-
-        # Process players and stats
-        for _, player_data in df.iterrows():
-            steamid = player_data['steamid']
-            player_name = player_data['player_name']
-            team_name = player_data['team_name']
-            discord_id = account_mapping.get(str(steamid))
-            role = role_mapping.get(str(steamid))
-            core = True if str(steamid) in core_members else False
-            # Check if player exists
-            player = db.query(Player).filter_by(steamid=steamid).first()
-            if not player:
-                # Create new player
-                player = Player(
-                    steamid=steamid,
-                    username=player_name,
-                    discord_id=discord_id,
-                    role=role,
-                    core_member=core,
-                )
-                db.add(player)
-                db.commit()  # Commit to get player.id
-
-            # Create PlayerMatchStats
-            player_stats = PlayerMatchStats(
-                match_id=match.id,
-                player_id=player.id,
-                team=team_name,
-                kills_total=int(player_data.get('kills_total', 0)),
-                deaths_total=int(player_data.get('deaths_total', 0)),
-                assists_total=int(player_data.get('assists_total', 0)),
-                damage_total=int(player_data.get('damage_total', 0)),
-                alive_time_total=int(player_data.get('alive_time_total', 0)),
-                headshot_kills_total=int(player_data.get('headshot_kills_total', 0)),
-                utility_damage_total=int(player_data.get('utility_damage_total', 0)),
-                enemies_flashed_total=int(player_data.get('enemies_flashed_total', 0)),
-                ace_rounds_total=int(player_data.get('ace_rounds_total', 0)),
-                four_k_rounds_total=int(player_data.get('4k_rounds_total', 0)),
-                three_k_rounds_total=int(player_data.get('3k_rounds_total', 0)),
-                score=int(player_data.get('score', 0)),
-                mvps=int(player_data.get('mvps', 0)),
-                rounds_won=team_scores.get(team_name, 0),
-                rounds_lost=(t_rounds + ct_rounds) - team_scores.get(team_name, 0),
-            )
+        db.add(ProcessedDemo(content_hash=demo_data['content_hash'], file_name=demo_file_name, match=match))
+        db.flush()  # Flush to get match.id
+
+    with ingest_profiler.stage('db_resolve_players'):
+        player_ids = resolve_player_ids(steamids, df['player_name'], mapping, db)
+
+    with ingest_profiler.stage('transform'):
+        # Build PlayerMatchStats rows
+        stats = pd.DataFrame(
+            {
+                stats_column: df[field] if field in df else 0
+                for field, stats_column in STATS_FIELD_MAP.items()
+            },
+            index=df.index,
+        ).astype(int)
+        stats['rounds_won'] = df['team_name'].map(team_scores).fillna(0).astype(int)
+        stats['rounds_lost'] = (t_rounds + ct_rounds) - stats['rounds_won']
+        stats.insert(0, 'team', df['team_name'].where(df['team_name'].notna(), None))
+        stats.insert(0, 'player_id', steamids.map(player_ids))
+        stats.insert(0, 'match_id', match.id)
+
+    with ingest_profiler.stage('db_insert_stats'):
+        db.execute(insert(PlayerMatchStats), stats.to_dict('records'))
+
+        rounds = demo_data.get('rounds')
+        if rounds is not None and not rounds.empty:
+            save_round_stats(rounds, match.id, player_ids, db)
+
+    with ingest_profiler.stage('db_commit'):
+        db.commit()
+    logging.info(f"Successfully processed and saved data for demo: {demo_file_name}")
+    return match
 
-            db.add(player_stats)
 
-        db.commit()
-        logging.info(f"Successfully processed and saved data for demo: {demo_file_name}")
+def save_round_stats(rounds, match_id, player_ids, db: SessionLocal):
+    """
+    Bulk insert the per-round stats of a match. Rounds of players that are not in the
+    final-tick player frame (e.g. players who left early) are skipped. Nothing is committed.
+    """
+    rounds = rounds[rounds['steamid'].isin(player_ids.keys())]
+    round_rows = rounds.drop(columns=['steamid', 'team_num'])
+    round_rows.insert(0, 'team', rounds['team_num'].map(TEAM_MAP))
+    round_rows.insert(0, 'player_id', rounds['steamid'].map(player_ids))
+    round_rows.insert(0, 'match_id', match_id)
+    db.execute(insert(PlayerRoundStats), round_rows.to_dict('records'))
+
+
+def resolve_player_ids(steamids, player_names, mapping: MappingIndex, db: SessionLocal):
+    """
+    Look up the player ids for the given SteamIDs, creating players that do not exist yet.
 
+    Existing players are found with a single IN query and missing players are added with
+    a single bulk insert. Nothing is committed.
+
+    Returns:
+        dict: SteamID to player id.
+
+    Raises:
+        ValueError: If a player could not be created, e.g. because of a conflicting Discord ID.
+    """
+    unique_steamids = list(dict.fromkeys(steamids))
+    player_ids = dict(
+        db.query(Player.steamid, Player.id).filter(Player.steamid.in_(unique_steamids)).all()
+    )
+
+    player_names = dict(zip(steamids, player_names))
+    new_players = [
+        {
+            'steamid': steamid,
+            'username': player_names[steamid],
+            'discord_id': mapping.discord_id(steamid),
+            'role': mapping.role(steamid),
+            'core_member': mapping.is_core(steamid),
+        }
+        for steamid in unique_steamids
+        if steamid not in player_ids
+    ]
+    if new_players:
+        db.execute(sqlite_insert(Player).on_conflict_do_nothing(), new_players)
+        new_steamids = [player['steamid'] for player in new_players]
+        player_ids.update(
+            db.query(Player.steamid, Player.id).filter(Player.steamid.in_(new_steamids)).all()
+        )
+
+    missing = [steamid for steamid in unique_steamids if steamid not in player_ids]
+    if missing:
+        raise ValueError(f"Could not create players for SteamIDs {missing}")
+    return player_ids
+
+
+def _extract_demo_data_safe(demo_file_path, content_hash, cache: DemoCache = None, extract_rounds=False, profile=False):
+    """
+    Worker entry point: extract a demo and log failures instead of raising them.
+
+    Returns:
+        tuple: The extracted demo data (None on failure) and the profile records
+               collected while extracting it (empty unless profile is set).
+    """
+    profiler = ingest_profiler.enable() if profile else None
+    try:
+        with ingest_profiler.demo(demo_file_path):
+            demo_data = extract_demo_data(demo_file_path, content_hash, cache, extract_rounds)
     except Exception as e:
         logging.error(f"Failed to parse demo file {demo_file_path}: {e}")
-        db.rollback()
+        demo_data = None
+    return demo_data, profiler.records if profiler else []
+
+
+def ingest_demo_files(
+    demo_files, mapping: MappingIndex, db: SessionLocal, workers=1, cache: DemoCache = None, extract_rounds=False
+):
+    """
+    Ingest demo files, parsing them in a process pool when workers > 1.
+
+    Parsing runs in the worker processes; all database writes happen here, in the
+    calling process, in the same order as a serial run.
+    """
+    if workers <= 1:
+        for demo_file in demo_files:
+            logging.info(f"Processing {demo_file}")
+            parse_demo_file(demo_file, mapping, db, cache, extract_rounds)
+        return
+
+    pending_files = []
+    content_hashes = []
+    for demo_file in demo_files:
+        with ingest_profiler.demo(demo_file):
+            try:
+                with ingest_profiler.stage('content_hash'):
+                    content_hash = demo_content_hash(demo_file)
+            except OSError as e:
+                logging.error(f"Failed to parse demo file {demo_file}: {e}")
+                continue
+            with ingest_profiler.stage('dedup_check'):
+                if is_demo_processed(demo_file, content_hash, db):
+                    continue
+        pending_files.append(demo_file)
+        content_hashes.append(content_hash)
+    if not pending_files:
+        return
+
+    profiler = ingest_profiler.active()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=setup_logging) as executor:
+        # map() yields results in submission order, so match ids are assigned as in a serial run
+        results = executor.map(
+            _extract_demo_data_safe,
+            pending_files,
+            content_hashes,
+            [cache] * len(pending_files),
+            [extract_rounds] * len(pending_files),
+            [profiler is not None] * len(pending_files),
+        )
+        for demo_file, (demo_data, profile_records) in zip(pending_files, results):
+            logging.info(f"Processing {demo_file}")
+            if profiler:
+                profiler.merge(profile_records)
+            if demo_data is None:
+                continue
+            try:
+                with ingest_profiler.demo(demo_file):
+                    # The same demo may appear twice in the input, check again before writing
+                    if is_demo_processed(demo_file, demo_data['content_hash'], db):
+                        continue
+                    save_demo_data(demo_data, mapping, db)
+            except Exception as e:
+                logging.error(f"Failed to parse demo file {demo_file}: {e}")
+                db.rollback()
+
+
+def watch_demo_directory(
+    input_path, mapping: MappingIndex, db: SessionLocal, cache: DemoCache = None, settle_seconds=2.0, extract_rounds=False
+):
+    """
+    Ingest demos as they appear in input_path and update the ratings of their players.
+
+    Runs until interrupted.
+    """
+    def ingest_demo(demo_file):
+        logging.info(f"Processing {demo_file}")
+        # Pick up edits to mapping.json without restarting
+        mapping.refresh_and_sync(db)
+        match = parse_demo_file(demo_file, mapping, db, cache, extract_rounds)
+        if match is not None:
+            with ingest_profiler.demo(demo_file), ingest_profiler.stage('update_ratings'):
+                update_ratings(db)
+            logging.info(f"Updated MMR for the players of {match.team_results}")
+
+    watcher = DemoWatcher(
+        input_path,
+        on_demo_ready=ingest_demo,
+        is_demo_file=is_demo_file,
+        settle_seconds=settle_seconds,
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        logging.info("Stopped watching for demos.")
 
 
 def extract_date_from_filename(filename):
@@ -218,8 +511,49 @@ def parse_arguments():
     parser = argparse.ArgumentParser(
         description='Parse CS2 .dem files to extract player statistics.'
     )
-    parser.add_argument('-i', '--input', required=True, help='Input .dem file path or directory')
-    parser.add_argument('-o', '--output', required=True, help='Output JSON file path')
+    parser.add_argument(
+        '-i', '--input', default=DEFAULT_INPUT_PATH,
+        help='Input .dem, .dem.gz, .dem.bz2 or .dem.zst file path or directory'
+    )
+    parser.add_argument('-o', '--output', help='Output JSON file path')
+    parser.add_argument(
+        '-w', '--workers', type=int, default=1,
+        help='Number of processes used to parse demos (default: 1, parse in the main process)'
+    )
+    parser.add_argument(
+        '--cache-dir', default=DEFAULT_CACHE_DIR,
+        help=f'Directory for cached parsed demo data (default: {DEFAULT_CACHE_DIR})'
+    )
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the parsed demo cache')
+    parser.add_argument(
+        '--watch', action='store_true',
+        help='Keep running and ingest new demos from the input directory as soon as they are complete'
+    )
+    parser.add_argument(
+        '--settle-seconds', type=float, default=2.0,
+        help='In --watch mode, how long a file must stay unchanged before it is parsed (default: 2)'
+    )
+    parser.add_argument(
+        '--rounds', action='store_true',
+        help='Also extract per-round player stats (economy, opening kills, trades, clutches)'
+    )
+    parser.add_argument(
+        '--recalculate', action='store_true',
+        help='Replay all matches to recalculate MMR instead of applying only the new ones'
+    )
+    parser.add_argument(
+        '--replay-from', type=int, metavar='MATCH_ID',
+        help='Replay MMR from this match onward, starting at the nearest checkpoint, e.g. after correcting it'
+    )
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='Record wall time, CPU time and peak RSS per ingest stage and demo, and print a summary'
+    )
+    parser.add_argument('--profile-output', help='With --profile, write the per-stage records to this JSON file')
+    parser.add_argument(
+        '--profile-compare', help='With --profile, compare mean stage times against a JSON file from an earlier run'
+    )
+    parser.add_argument('--cprofile', help='Write cProfile stats of the main process to this file')
     return parser.parse_args()
 
 
@@ -231,7 +565,15 @@ def setup_logging():
     )
 
 
-def main(input_path, db: SessionLocal):
+def main(
+    input_path,
+    db: SessionLocal,
+    workers=1,
+    cache_dir=DEFAULT_CACHE_DIR,
+    watch=False,
+    settle_seconds=2.0,
+    extract_rounds=False,
+):
     """Main function to execute the script."""
     setup_logging()
 
@@ -240,18 +582,28 @@ def main(input_path, db: SessionLocal):
         sys.exit(1)
 
     try:
+        mapping_index.refresh_and_sync(db)
+        cache = DemoCache(cache_dir) if cache_dir else None
+
+        if watch:
+            if not os.path.isdir(input_path):
+                logging.error(f"Input path {input_path} is not a directory.")
+                sys.exit(1)
+            watch_demo_directory(
+                input_path, mapping_index, db, cache, settle_seconds=settle_seconds, extract_rounds=extract_rounds
+            )
+            return
+
         logging.info(f"Parsing demo files in: {input_path}")
 
         if os.path.isdir(input_path):
-            demo_files = [os.path.join(input_path, f) for f in os.listdir(input_path) if f.endswith('.dem')]
+            demo_files = sorted(os.path.join(input_path, f) for f in os.listdir(input_path) if is_demo_file(f))
         else:
             demo_files = [input_path]
 
-        with open("mapping.json", "r") as discord_mapping_file:
-            discord_mapping = json.load(discord_mapping_file)
-            for demo_file in demo_files:
-                logging.info(f"Processing {demo_file}")
-                parse_demo_file(demo_file, discord_mapping, db)
+        ingest_demo_files(
+            demo_files, mapping_index, db, workers=workers, cache=cache, extract_rounds=extract_rounds
+        )
 
     except Exception as e:
         logging.error(f"An error occurred: {e}")
@@ -260,6 +612,46 @@ def main(input_path, db: SessionLocal):
 
 
 if __name__ == '__main__':
+    args = parse_arguments()
     db = SessionLocal()
-    main("C:/Users/Dimas/MatchZy", db)
-    recalculate_all_mmr(db)
+
+    profiler = ingest_profiler.enable() if args.profile else None
+    cprofiler = cProfile.Profile() if args.cprofile else None
+    if cprofiler:
+        cprofiler.enable()
+
+    main(
+        args.input,
+        db,
+        workers=args.workers,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        watch=args.watch,
+        settle_seconds=args.settle_seconds,
+        extract_rounds=args.rounds,
+    )
+    if args.recalculate:
+        with ingest_profiler.stage('recalculate_all_mmr'):
+            recalculate_all_mmr(db)
+            get_synergy_matrix(db).update(db, recount=True)
+    elif args.replay_from:
+        replay_match = crud.get_match(db, match_id=args.replay_from)
+        if replay_match is None:
+            logging.error(f"Match {args.replay_from} not found, MMR was not replayed.")
+        else:
+            with ingest_profiler.stage('replay_from'):
+                replay_from(db, replay_match)
+                # The match may have been corrected in place, under the same id
+                get_synergy_matrix(db).update(db, recount=True)
+    elif not args.watch:
+        with ingest_profiler.stage('update_ratings'):
+            update_ratings(db)
+
+    if cprofiler:
+        cprofiler.disable()
+        cprofiler.dump_stats(args.cprofile)
+        logging.info(f"Wrote cProfile stats to {args.cprofile}")
+    if profiler:
+        previous = ingest_profiler.IngestProfiler.read_json(args.profile_compare) if args.profile_compare else None
+        print(profiler.summary(previous=previous))
+        if args.profile_output:
+            profiler.write_json(args.profile_output)
@@ -0,0 +1,131 @@
+import logging
+import os
+import threading
+import time
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watchdog is optional, fall back to polling the directory
+    FileSystemEventHandler = object
+    Observer = None
+
+
+class _WakeUpHandler(FileSystemEventHandler):
+    """
+    Forward file system events for demo files to the watcher.
+    """
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        path = getattr(event, 'dest_path', None) or event.src_path
+        self.watcher.notify(path)
+
+
+class DemoWatcher:
+    """
+    Watch a directory and hand each demo file to a callback once it has stopped changing.
+
+    File system events come from watchdog (inotify on Linux) when it is installed,
+    otherwise the directory is polled. In both cases a file is only considered complete
+    when its size and modification time have not changed for settle_seconds, so demos
+    that are still being uploaded are never parsed.
+    """
+
+    def __init__(self, directory, on_demo_ready, is_demo_file, settle_seconds=2.0, poll_interval=1.0):
+        self.directory = directory
+        self.on_demo_ready = on_demo_ready
+        self.is_demo_file = is_demo_file
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+
+        # path -> (size, mtime, time the file was last seen changing)
+        self.pending = {}
+        # path -> (size, mtime) of files already handed to the callback
+        self.done = {}
+        self._lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._stopped = threading.Event()
+
+    def notify(self, path):
+        """
+        Mark a path as possibly new or changed.
+        """
+        if not self.is_demo_file(path):
+            return
+        with self._lock:
+            self.pending.setdefault(path, None)
+        self._wake_up.set()
+
+    def scan(self):
+        """
+        Mark every demo file in the directory as possibly new or changed.
+        """
+        for file_name in os.listdir(self.directory):
+            self.notify(os.path.join(self.directory, file_name))
+
+    def stop(self):
+        self._stopped.set()
+        self._wake_up.set()
+
+    def run(self):
+        """
+        Watch the directory until stop() is called.
+        """
+        observer = None
+        if Observer is not None:
+            observer = Observer()
+            observer.schedule(_WakeUpHandler(self), self.directory, recursive=False)
+            observer.start()
+            logging.info(f"Watching {self.directory} for new demos.")
+        else:
+            logging.info(f"watchdog is not installed, polling {self.directory} every {self.poll_interval}s.")
+
+        self.scan()
+        try:
+            while not self._stopped.is_set():
+                if observer is None:
+                    self.scan()
+                self._check_pending()
+
+                with self._lock:
+                    has_pending = bool(self.pending)
+                # With file system events there is nothing to poll for until a file is pending
+                timeout = self.poll_interval if observer is None or has_pending else None
+                self._wake_up.wait(timeout)
+                self._wake_up.clear()
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+    def _check_pending(self):
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            for path, previous in list(self.pending.items()):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    del self.pending[path]
+                    continue
+
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if self.done.get(path) == signature:
+                    del self.pending[path]
+                elif previous is None or previous[:2] != signature:
+                    self.pending[path] = signature + (now,)
+                elif now - previous[2] >= self.settle_seconds:
+                    del self.pending[path]
+                    self.done[path] = signature
+                    ready.append(path)
+
+        for path in sorted(ready):
+            try:
+                self.on_demo_ready(path)
+            except Exception as e:
+                logging.error(f"Failed to ingest demo file {path}: {e}")
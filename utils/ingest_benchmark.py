@@ -0,0 +1,333 @@
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from database.database import Base
+from services.mapping_index import MappingIndex
+from services.mmr_algorithm import recalculate_all_mmr
+from services.models import Match, Player, PlayerMatchStats, PlayerRoundStats
+from utils import demo_parser
+from utils.demo_cache import DemoCache
+from utils.ingest_profiler import peak_rss_mb
+
+# Worker processes started with "spawn" re-import this module, so the fake parser's
+# configuration is passed to them through the environment
+FAKE_PARSER_ENV = 'CS2_BOT_BENCH_FAKE_PARSER'
+
+TICKS_PER_ROUND = 6400
+FREEZE_TICKS = 1000
+FIRST_STEAMID = 76561198000000000
+
+
+class FakeDemoParser:
+    """
+    Stand-in for demoparser2.DemoParser that returns synthetic data.
+
+    The data is derived from the demo file's content, so the same file always produces
+    the same header, events and ticks, and different files produce different matches.
+    """
+
+    rounds = 24
+    players = 10
+    player_pool = 40
+
+    def __init__(self, demo_file_path):
+        with open(demo_file_path, 'rb') as demo_file:
+            self.rng = random.Random(demo_file.read(4096))
+        self.steamids = [FIRST_STEAMID + i for i in self.rng.sample(range(self.player_pool), self.players)]
+        self.team_nums = [2 if i < self.players // 2 else 3 for i in range(self.players)]
+        self.round_end_ticks = [(r + 1) * TICKS_PER_ROUND for r in range(self.rounds)]
+
+    def parse_header(self):
+        return {'map_name': self.rng.choice(['de_dust2', 'de_mirage', 'de_inferno', 'de_nuke']), 'server_name': 'bench'}
+
+    def parse_player_info(self):
+        return pd.DataFrame({
+            'steamid': self.steamids,
+            'name': [f"player{steamid % 1000}" for steamid in self.steamids],
+            'team_number': self.team_nums,
+        })
+
+    def parse_event(self, event_name, **kwargs):
+        if event_name == 'round_end':
+            return pd.DataFrame({
+                'tick': self.round_end_ticks,
+                'round': range(1, self.rounds + 1),
+                'winner': [self.rng.choice(['T', 'CT']) for _ in range(self.rounds)],
+                'reason': 'bomb_exploded',
+            })
+        if event_name == 'round_freeze_end':
+            return pd.DataFrame({'tick': [tick - TICKS_PER_ROUND + FREEZE_TICKS for tick in self.round_end_ticks]})
+        if event_name == 'player_death':
+            return self._player_deaths()
+        return pd.DataFrame()
+
+    def _player_deaths(self):
+        deaths = []
+        for end_tick in self.round_end_ticks:
+            tick = end_tick - TICKS_PER_ROUND + FREEZE_TICKS
+            alive = {2: [], 3: []}
+            for steamid, team_num in zip(self.steamids, self.team_nums):
+                alive[team_num].append(steamid)
+            while alive[2] and alive[3] and self.rng.random() < 0.9:
+                tick += self.rng.randint(10, 400)
+                victim_team = self.rng.choice([2, 3])
+                victim = self.rng.choice(alive[victim_team])
+                attacker = self.rng.choice(alive[5 - victim_team])
+                assister = self.rng.choice(self.steamids)
+                alive[victim_team].remove(victim)
+                deaths.append((tick, victim, attacker, assister))
+        return pd.DataFrame(deaths, columns=['tick', 'user_steamid', 'attacker_steamid', 'assister_steamid'])
+
+    def parse_ticks(self, wanted_props, ticks=None):
+        ticks = np.asarray(ticks if ticks is not None else self.round_end_ticks)
+        n_rows = len(ticks) * self.players
+        frame = {
+            'tick': np.repeat(ticks, self.players),
+            'steamid': np.tile(self.steamids, len(ticks)),
+            'name': np.tile([f"player{steamid % 1000}" for steamid in self.steamids], len(ticks)),
+        }
+        for prop in wanted_props:
+            if prop == 'team_num':
+                frame[prop] = np.tile(self.team_nums, len(ticks))
+            elif prop == 'player_name':
+                frame[prop] = frame['name']
+            elif prop == 'user_id':
+                frame[prop] = np.tile(np.arange(self.players), len(ticks))
+            else:
+                # Cumulative counters grow with the tick
+                progress = np.repeat(ticks, self.players) // TICKS_PER_ROUND
+                frame[prop] = progress * np.array([self.rng.randint(0, 3) for _ in range(n_rows)])
+        return pd.DataFrame(frame)
+
+
+def install_fake_parser(rounds, players, player_pool):
+    """
+    Replace DemoParser in utils.demo_parser with a FakeDemoParser of the given size,
+    in this process and in any worker process started later.
+    """
+    os.environ[FAKE_PARSER_ENV] = json.dumps({'rounds': rounds, 'players': players, 'player_pool': player_pool})
+    _install_fake_parser_from_env()
+
+
+def _install_fake_parser_from_env():
+    config = os.environ.get(FAKE_PARSER_ENV)
+    if not config:
+        return
+    for name, value in json.loads(config).items():
+        setattr(FakeDemoParser, name, value)
+    demo_parser.DemoParser = FakeDemoParser
+
+
+_install_fake_parser_from_env()
+
+
+def create_fake_demos(directory, count, seed):
+    """
+    Create count small demo files with distinct, reproducible content.
+
+    Returns:
+        list: The demo file paths, in ingest order.
+    """
+    rng = random.Random(seed)
+    demo_files = []
+    for i in range(count):
+        day = i % 28 + 1
+        file_name = f"2024-09-{day:02d}_{i // 28 % 24:02d}-00-00_{i}.dem"
+        demo_file_path = os.path.join(directory, file_name)
+        with open(demo_file_path, 'wb') as demo_file:
+            demo_file.write(rng.randbytes(4096))
+        demo_files.append(demo_file_path)
+    return demo_files
+
+
+def run_once(args, work_dir):
+    """
+    Ingest args.demos fake demos into a fresh SQLite database in work_dir.
+
+    Returns:
+        dict: Timings, row and query counts and memory use of the run.
+    """
+    demo_dir = os.path.join(work_dir, 'demos')
+    os.makedirs(demo_dir)
+    demo_files = create_fake_demos(demo_dir, args.demos, args.seed)
+
+    engine = create_engine(f"sqlite:///{os.path.join(work_dir, 'bench.db')}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine, autocommit=False, autoflush=False)()
+
+    query_count = 0
+
+    def count_query(*_):
+        nonlocal query_count
+        query_count += 1
+
+    event.listen(engine, 'before_cursor_execute', count_query)
+
+    cache = DemoCache(os.path.join(work_dir, 'cache')) if args.cache else None
+    mapping = MappingIndex(path=None)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    start = time.perf_counter()
+    demo_parser.ingest_demo_files(
+        demo_files, mapping, db, workers=args.workers, cache=cache, extract_rounds=args.rounds
+    )
+    ingest_seconds = time.perf_counter() - start
+    ingest_queries = query_count
+
+    start = time.perf_counter()
+    recalculate_all_mmr(db)
+    mmr_seconds = time.perf_counter() - start
+    traced_peak_mb = None
+    if args.tracemalloc:
+        traced_peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+
+    rows = {
+        'matches': db.query(Match).count(),
+        'players': db.query(Player).count(),
+        'player_match_stats': db.query(PlayerMatchStats).count(),
+        'player_round_stats': db.query(PlayerRoundStats).count(),
+    }
+    db.close()
+    engine.dispose()
+
+    total_rows = sum(rows.values())
+    return {
+        'ingest_seconds': ingest_seconds,
+        'mmr_seconds': mmr_seconds,
+        'demos_per_second': args.demos / ingest_seconds,
+        'rows_per_second': total_rows / ingest_seconds,
+        'rows': rows,
+        'ingest_queries': ingest_queries,
+        'queries_per_demo': ingest_queries / args.demos,
+        'mmr_queries': query_count - ingest_queries,
+        'peak_rss_mb': peak_rss_mb(),
+        'traced_peak_mb': traced_peak_mb,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    """
+    Run the benchmark args.repeat times and keep the run with the median ingest time.
+    """
+    install_fake_parser(args.rounds_per_demo, args.players, args.player_pool)
+
+    runs = []
+    for _ in range(args.repeat):
+        work_dir = tempfile.mkdtemp(prefix='cs2-bot-bench-')
+        try:
+            runs.append(run_once(args, work_dir))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    median_seconds = statistics.median(run['ingest_seconds'] for run in runs)
+    result = min(runs, key=lambda run: abs(run['ingest_seconds'] - median_seconds))
+    return {
+        'revision': git_revision(),
+        'config': {
+            'demos': args.demos,
+            'rounds_per_demo': args.rounds_per_demo,
+            'players': args.players,
+            'player_pool': args.player_pool,
+            'workers': args.workers,
+            'cache': args.cache,
+            'rounds': args.rounds,
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'result': result,
+    }
+
+
+COMPARED_METRICS = [
+    ('demos_per_second', 'demos/s', True),
+    ('rows_per_second', 'rows/s', True),
+    ('queries_per_demo', 'queries/demo', False),
+    ('mmr_seconds', 'MMR recalc s', False),
+    ('peak_rss_mb', 'peak RSS MB', False),
+    ('traced_peak_mb', 'traced peak MB', False),
+]
+
+
+def format_report(report, baseline=None):
+    result = report['result']
+    lines = [
+        f"revision {report['revision'] or 'unknown'}, config {json.dumps(report['config'])}",
+        f"ingested {report['config']['demos']} demos in {result['ingest_seconds']:.2f}s, rows {result['rows']}",
+    ]
+    if baseline and baseline['config'] != report['config']:
+        lines.append("warning: baseline was run with a different config, numbers are not comparable")
+    for key, label, higher_is_better in COMPARED_METRICS:
+        value = result[key]
+        if value is None:
+            continue
+        line = f"  {label:<16} {value:>12.2f}"
+        baseline_value = baseline['result'].get(key) if baseline else None
+        if baseline_value:
+            change = (value - baseline_value) / baseline_value * 100
+            better = change > 0 if higher_is_better else change < 0
+            line += f"  {change:+7.1f}% vs {baseline['revision'] or 'baseline'}" + (' (better)' if better else '')
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def parse_arguments():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark demo ingestion end to end with a fake DemoParser and a temporary SQLite database.'
+    )
+    parser.add_argument('-n', '--demos', type=int, default=200, help='Number of demos to ingest (default: 200)')
+    parser.add_argument('--rounds-per-demo', type=int, default=24, help='Rounds per fake demo (default: 24)')
+    parser.add_argument('--players', type=int, default=10, help='Players per fake demo (default: 10)')
+    parser.add_argument(
+        '--player-pool', type=int, default=40, help='Number of distinct players across all demos (default: 40)'
+    )
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Parser processes (default: 1)')
+    parser.add_argument('--cache', action='store_true', help='Write the parsed demo cache while ingesting')
+    parser.add_argument('--rounds', action='store_true', help='Also extract per-round player stats')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs to take the median of (default: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the fake demo contents (default: 0)')
+    parser.add_argument('--tracemalloc', action='store_true', help='Also report the peak of traced Python allocations')
+    parser.add_argument('-o', '--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Compare against a JSON results file from an earlier run')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    args = parse_arguments()
+    report = run_benchmark(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+    print(format_report(report, baseline))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
@@ -0,0 +1,181 @@
+import json
+import logging
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Process-wide profiler, None while profiling is disabled
+_active = None
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process so far, in MB, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class IngestProfiler:
+    """
+    Record wall time, CPU time and peak RSS for each ingest stage of each demo.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.current_demo = None
+
+    @contextmanager
+    def demo(self, demo_name):
+        previous_demo = self.current_demo
+        self.current_demo = demo_name
+        try:
+            yield
+        finally:
+            self.current_demo = previous_demo
+
+    @contextmanager
+    def stage(self, stage_name):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            self.records.append({
+                'demo': self.current_demo,
+                'stage': stage_name,
+                'wall': time.perf_counter() - wall_start,
+                'cpu': time.process_time() - cpu_start,
+                'peak_rss_mb': peak_rss_mb(),
+            })
+
+    def merge(self, records):
+        """Add records collected in another process."""
+        self.records.extend(records)
+
+    def stage_totals(self):
+        """
+        Returns:
+            dict: Stage name to count, total and max wall time, total CPU time and max peak RSS.
+        """
+        totals = defaultdict(lambda: {'count': 0, 'wall': 0.0, 'max_wall': 0.0, 'cpu': 0.0, 'peak_rss_mb': None})
+        for record in self.records:
+            stage_total = totals[record['stage']]
+            stage_total['count'] += 1
+            stage_total['wall'] += record['wall']
+            stage_total['max_wall'] = max(stage_total['max_wall'], record['wall'])
+            stage_total['cpu'] += record['cpu']
+            if record['peak_rss_mb'] is not None:
+                stage_total['peak_rss_mb'] = max(stage_total['peak_rss_mb'] or 0, record['peak_rss_mb'])
+        return dict(totals)
+
+    def demo_totals(self):
+        """
+        Returns:
+            dict: Demo name to total wall and CPU time over all of its stages.
+        """
+        totals = defaultdict(lambda: {'wall': 0.0, 'cpu': 0.0})
+        for record in self.records:
+            if record['demo'] is not None:
+                totals[record['demo']]['wall'] += record['wall']
+                totals[record['demo']]['cpu'] += record['cpu']
+        return dict(totals)
+
+    def summary(self, slowest=5, previous=None):
+        """
+        Format the per-stage totals and the slowest demos as a text table.
+
+        Args:
+            slowest (int): Number of slowest demos to list.
+            previous (IngestProfiler): An earlier run to compare the mean wall time per stage against.
+        """
+        previous_totals = previous.stage_totals() if previous else {}
+        lines = [
+            f"{'stage':<28} {'count':>6} {'wall s':>9} {'mean ms':>9} {'max ms':>9} {'cpu s':>9} {'peak MB':>8}"
+            + (f" {'vs prev':>8}" if previous else '')
+        ]
+        for stage_name, total in self.stage_totals().items():
+            mean_wall = total['wall'] / total['count']
+            peak = f"{total['peak_rss_mb']:.0f}" if total['peak_rss_mb'] is not None else '-'
+            line = (
+                f"{stage_name:<28} {total['count']:>6} {total['wall']:>9.2f} {mean_wall * 1000:>9.1f} "
+                f"{total['max_wall'] * 1000:>9.1f} {total['cpu']:>9.2f} {peak:>8}"
+            )
+            if previous:
+                previous_total = previous_totals.get(stage_name)
+                if previous_total:
+                    previous_mean = previous_total['wall'] / previous_total['count']
+                    change = (mean_wall - previous_mean) / previous_mean * 100 if previous_mean else 0.0
+                    line += f" {change:>+7.0f}%"
+                else:
+                    line += f" {'new':>8}"
+            lines.append(line)
+
+        demo_totals = sorted(self.demo_totals().items(), key=lambda item: item[1]['wall'], reverse=True)
+        if demo_totals:
+            lines.append('')
+            lines.append(f"Slowest demos ({len(demo_totals)} profiled):")
+            for demo_name, total in demo_totals[:slowest]:
+                lines.append(f"  {total['wall']:>8.2f}s wall {total['cpu']:>8.2f}s cpu  {demo_name}")
+        return '\n'.join(lines)
+
+    def write_json(self, path):
+        with open(path, 'w') as trace_file:
+            json.dump({'records': self.records}, trace_file, indent=1)
+        logging.info(f"Wrote profile trace to {path}")
+
+    @classmethod
+    def read_json(cls, path):
+        profiler = cls()
+        with open(path, 'r') as trace_file:
+            profiler.records = json.load(trace_file)['records']
+        return profiler
+
+
+def enable():
+    """
+    Start profiling in this process with a fresh profiler.
+
+    Returns:
+        IngestProfiler: The active profiler.
+    """
+    global _active
+    _active = IngestProfiler()
+    return _active
+
+
+def disable():
+    global _active
+    _active = None
+
+
+def active():
+    """Return the active profiler, or None if profiling is disabled."""
+    return _active
+
+
+@contextmanager
+def stage(stage_name):
+    """Time a stage with the active profiler. Does nothing while profiling is disabled."""
+    if _active is None:
+        yield
+        return
+    with _active.stage(stage_name):
+        yield
+
+
+@contextmanager
+def demo(demo_name):
+    """Attribute the stages inside the block to a demo. Does nothing while profiling is disabled."""
+    if _active is None:
+        yield
+        return
+    with _active.demo(demo_name):
+        yield
@@ -0,0 +1,340 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from database.database import SessionLocal
+from services import crud, mmr_algorithm
+from services.mmr_algorithm import calculate_hltv_ratings_batch, mmr_changes_from_ratings
+
+# Parameters swept by default. BASE_MMR is not swept: it shifts every rating by the same
+# amount and cancels out of every team difference, so it cannot change any metric.
+DEFAULT_SCALES = [10, 15, 20, 25, 30, 40]
+DEFAULT_BONUSES = [0, 2.5, 5, 7.5, 10]
+DEFAULT_CLAMPS = [25, 50, 75, 100]
+
+TEAM_SIZE = 5
+
+# Share of the scored matches, oldest first, the prediction slopes are fitted on. The metrics
+# are computed on the remaining, newer matches only.
+TRAIN_FRACTION = 0.5
+
+# The snapshot each worker process loads once, read only
+_snapshot = None
+
+
+def build_snapshot(db) -> dict:
+    """
+    Load the match and stat tables into arrays, once, for all configurations to replay.
+
+    Stat rows are kept in chronological order with their HLTV 2.0 rating already computed,
+    since it does not depend on the swept parameters, and whether the player is a sniper, for
+    the sniper rule of balance_teams. Team A of a match is the team whose name sorts first.
+
+    Returns:
+        dict: Arrays per stat row, per match, and the stat rows of the 5v5 matches.
+    """
+    rows = crud.stream_match_stats(db).all()
+    if not rows:
+        raise ValueError("No matches to replay.")
+    columns = dict(zip(rows[0]._fields, zip(*rows)))
+    _, ratings, team_results, has_rounds = calculate_hltv_ratings_batch(columns)
+
+    match_ids = np.asarray(columns['match_id'], dtype=np.int64)
+    # Rows come grouped by match in chronological order, number the matches in that order
+    match_index = np.cumsum(np.r_[True, match_ids[1:] != match_ids[:-1]]) - 1
+    match_count = int(match_index[-1]) + 1
+    _, player_index = np.unique(np.asarray(columns['player_id'], dtype=np.int64), return_inverse=True)
+    roles = crud.get_player_roles(db)
+    is_sniper = np.array([roles.get(player_id) == 'sniper' for player_id in columns['player_id']])
+
+    teams = [team.lower() for team in columns['team']]
+    team_a_names = {}
+    for index, team in zip(match_index.tolist(), teams):
+        team_a_names[index] = min(team, team_a_names.get(index, team))
+    side_a = np.array([team == team_a_names[index] for index, team in zip(match_index.tolist(), teams)])
+
+    total_rounds = np.asarray(columns['team1_score'], dtype=np.int64) + np.asarray(columns['team2_score'])
+    side_a_rows = np.flatnonzero(side_a)
+    results = np.full(match_count, np.nan)
+    results[match_index[side_a_rows]] = (team_results[side_a_rows] + 1) / 2
+    round_shares = np.full(match_count, np.nan)
+    round_shares[match_index[side_a_rows]] = (
+        np.asarray(columns['rounds_won'], dtype=float)[side_a_rows] / np.maximum(total_rounds[side_a_rows], 1)
+    )
+
+    counts_a = np.bincount(match_index, weights=side_a, minlength=match_count)
+    counts_b = np.bincount(match_index, weights=~side_a, minlength=match_count)
+    match_rounds = np.zeros(match_count, dtype=np.int64)
+    match_rounds[match_index] = total_rounds
+    valid = (counts_a > 0) & (counts_b > 0) & (match_rounds > 0)
+
+    # Stat rows of the 5v5 matches, team A first, to evaluate the balance_teams split on
+    five_v_five = np.flatnonzero(valid & (counts_a == TEAM_SIZE) & (counts_b == TEAM_SIZE))
+    by_match = np.lexsort((~side_a, match_index))
+    first_row = np.searchsorted(match_index[by_match], five_v_five)
+    five_v_five_rows = by_match[first_row[:, None] + np.arange(2 * TEAM_SIZE)]
+
+    return {
+        'ratings': ratings,
+        'team_results': team_results,
+        'has_rounds': has_rounds,
+        'match_index': match_index,
+        'player_order': np.lexsort((np.arange(len(rows)), player_index)),
+        'player_index': player_index,
+        'side_a': side_a,
+        'is_sniper': is_sniper,
+        'counts_a': counts_a,
+        'counts_b': counts_b,
+        'results': results,
+        'round_shares': round_shares,
+        'valid': valid,
+        'five_v_five_rows': five_v_five_rows,
+    }
+
+
+def _split_signs(team_size: int) -> np.ndarray:
+    """
+    Every split of 2 * team_size players into two teams, as +1 (team A) and -1 (team B) rows.
+    The first player is always in team A, so each split appears once.
+    """
+    players = 2 * team_size
+    splits = [combo for combo in itertools.combinations(range(players), team_size) if 0 in combo]
+    signs = -np.ones((len(splits), players))
+    for row, combo in enumerate(splits):
+        signs[row, list(combo)] = 1
+    return signs
+
+
+def _load_snapshot(path: str):
+    global _snapshot
+    with np.load(path) as snapshot:
+        _snapshot = {name: snapshot[name] for name in snapshot.files}
+    for array in _snapshot.values():
+        array.flags.writeable = False
+    _snapshot['split_signs'] = _split_signs(TEAM_SIZE)
+
+
+def _fit_logistic_slope(x: np.ndarray, y: np.ndarray, iterations: int = 50) -> float:
+    # Newton's method on the log-loss of p = sigmoid(slope * x)
+    slope = 0.0
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(-np.clip(slope * x, -500, 500)))
+        hessian = np.sum(p * (1 - p) * x * x)
+        if hessian <= 0:
+            break
+        step = np.sum((p - y) * x) / hessian
+        slope -= step
+        if abs(step) < 1e-12:
+            break
+    return slope
+
+
+def evaluate(config: dict, snapshot: dict = None, warmup: int = 0, train_fraction: float = TRAIN_FRACTION) -> dict:
+    """
+    Replay the snapshot with one parameter configuration and score it.
+
+    Each match is predicted from the team mean MMR difference before the match. The
+    logistic slope turning differences into win probabilities, and the linear slope turning
+    them into round shares, are fitted per configuration, so configurations on different
+    MMR scales are compared fairly. They are fitted on the first train_fraction of the matches
+    after the warmup, and every metric is computed on the matches after those, so a
+    configuration cannot score well by fitting the matches it is scored on.
+
+    Returns:
+        dict: The configuration with the log-loss, Brier score and accuracy of the win
+            predictions, and the balance error: the expected distance from a 50% round share
+            of the teams balance_teams would pick by these ratings in the 5v5 matches.
+    """
+    snapshot = snapshot or _snapshot
+    changes = mmr_changes_from_ratings(
+        snapshot['ratings'], snapshot['team_results'], snapshot['has_rounds'],
+        config['scale'], config['bonus'], config['clamp'],
+    )
+
+    # MMR of each player before each of their matches: the running sum of their earlier changes
+    order = snapshot['player_order']
+    ordered_changes = changes[order]
+    running = np.cumsum(ordered_changes) - ordered_changes
+    player_starts = np.r_[True, np.diff(snapshot['player_index'][order]) != 0]
+    running -= running[np.flatnonzero(player_starts)][np.cumsum(player_starts) - 1]
+    before = np.empty(len(changes))
+    before[order] = running
+
+    match_index, side_a = snapshot['match_index'], snapshot['side_a']
+    match_count = len(snapshot['results'])
+    sum_a = np.bincount(match_index, weights=before * side_a, minlength=match_count)
+    sum_b = np.bincount(match_index, weights=before * ~side_a, minlength=match_count)
+    differences = np.zeros(match_count)
+    valid = snapshot['valid']
+    differences[valid] = sum_a[valid] / snapshot['counts_a'][valid] - sum_b[valid] / snapshot['counts_b'][valid]
+    share_excesses = snapshot['round_shares'] - 0.5
+
+    # Fit on the older scored matches, score on the newer ones
+    scored_matches = np.flatnonzero(valid)
+    scored_matches = scored_matches[scored_matches >= warmup]
+    train_count = int(len(scored_matches) * train_fraction)
+    train, test = scored_matches[:train_count], scored_matches[train_count:]
+    if not len(train) or not len(test):
+        raise ValueError(
+            f"Not enough matches after the warmup to fit and score: {len(train)} to fit, {len(test)} to score."
+        )
+
+    slope = _fit_logistic_slope(differences[train], snapshot['results'][train])
+    # Round share of team A above 50%, explained linearly by the MMR difference
+    share_slope = (
+        np.dot(differences[train], share_excesses[train]) / max(np.dot(differences[train], differences[train]), 1e-12)
+    )
+
+    difference, results = differences[test], snapshot['results'][test]
+    p = np.clip(1 / (1 + np.exp(-slope * difference)), 1e-15, 1 - 1e-15)
+    decisive = results != 0.5
+    residual_mse = np.mean((share_excesses[test] - share_slope * difference) ** 2)
+
+    # Closest split balance_teams could pick by these ratings, as a team mean MMR difference,
+    # with each team getting a sniper when at least two play
+    five_v_five_rows = snapshot['five_v_five_rows']
+    five_v_five_rows = five_v_five_rows[match_index[five_v_five_rows[:, 0]] >= test[0]]
+    if len(five_v_five_rows):
+        split_signs = snapshot['split_signs']
+        split_diffs = np.abs(before[five_v_five_rows] @ split_signs.T)
+        snipers = snapshot['is_sniper'][five_v_five_rows].astype(float)
+        sniper_counts = snipers.sum(axis=1)[:, None]
+        snipers_team_a = snipers @ (split_signs.T > 0)
+        split_diffs[(sniper_counts >= 2) & ((snipers_team_a < 1) | (snipers_team_a >= sniper_counts))] = np.inf
+        best_split = split_diffs.min(axis=1) / TEAM_SIZE
+        split_mse = np.mean((share_slope * best_split) ** 2)
+    else:
+        split_mse = 0.0
+
+    return {
+        **config,
+        'log_loss': float(-np.mean(results * np.log(p) + (1 - results) * np.log(1 - p))),
+        'brier': float(np.mean((p - results) ** 2)),
+        'accuracy': float(np.mean((p > 0.5)[decisive] == (results[decisive] == 1))) if decisive.any() else None,
+        'balance_error': float(np.sqrt(split_mse + residual_mse)),
+    }
+
+
+def _evaluate_with_warmup(args) -> dict:
+    config, warmup, train_fraction = args
+    return evaluate(config, warmup=warmup, train_fraction=train_fraction)
+
+
+def sweep_configs(scales, bonuses, clamps, random_count: int = None, seed: int = 0) -> list:
+    """
+    The grid over the given parameter values, or random_count configurations drawn uniformly
+    between the smallest and largest value of each parameter.
+    """
+    if random_count is None:
+        return [
+            {'scale': scale, 'bonus': bonus, 'clamp': clamp}
+            for scale, bonus, clamp in itertools.product(scales, bonuses, clamps)
+        ]
+    rng = random.Random(seed)
+    return [
+        {
+            'scale': round(rng.uniform(min(scales), max(scales)), 2),
+            'bonus': round(rng.uniform(min(bonuses), max(bonuses)), 2),
+            'clamp': round(rng.uniform(min(clamps), max(clamps)), 2),
+        }
+        for _ in range(random_count)
+    ]
+
+
+def run_sweep(
+    snapshot: dict, configs: list, workers: int, warmup: int = 0, train_fraction: float = TRAIN_FRACTION
+) -> list:
+    """
+    Evaluate the configurations across a process pool. The snapshot is written to a temporary
+    file once and loaded by each worker when it starts.
+    """
+    snapshot_dir = tempfile.mkdtemp(prefix='cs2-bot-sweep-')
+    try:
+        snapshot_path = os.path.join(snapshot_dir, 'snapshot.npz')
+        np.savez(snapshot_path, **snapshot)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_load_snapshot, initargs=(snapshot_path,)) as pool:
+            chunksize = max(1, len(configs) // (workers * 8))
+            return list(pool.map(_evaluate_with_warmup, [(config, warmup, train_fraction) for config in configs], chunksize=chunksize))
+    finally:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+
+def format_report(results: list, rank_by: str, top: int) -> str:
+    current = {
+        'scale': mmr_algorithm.RATING_SCALE, 'bonus': mmr_algorithm.RESULT_BONUS, 'clamp': mmr_algorithm.MAX_MMR_CHANGE
+    }
+    ranked = sorted(results, key=lambda result: result[rank_by])
+    lines = [f"{'rank':>4} {'scale':>7} {'bonus':>7} {'clamp':>7} {'log-loss':>9} {'brier':>7} {'accuracy':>9} {'balance':>8}"]
+    for rank, result in enumerate(ranked, 1):
+        is_current = all(result[key] == value for key, value in current.items())
+        if rank > top and not is_current:
+            continue
+        accuracy = f"{result['accuracy']:.3f}" if result['accuracy'] is not None else '-'
+        lines.append(
+            f"{rank:>4} {result['scale']:>7} {result['bonus']:>7} {result['clamp']:>7} {result['log_loss']:>9.4f} "
+            f"{result['brier']:>7.4f} {accuracy:>9} {result['balance_error']:>8.4f}" + ('  (current)' if is_current else '')
+        )
+    return '\n'.join(lines)
+
+
+def parse_arguments():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Sweep the MMR constants over the match history and rank them by prediction and balance quality.'
+    )
+    parser.add_argument('--scale', type=float, nargs='+', default=DEFAULT_SCALES, help='Rating scale values')
+    parser.add_argument('--bonus', type=float, nargs='+', default=DEFAULT_BONUSES, help='Win/loss bonus values')
+    parser.add_argument('--clamp', type=float, nargs='+', default=DEFAULT_CLAMPS, help='Maximum MMR change values')
+    parser.add_argument(
+        '--random', type=int, metavar='N',
+        help='Draw N random configurations within the range of each parameter instead of the grid'
+    )
+    parser.add_argument('--seed', type=int, default=0, help='Seed for --random (default: 0)')
+    parser.add_argument(
+        '--warmup', type=int, default=20,
+        help='Number of first matches to replay without scoring, while ratings are still flat (default: 20)'
+    )
+    parser.add_argument(
+        '--train-fraction', type=float, default=TRAIN_FRACTION,
+        help='Share of the matches after the warmup to fit the prediction slopes on, the newer ones '
+             'being scored (default: 0.5)'
+    )
+    parser.add_argument(
+        '--rank-by', choices=['log_loss', 'brier', 'balance_error'], default='log_loss',
+        help='Metric to rank configurations by (default: log_loss)'
+    )
+    parser.add_argument('--top', type=int, default=15, help='Number of configurations to show (default: 15)')
+    parser.add_argument(
+        '-w', '--workers', type=int, default=os.cpu_count(), help='Worker processes (default: CPU count)'
+    )
+    parser.add_argument('-o', '--output', help='Write all results to this JSON file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    args = parse_arguments()
+
+    with SessionLocal() as db:
+        snapshot = build_snapshot(db)
+    configs = sweep_configs(args.scale, args.bonus, args.clamp, random_count=args.random, seed=args.seed)
+
+    start = time.perf_counter()
+    results = run_sweep(
+        snapshot, configs, workers=args.workers, warmup=args.warmup, train_fraction=args.train_fraction
+    )
+    print(f"Evaluated {len(results)} configurations on {int(snapshot['valid'].sum())} matches "
+          f"in {time.perf_counter() - start:.1f}s")
+    print(format_report(results, args.rank_by, args.top))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
@@ -0,0 +1,133 @@
+import argparse
+import json
+import logging
+import time
+import tracemalloc
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from database.database import SessionLocal
+from services import crud
+from services.mmr_algorithm import calculate_mmr_changes_batch
+from services.rating_models import RATING_MODELS
+
+# Probabilities are clipped to this distance from 0 and 1 before taking logarithms
+EPSILON = 1e-15
+
+
+def load_match_outcomes(db: Session) -> list:
+    """
+    Load every match in chronological order as a (match id, team A player ids, team B player
+    ids, result, MMR changes) tuple. The result is 1.0 when team A won, 0.0 when team B won and
+    0.5 for a draw, and MMR changes maps each player to their HLTV-based change.
+    """
+    rows = crud.stream_match_stats(db).all()
+    if not rows:
+        return []
+    columns = dict(zip(rows[0]._fields, zip(*rows)))
+    _, changes = calculate_mmr_changes_batch(columns)
+
+    matches = {}
+    for row, change in zip(rows, changes.tolist()):
+        teams, winner, mmr_changes = matches.setdefault(row.match_id, ({}, row.winner.lower(), {}))
+        teams.setdefault(row.team.lower(), []).append(row.player_id)
+        mmr_changes[row.player_id] = change
+
+    outcomes = []
+    for match_id, (teams, winner, mmr_changes) in matches.items():
+        if len(teams) != 2:
+            logging.warning(f"Skipping match {match_id}: expected two teams, found {sorted(teams)}.")
+            continue
+        (team_a_name, team_a), (_, team_b) = sorted(teams.items())
+        result = 0.5 if winner == 'draw' else float(winner == team_a_name)
+        outcomes.append((match_id, team_a, team_b, result, mmr_changes))
+    return outcomes
+
+
+def backtest(model, outcomes: list, warmup: int = 0) -> dict:
+    """
+    Replay the matches in order with a rating model, predicting each match before rating it.
+    The first warmup matches are rated but not scored.
+
+    Returns:
+        dict: Log-loss and Brier score of the predictions, accuracy on the decisive matches,
+            and the runtime and peak traced memory of the replay.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    ratings = {}
+    predictions = []
+    for _, team_a, team_b, result, mmr_changes in outcomes:
+        predictions.append(model.win_probability(ratings, team_a, team_b))
+        model.update(ratings, team_a, team_b, result, mmr_changes)
+    seconds = time.perf_counter() - start
+    traced_peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    tracemalloc.stop()
+
+    report = score_predictions(predictions[warmup:], [outcome[3] for outcome in outcomes[warmup:]])
+    report.update({'seconds': seconds, 'traced_peak_mb': traced_peak_mb})
+    return report
+
+
+def score_predictions(predictions, results) -> dict:
+    """
+    Score win probabilities of team A against the actual results.
+    """
+    p = np.clip(np.asarray(predictions, dtype=float), EPSILON, 1 - EPSILON)
+    y = np.asarray(results, dtype=float)
+    if not len(p):
+        return {'matches': 0, 'log_loss': None, 'brier': None, 'accuracy': None}
+
+    decisive = y != 0.5
+    # A coin flip prediction counts as half right
+    correct = np.where(p == 0.5, 0.5, (p > 0.5) == (y == 1))[decisive]
+    return {
+        'matches': len(p),
+        'log_loss': float(-np.mean(y * np.log(p) + (1 - y) * np.log(1 - p))),
+        'brier': float(np.mean((p - y) ** 2)),
+        'accuracy': float(np.mean(correct)) if decisive.any() else None,
+    }
+
+
+def format_report(reports: dict) -> str:
+    lines = [f"{'model':<10} {'matches':>8} {'log-loss':>9} {'brier':>7} {'accuracy':>9} {'seconds':>8} {'peak MB':>8}"]
+    for name, report in sorted(reports.items(), key=lambda item: item[1]['log_loss'] or 0):
+        if not report['matches']:
+            lines.append(f"{name:<10} {0:>8}")
+            continue
+        accuracy = f"{report['accuracy']:.3f}" if report['accuracy'] is not None else '-'
+        lines.append(
+            f"{name:<10} {report['matches']:>8} {report['log_loss']:>9.4f} {report['brier']:>7.4f} "
+            f"{accuracy:>9} {report['seconds']:>8.3f} {report['traced_peak_mb']:>8.2f}"
+        )
+    return '\n'.join(lines)
+
+
+def parse_arguments():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Replay the match history with each rating model and score its match outcome predictions.'
+    )
+    parser.add_argument(
+        '-m', '--models', nargs='+', choices=sorted(RATING_MODELS), default=sorted(RATING_MODELS),
+        help='Rating models to backtest (default: all)'
+    )
+    parser.add_argument(
+        '--warmup', type=int, default=0, help='Number of first matches to rate without scoring (default: 0)'
+    )
+    parser.add_argument('-o', '--output', help='Write the results to this JSON file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    args = parse_arguments()
+
+    with SessionLocal() as db:
+        outcomes = load_match_outcomes(db)
+    reports = {name: backtest(RATING_MODELS[name](), outcomes, warmup=args.warmup) for name in args.models}
+    print(format_report(reports))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(reports, output_file, indent=2)
@@ -0,0 +1,190 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+# A kill counts as a trade when the killer dies within this many ticks (5 seconds at 64 tick)
+TRADE_WINDOW_TICKS = 5 * 64
+
+# Fields sampled at the start (freeze end) and end of every round
+ROUND_TICK_FIELDS = ["team_num", "damage_total", "current_equip_value"]
+
+WINNER_TEAM_NUM = {'T': 2, 'CT': 3}
+PLAYING_TEAM_NUMS = (2, 3)
+
+ROUND_STATS_COLUMNS = [
+    'round_number',
+    'steamid',
+    'team_num',
+    'kills',
+    'deaths',
+    'assists',
+    'damage',
+    'equipment_value',
+    'opening_kill',
+    'opening_death',
+    'trade_kill',
+    'traded_death',
+    'clutch_opponents',
+    'clutch_won',
+    'survived',
+    'round_won',
+]
+
+
+def _steamids(column):
+    """Normalize a SteamID column to strings, with None for missing values (e.g. world damage)."""
+    return [None if pd.isna(steamid) else str(steamid) for steamid in column]
+
+
+def _round_start_ticks(round_end_ticks, freeze_end_ticks):
+    """
+    Find the start tick of each round: the last freeze end between the previous
+    round_end and this one, or the tick after the previous round_end if there is none.
+    """
+    start_ticks = []
+    previous_end_tick = 0
+    for end_tick in round_end_ticks:
+        i = np.searchsorted(freeze_end_ticks, end_tick, side='right') - 1
+        if i >= 0 and freeze_end_ticks[i] > previous_end_tick:
+            start_ticks.append(int(freeze_end_ticks[i]))
+        else:
+            start_ticks.append(int(previous_end_tick) + 1)
+        previous_end_tick = end_tick
+    return start_ticks
+
+
+def extract_round_stats(parser, round_end_events):
+    """
+    Extract per-round, per-player stats from a demo.
+
+    Tick data is only sampled at the start and end of each round, and events are
+    processed one round at a time, so memory depends on the number of rounds and
+    players rather than on the length of the demo in ticks.
+
+    Returns:
+        pandas.DataFrame: One row per player per round with the ROUND_STATS_COLUMNS columns.
+    """
+    round_end_events = round_end_events.sort_values('tick')
+    round_end_ticks = round_end_events['tick'].to_numpy()
+    if 'winner' in round_end_events:
+        round_winners = round_end_events['winner'].map(WINNER_TEAM_NUM).tolist()
+    else:
+        round_winners = [None] * len(round_end_ticks)
+
+    freeze_end_events = parser.parse_event("round_freeze_end")
+    freeze_end_ticks = np.sort(freeze_end_events['tick'].to_numpy()) if not freeze_end_events.empty else np.array([])
+    round_start_ticks = _round_start_ticks(round_end_ticks, freeze_end_ticks)
+
+    sampled_ticks = sorted(set(round_start_ticks) | set(int(tick) for tick in round_end_ticks))
+    snapshots = parser.parse_ticks(ROUND_TICK_FIELDS, ticks=sampled_ticks)
+    snapshots['steamid'] = _steamids(snapshots['steamid'])
+    snapshots_by_tick = {tick: frame for tick, frame in snapshots.groupby('tick')}
+
+    deaths = parser.parse_event("player_death")
+    if deaths.empty:
+        deaths = pd.DataFrame(columns=['tick', 'user_steamid', 'attacker_steamid', 'assister_steamid'])
+    deaths = deaths.sort_values('tick')
+    death_rounds = np.searchsorted(round_end_ticks, deaths['tick'].to_numpy(), side='left')
+    deaths_by_round = {round_index: frame for round_index, frame in deaths.groupby(death_rounds)}
+
+    empty_snapshot = snapshots.iloc[0:0]
+    rows = []
+    for round_index, (start_tick, end_tick) in enumerate(zip(round_start_ticks, round_end_ticks)):
+        round_deaths = deaths_by_round.get(round_index, deaths.iloc[0:0])
+        round_deaths = round_deaths[round_deaths['tick'] >= start_tick]
+        rows.extend(_round_rows(
+            round_index + 1,
+            snapshots_by_tick.get(start_tick, empty_snapshot),
+            snapshots_by_tick.get(int(end_tick), empty_snapshot),
+            round_deaths,
+            round_winners[round_index],
+        ))
+
+    logging.info(f"Extracted round stats for {len(round_end_ticks)} rounds.")
+    return pd.DataFrame(rows, columns=ROUND_STATS_COLUMNS)
+
+
+def _round_rows(round_number, start_frame, end_frame, round_deaths, winner_team):
+    """
+    Build the stats rows of a single round from the player snapshots at its start and
+    end and its player_death events.
+    """
+    teams = {}
+    start_damage = {}
+    equipment_values = {}
+    for steamid, team_num, damage, equipment_value in zip(
+        start_frame['steamid'], start_frame['team_num'], start_frame['damage_total'], start_frame['current_equip_value']
+    ):
+        if steamid is not None and team_num in PLAYING_TEAM_NUMS:
+            teams[steamid] = int(team_num)
+            start_damage[steamid] = 0 if pd.isna(damage) else int(damage)
+            equipment_values[steamid] = 0 if pd.isna(equipment_value) else int(equipment_value)
+    end_damage = {
+        steamid: 0 if pd.isna(damage) else int(damage)
+        for steamid, damage in zip(end_frame['steamid'], end_frame['damage_total'])
+    }
+
+    stats = {
+        steamid: {
+            'kills': 0, 'deaths': 0, 'assists': 0,
+            'opening_kill': False, 'opening_death': False,
+            'trade_kill': False, 'traded_death': False,
+        }
+        for steamid in teams
+    }
+    alive = {team_num: {steamid for steamid, team in teams.items() if team == team_num} for team_num in PLAYING_TEAM_NUMS}
+    clutches = {}
+    recent_kills = []
+    opening_done = False
+
+    for tick, victim, attacker, assister in zip(
+        round_deaths['tick'],
+        _steamids(round_deaths['user_steamid']),
+        _steamids(round_deaths['attacker_steamid']),
+        _steamids(round_deaths.get('assister_steamid', pd.Series([None] * len(round_deaths)))),
+    ):
+        if victim not in stats:
+            continue
+        victim_team = teams[victim]
+        stats[victim]['deaths'] += 1
+        alive[victim_team].discard(victim)
+
+        if attacker in stats and teams[attacker] != victim_team:
+            stats[attacker]['kills'] += 1
+            if not opening_done:
+                stats[attacker]['opening_kill'] = True
+                stats[victim]['opening_death'] = True
+                opening_done = True
+            # The victim was traded if they had just killed a teammate of the attacker
+            for kill_tick, killer, killed in recent_kills:
+                if killer == victim and teams[killed] == teams[attacker] and tick - kill_tick <= TRADE_WINDOW_TICKS:
+                    stats[attacker]['trade_kill'] = True
+                    stats[killed]['traded_death'] = True
+            recent_kills.append((tick, attacker, victim))
+
+        if assister in stats and assister != attacker and teams[assister] != victim_team:
+            stats[assister]['assists'] += 1
+
+        for team_num, other_team_num in ((2, 3), (3, 2)):
+            if team_num not in clutches and len(alive[team_num]) == 1 and alive[other_team_num]:
+                clutches[team_num] = (next(iter(alive[team_num])), len(alive[other_team_num]))
+
+    rows = []
+    for steamid, team_num in teams.items():
+        clutcher, clutch_opponents = clutches.get(team_num, (None, 0))
+        is_clutcher = clutcher == steamid
+        round_won = winner_team == team_num
+        rows.append({
+            'round_number': round_number,
+            'steamid': steamid,
+            'team_num': team_num,
+            **stats[steamid],
+            'damage': max(end_damage.get(steamid, start_damage[steamid]) - start_damage[steamid], 0),
+            'equipment_value': equipment_values[steamid],
+            'clutch_opponents': clutch_opponents if is_clutcher else 0,
+            'clutch_won': is_clutcher and round_won,
+            'survived': steamid in alive[team_num],
+            'round_won': round_won,
+        })
+    return rows